@@ -1,18 +1,23 @@
 from itertools import combinations
 import datetime
 import pickle
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
 from scipy.optimize import minimize, brute, basinhopping
 
-from shared_aliens import alien_initial_Q, update_Qs_sim, split_subj_in_half
+from shared_aliens import alien_initial_Q, simulate_aliens, get_action_frequencies, get_action_likelihoods, split_subj_in_half
 from shared_modeling_simulation import get_alien_paths
+from slcn_config import get_config
 from AlienTask import Task
 
 
-run_on_cluster = False
+# Switches for this script (settings given in the config file, environment, or command line take precedence)
+config = get_config()
+run_on_cluster = config.get('run_on_cluster', False)
 n_subj = 5  # 31 in version3.1; 82 in version1.0 and version3.1 combined
 n_sim_per_subj = 2000
 n_TS, n_seasons, n_aliens, n_actions = 3, 3, 4, 3  # 3, 3, 4, 3
@@ -23,6 +28,7 @@ param_scalers = pd.DataFrame.from_dict(
 param_names = np.array(param_scalers.columns.values)
 plot_dir = get_alien_paths(run_on_cluster)["fitting results"]
 n_iter = 500
+n_cores = config.get('n_cores', 1)  # number of processes that evaluate calculate_mse in parallel
 run_brute = False
 run_random = True
 run_same_params = True
@@ -92,39 +98,19 @@ def calculate_mse(parameters, param_scalers, return_MSE=False, make_plot=False):
     else:
         forget_high = forget.flatten().reshape(forget_high_shape)
 
-    sim_corrects = np.zeros([n_trials, n_sim])
-    sim_actions = np.zeros([n_trials, n_sim])
-
     Q_low = alien_initial_Q * np.ones([n_sim, n_TS, n_aliens, n_actions])
     Q_high = alien_initial_Q * np.ones([n_sim, n_seasons, n_TS])
 
-    for trial in range(n_trials):
-
-        # Observe stimuli
-        season, alien = task.present_stimulus(trial)
-
-        # Select action & update Q-values
-        [Q_low, Q_high, TS, action, correct, reward, p_low] =\
-            update_Qs_sim(season, alien,
-                          Q_low, Q_high,
-                          beta, beta_high, alpha, alpha_high, forget, forget_high,
-                          n_sim, n_actions, n_TS, task, verbose=False)
-
-        # Get data for learning curves
-        sim_corrects[trial] = correct
-        sim_actions[trial] = action
-
-    sim_actions_chosen = np.full((n_subj, n_trials, n_actions), np.nan)
-    for subj in range(n_subj):
-        subj_dat = sim_actions[:, range(subj, n_sim, n_subj)]
-        sim_actions_chosen[subj] = np.array([np.sum(subj_dat == a, axis=1) for a in range(n_actions)]).T
+    # Simulate all agents on all trials
+    [_, _, _, _, _, sim_actions, _, sim_corrects, _, _] =\
+        simulate_aliens(task, n_trials,
+                        Q_low, Q_high,
+                        beta, beta_high, alpha, alpha_high, forget, forget_high,
+                        n_sim, n_actions, n_TS)
 
-    # Calculate likelihoods of human actions
-    sim_actions_chosen /= n_sim_per_subj  # normalize -> get % for each action
-    liks = np.full((n_trials, n_subj), np.nan)
-    for subj in range(n_subj):
-        for trial in range(n_trials):
-            liks[trial, subj] = sim_actions_chosen[subj, trial, int(hum_actions[trial, subj])]
+    # Calculate likelihoods of human actions (% of each subject's simulations that chose the human's action)
+    sim_actions_chosen = get_action_frequencies(sim_actions, n_subj, n_actions)
+    liks = get_action_likelihoods(sim_actions_chosen, hum_actions)
 
     liks[missed_trials] = 1/3
     liks[liks == 0] = 0.001
@@ -173,171 +159,195 @@ def calculate_mse(parameters, param_scalers, return_MSE=False, make_plot=False):
         return np.mean(log_lik[-1])
 
 
+def evaluate_params(params, param_scalers, seed):
+
+    # Each evaluation gets its own seed, such that parallel workers do not simulate identical agents
+    np.random.seed(seed)
+    return calculate_mse(params, param_scalers)
+
+
+def run_search(all_params, param_scalers, file_name):
+
+    # Evaluate calculate_mse for each row of all_params (n_cores processes; each worker has its own copy of the task and
+    # human data) and append each result to file_name as soon as it is finished, such that crashes keep partial results
+    seeds = np.random.randint(2 ** 31, size=len(all_params))
+    colnames = np.append(param_names, ['MSE'])
+    if os.path.isfile(file_name):
+        os.remove(file_name)
+
+    def save_result(iter, MSE):
+        rescaled = param_scalers.loc[0] + param_scalers.loc[1] * pd.Series(all_params[iter], index=param_names)
+        result = pd.DataFrame([np.append(rescaled[param_names], [MSE])], columns=colnames, index=[iter])
+        result.to_csv(file_name, mode='a', header=not os.path.isfile(file_name))
+
+    if n_cores == 1:
+        for iter, (params, seed) in enumerate(zip(all_params, seeds)):
+            save_result(iter, evaluate_params(params, param_scalers, seed))
+    else:
+        with ProcessPoolExecutor(max_workers=n_cores) as executor:
+            futures = {executor.submit(evaluate_params, params, param_scalers, seed): iter
+                       for iter, (params, seed) in enumerate(zip(all_params, seeds))}
+            for future in as_completed(futures):
+                save_result(futures[future], future.result())
+
+    return pd.read_csv(file_name, index_col=0).sort_index()
+
+
 # NLL = calculate_mse((0.2, 0.2, 0.05), param_scalers, return_MSE=False, make_plot=True)
 # plt.show()
 
 
-if run_brute:
-    # Minimize function using grid search
-    print("Starting brute with {} iterations!".format(n_iter))
-    # Needs >= 3 param_names; speed up for debugging: set n_subj=2 and n_sim_per_subj=2
-    brute_results = brute(func=calculate_mse,
-                          ranges=([(0, 1) for param in param_names]),
-                          args=([param_scalers]),
-                          Ns=n_iter,
-                          full_output=True,
-                          finish=None,
-                          disp=True)
+# Run the search only in the main process (worker processes import this script to get task and human data)
+if __name__ == '__main__':
 
-    print('Saving brute_results to {0}/{1}.\n'.format(plot_dir, save_id))
-    with open(plot_dir + '/' + save_id + '.pickle', 'wb') as handle:
-        pickle.dump(brute_results, handle, protocol=pickle.HIGHEST_PROTOCOL)
+    if run_brute:
+        # Minimize function using grid search
+        print("Starting brute with {} iterations!".format(n_iter))
+        # Needs >= 3 param_names; speed up for debugging: set n_subj=2 and n_sim_per_subj=2
+        brute_results = brute(func=calculate_mse,
+                              ranges=([(0, 1) for param in param_names]),
+                              args=([param_scalers]),
+                              Ns=n_iter,
+                              full_output=True,
+                              finish=None,
+                              disp=True,
+                              workers=n_cores)
 
-# # Plot relationship between MSE and NLL
-# plt.figure()
-# plt.plot()
+        print('Saving brute_results to {0}/{1}.\n'.format(plot_dir, save_id))
+        with open(plot_dir + '/' + save_id + '.pickle', 'wb') as handle:
+            pickle.dump(brute_results, handle, protocol=pickle.HIGHEST_PROTOCOL)
 
-elif run_random:
+    # # Plot relationship between MSE and NLL
+    # plt.figure()
+    # plt.plot()
 
-    # Minimize function using random search
-    print("Starting random search with {} iterations!".format(n_iter))
+    elif run_random:
 
-    random_results = pd.DataFrame(columns=np.append(param_names, ['MSE']), index=range(n_iter))
-    for iter in range(n_iter):
-        params = np.random.rand(len(param_names))
-        MSE = calculate_mse(params, param_scalers)
-        random_results.loc[iter] = np.append(params, [MSE])
+        # Minimize function using random search
+        print("Starting random search with {} iterations!".format(n_iter))
+        print('Saving random_results to {0}/{1}.\n'.format(plot_dir, save_id))
+        random_results = run_search(np.random.rand(n_iter, len(param_names)), param_scalers,
+                                    plot_dir + save_id + 'random.csv')
 
-    print('Saving random_results to {0}/{1}.\n'.format(plot_dir, save_id))
-    param_scalers['MSE'] = [0, 1]
-    random_results = param_scalers.loc[0] + param_scalers.loc[1] * random_results
-    random_results.to_csv(plot_dir + save_id + 'random.csv')
+    elif run_same_params:
 
-elif run_same_params:
+        print("Testing consistency!")
 
-    print("Testing consistency!")
-
-    param_scalers.loc[0] = 0
-    param_scalers.loc[1] = 1
-    consist_results = pd.DataFrame(columns=np.append(param_names, ['MSE']), index=range(n_iter))
-    for iter in range(n_iter):
+        param_scalers.loc[0] = 0
+        param_scalers.loc[1] = 1
         params = np.array([0.749080, 1.144666, 0.155407, 0.181850, 5.433470, 0.195208])
-        MSE = calculate_mse(params, param_scalers)
-        consist_results.loc[iter] = np.append(params, [MSE])
-
-    print('Saving consist_results to {0}/{1}.\n'.format(plot_dir, save_id))
-    param_scalers['MSE'] = [0, 1]
-    consist_results = param_scalers.loc[0] + param_scalers.loc[1] * consist_results
-    consist_results.to_csv(plot_dir + save_id + 'consist.csv')
-
-
-else:
-    with open(pickle_path + ".pickle", 'rb') as handle:
-        brute_results = pickle.load(handle)
-
-# Plot learning curve at minimum
-if not run_on_cluster and run_brute:
-    plt.figure()
-    calculate_mse(brute_results[0], param_scalers, make_plot=True)
-    save_dir = plot_dir + '/MSE_{}.png'.format(save_id)
-    plt.savefig(save_dir)
-    print("Saving figure to {}".format(save_dir))
-
-    # Plot heatmap for the whole space
-    combos = list(combinations(param_names, 2))
-    n = len(param_names) - 1
-    tril_pos = np.tril((np.arange(n ** 2) + 1).reshape(n, -1)).T.ravel()
-    positions = tril_pos[tril_pos != 0]
-
-    # Find the 10 best parameter sets
-    tenth_best = sorted(brute_results[3].flatten())[15]
-    ten_best = np.argwhere(brute_results[3] < tenth_best) / brute_results[3].shape[0]
-    ten_best = pd.DataFrame(ten_best, columns=param_names)
-    ten_best_rescaled = param_scalers.loc[0] + param_scalers.loc[1] * ten_best
-    pd.DataFrame(ten_best_rescaled).to_csv(plot_dir + '/ten_best_{}.csv'.format(save_id))
-
-    plt.figure()
-    for (xname, yname), pos in zip(combos, positions):
-
-        # Specify subplot
-        ax = plt.subplot(n, n, pos)
-
-        # Find index for the two parameters
-        xi = int(np.argwhere(param_names == xname))  # param_names.index(xname)
-        yi = int(np.argwhere(param_names == yname))  # param_names.index(yname)
-
-        # get the meshgrids for x and y
-        X = brute_results[2][xi]
-        Y = brute_results[2][yi]
-
-        # Find other axes to collapse
-        axes = tuple([ii for ii in range(brute_results[3].ndim) if ii not in (xi, yi)])
-
-        # Collapse to minimum Jout
-        min_jout = np.amin(brute_results[3], axis=axes)
-        min_xgrid = np.amin(X, axis=axes)
-        min_ygrid = np.amin(Y, axis=axes)
-
-        # Create heatmap
-        ax.pcolormesh(min_xgrid, min_ygrid, min_jout)
-
-        # Add minima
-        ax.scatter(ten_best[xname] + 0.03, ten_best[yname] + 0.03, marker='*', s=20, color='red')  # star 10 smallest
-        plt.text(0.5, 0.5, 'MSE <= {}'.format(tenth_best.round(4)), color='red',
-                 horizontalalignment='center', verticalalignment='center')
-
-        # Add labels to edge only
-        if pos >= n ** 2 - n:
-            plt.xlabel(xname)
-        if pos % n == 1:
-            plt.ylabel(yname)
-
-    plt.tight_layout()
-    plt.savefig(plot_dir + '/heatmap_{}.png'.format(save_id))
-
-# # Minimizer options
-# from basinhopping_specifics import MyBounds, MyTakeStep
-# nelder_mead_options = {
-#     'maxfev': 50,
-#     'xatol': 0.01,
-#     'fatol': 0.01
-# }
-#
-# print("Starting basinhopping!")
-# # Can be sped up by just fitting one parameter; needs a good number of n_subj and n_sim_per_subj to work properly
-# bounds = MyBounds(xmax=np.ones(len(param_names)), xmin=np.zeros(len(param_names)))
-# takestep = MyTakeStep(stepsize=0.5)
-# hoppin_results = basinhopping(func=calculate_mse,
-#                               x0=.5 * np.ones(len(param_names)),
-#                               niter=n_iter,
-#                               # T: The “temperature” parameter for the accept or reject criterion. Higher “temperatures” mean that larger jumps in function value will be accepted. For best results T should be comparable to the separation (in function value) between local minima.
-#                               T=0.01,
-#                               minimizer_kwargs={'method': 'Nelder-Mead',
-#                                                 'args': param_scalers,
-#                                                 'options': nelder_mead_options
-#                                                 },
-#                               take_step=takestep,
-#                               accept_test=bounds,
-#                               disp=True)
-# hoppin_fit_par, hoppin_MSE = [hoppin_results.x, hoppin_results.fun]
-# print("Found minimum {0} with MSE {1} through basinhopping!".format(hoppin_fit_par.round(2), hoppin_MSE.round(4)))
-# calculate_mse(hoppin_fit_par, param_scalers, make_plot=True)
-
-# print("Starting minimize!")
-# # Needs many n_subj and n_sim_per_subj to be able to find a minimum; n_iter needs to be >= 2
-# all_minimize_res = np.full((n_iter, len(param_names)+1), np.nan)
-# for i in range(n_iter):
-#     print("minimize iteration {}".format(i))
-#     random_start_values = np.random.rand(len(param_names))
-#     minimize_res = minimize(fun=calculate_mse,
-#                             x0=random_start_values,
-#                             args=param_scalers,
-#                             tol=0.01,
-#                             method='Nelder-Mead',
-#                             options=nelder_mead_options)
-#     all_minimize_res[i] = np.concatenate([[calculate_mse(minimize_res.x, param_names)], minimize_res.x])
-#
-# minimize_results = all_minimize_res[all_minimize_res[:, 0] == np.min(all_minimize_res[:, 0])].flatten()
-# calculate_mse(minimize_results[1:], param_scalers, make_plot=True)
-# print("Found minimum {0} with MSE {1} through minimize!".
-#       format(minimize_results[1:].round(3), minimize_results[0].round(4)))
+        print('Saving consist_results to {0}/{1}.\n'.format(plot_dir, save_id))
+        consist_results = run_search(np.tile(params, (n_iter, 1)), param_scalers,
+                                     plot_dir + save_id + 'consist.csv')
+
+
+    else:
+        with open(pickle_path + ".pickle", 'rb') as handle:
+            brute_results = pickle.load(handle)
+
+    # Plot learning curve at minimum
+    if not run_on_cluster and run_brute:
+        plt.figure()
+        calculate_mse(brute_results[0], param_scalers, make_plot=True)
+        save_dir = plot_dir + '/MSE_{}.png'.format(save_id)
+        plt.savefig(save_dir)
+        print("Saving figure to {}".format(save_dir))
+
+        # Plot heatmap for the whole space
+        combos = list(combinations(param_names, 2))
+        n = len(param_names) - 1
+        tril_pos = np.tril((np.arange(n ** 2) + 1).reshape(n, -1)).T.ravel()
+        positions = tril_pos[tril_pos != 0]
+
+        # Find the 10 best parameter sets
+        tenth_best = sorted(brute_results[3].flatten())[15]
+        ten_best = np.argwhere(brute_results[3] < tenth_best) / brute_results[3].shape[0]
+        ten_best = pd.DataFrame(ten_best, columns=param_names)
+        ten_best_rescaled = param_scalers.loc[0] + param_scalers.loc[1] * ten_best
+        pd.DataFrame(ten_best_rescaled).to_csv(plot_dir + '/ten_best_{}.csv'.format(save_id))
+
+        plt.figure()
+        for (xname, yname), pos in zip(combos, positions):
+
+            # Specify subplot
+            ax = plt.subplot(n, n, pos)
+
+            # Find index for the two parameters
+            xi = int(np.argwhere(param_names == xname))  # param_names.index(xname)
+            yi = int(np.argwhere(param_names == yname))  # param_names.index(yname)
+
+            # get the meshgrids for x and y
+            X = brute_results[2][xi]
+            Y = brute_results[2][yi]
+
+            # Find other axes to collapse
+            axes = tuple([ii for ii in range(brute_results[3].ndim) if ii not in (xi, yi)])
+
+            # Collapse to minimum Jout
+            min_jout = np.amin(brute_results[3], axis=axes)
+            min_xgrid = np.amin(X, axis=axes)
+            min_ygrid = np.amin(Y, axis=axes)
+
+            # Create heatmap
+            ax.pcolormesh(min_xgrid, min_ygrid, min_jout)
+
+            # Add minima
+            ax.scatter(ten_best[xname] + 0.03, ten_best[yname] + 0.03, marker='*', s=20, color='red')  # star 10 smallest
+            plt.text(0.5, 0.5, 'MSE <= {}'.format(tenth_best.round(4)), color='red',
+                     horizontalalignment='center', verticalalignment='center')
+
+            # Add labels to edge only
+            if pos >= n ** 2 - n:
+                plt.xlabel(xname)
+            if pos % n == 1:
+                plt.ylabel(yname)
+
+        plt.tight_layout()
+        plt.savefig(plot_dir + '/heatmap_{}.png'.format(save_id))
+
+    # # Minimizer options
+    # from basinhopping_specifics import MyBounds, MyTakeStep
+    # nelder_mead_options = {
+    #     'maxfev': 50,
+    #     'xatol': 0.01,
+    #     'fatol': 0.01
+    # }
+    #
+    # print("Starting basinhopping!")
+    # # Can be sped up by just fitting one parameter; needs a good number of n_subj and n_sim_per_subj to work properly
+    # bounds = MyBounds(xmax=np.ones(len(param_names)), xmin=np.zeros(len(param_names)))
+    # takestep = MyTakeStep(stepsize=0.5)
+    # hoppin_results = basinhopping(func=calculate_mse,
+    #                               x0=.5 * np.ones(len(param_names)),
+    #                               niter=n_iter,
+    #                               # T: The “temperature” parameter for the accept or reject criterion. Higher “temperatures” mean that larger jumps in function value will be accepted. For best results T should be comparable to the separation (in function value) between local minima.
+    #                               T=0.01,
+    #                               minimizer_kwargs={'method': 'Nelder-Mead',
+    #                                                 'args': param_scalers,
+    #                                                 'options': nelder_mead_options
+    #                                                 },
+    #                               take_step=takestep,
+    #                               accept_test=bounds,
+    #                               disp=True)
+    # hoppin_fit_par, hoppin_MSE = [hoppin_results.x, hoppin_results.fun]
+    # print("Found minimum {0} with MSE {1} through basinhopping!".format(hoppin_fit_par.round(2), hoppin_MSE.round(4)))
+    # calculate_mse(hoppin_fit_par, param_scalers, make_plot=True)
+
+    # print("Starting minimize!")
+    # # Needs many n_subj and n_sim_per_subj to be able to find a minimum; n_iter needs to be >= 2
+    # all_minimize_res = np.full((n_iter, len(param_names)+1), np.nan)
+    # for i in range(n_iter):
+    #     print("minimize iteration {}".format(i))
+    #     random_start_values = np.random.rand(len(param_names))
+    #     minimize_res = minimize(fun=calculate_mse,
+    #                             x0=random_start_values,
+    #                             args=param_scalers,
+    #                             tol=0.01,
+    #                             method='Nelder-Mead',
+    #                             options=nelder_mead_options)
+    #     all_minimize_res[i] = np.concatenate([[calculate_mse(minimize_res.x, param_names)], minimize_res.x])
+    #
+    # minimize_results = all_minimize_res[all_minimize_res[:, 0] == np.min(all_minimize_res[:, 0])].flatten()
+    # calculate_mse(minimize_results[1:], param_scalers, make_plot=True)
+    # print("Found minimum {0} with MSE {1} through minimize!".
+    #       format(minimize_results[1:].round(3), minimize_results[0].round(4)))
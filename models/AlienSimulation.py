@@ -1,15 +1,18 @@
-import pickle
 import os
 
 import pandas as pd
 import numpy as np
 
 from shared_modeling_simulation import get_alien_paths
-from shared_aliens import alien_initial_Q, update_Qs_sim
+from slcn_config import get_config
+from trace_reader import open_trace, summarize
+from shared_aliens import alien_initial_Q, simulate_aliens
 from AlienTask import Task
 
 
-# Switches for this script
+# Switches for this script (settings given in the config file, environment, or command line take precedence)
+config = get_config()
+run_on_cluster = config.get('run_on_cluster', False)
 model_name = "soft"
 verbose = False
 n_subj = 31
@@ -20,13 +23,13 @@ fake_data = False
 model_to_be_simulated = "specify"  # "MSE"  # "MCMC" "specify"
 # model_name = "/AliensMSEFitting/18-10-14/f_['alpha' 'beta' 'forget']_[[ 1 10  1]]_2018_10_14_9_47"  # 'Aliens/max_abf_2018_10_10_18_7_humans_n_samples10'  #
 # Get save path
-save_dir = get_alien_paths(False)['simulations']
+save_dir = get_alien_paths(run_on_cluster)['simulations']
 if not os.path.exists(save_dir):
     os.makedirs(save_dir)
 
 # Get parameters
 parameters = pd.DataFrame(columns=np.append(param_names, ['sID']))
-parameter_dir = get_alien_paths(run_on_cluster=False)['fitting results']
+parameter_dir = get_alien_paths(run_on_cluster)['fitting results']
 
 if model_to_be_simulated == 'specify':
 
@@ -58,12 +61,7 @@ elif model_to_be_simulated == 'MSE':
 elif model_to_be_simulated == 'MCMC':
 
     print('Loading {0}{1}.\n'.format(parameter_dir, model_name))
-    with open(parameter_dir + model_name + '.pickle', 'rb') as handle:
-        data = pickle.load(handle)
-        model_summary = data['summary']
-        model = data['model']
-
-    model_summary = pd.read_csv(parameter_dir + model_name + '_summary.csv', index_col=0)
+    model_summary = summarize(open_trace(parameter_dir + model_name), param_names)
     for param_name in param_names:
         param_idx = [idx for idx in model_summary.index if param_name + '__' in idx]
         parameters[param_name] = model_summary.loc[param_idx[:n_subj], 'mean'].values
@@ -90,21 +88,10 @@ n_season_repetitions = np.array([3, 2, 2])  # InitialLearning, Refresher2, Refre
 
 # Initialize task
 task = Task(n_subj)
-n_trials, _, _ = task.get_trial_sequence("C:/Users/maria/MEGAsync/Berkeley/TaskSets/Data/version3.1/",
+n_trials, _, _ = task.get_trial_sequence(get_alien_paths(run_on_cluster)['task sequences'],
                                          n_subj, n_sim_per_subj, range(n_subj), fake_data)
 print("n_trials", n_trials)
 
-# For saving data
-seasons = np.zeros([n_trials, n_sim], dtype=int)
-TSs = np.zeros([n_trials, n_sim], dtype=int)
-aliens = np.zeros([n_trials, n_sim], dtype=int)
-actions = np.zeros([n_trials, n_sim], dtype=int)
-rewards = np.zeros([n_trials, n_sim])
-corrects = np.zeros([n_trials, n_sim])
-p_lows = np.zeros([n_trials, n_sim, n_actions])
-# Q_lows = np.zeros([n_trials, n_sim, n_TS, n_aliens, n_actions])
-Q_highs = np.zeros([n_trials, n_sim])
-
 print('Simulating {0} {2} agents on {1} trials.\n'.format(n_sim, n_trials, model_name))
 
 Q_low = alien_initial_Q * np.ones([n_sim, n_TS, n_aliens, n_actions])
@@ -118,34 +105,12 @@ alpha_high = parameters['alpha_high'].values
 beta_high = parameters['beta_high'].values.reshape(beta_high_shape)
 forget_high = parameters['forget_high'].values.reshape(forget_high_shape)
 
-for trial in range(np.sum(n_trials)):
-
-    # Observe stimuli
-    season, alien = task.present_stimulus(trial)
-
-    # Print info
-    if verbose:
-        print("\n\tTRIAL {0}".format(trial))
-        print("season:", season)
-        print("alien:", alien)
-
-    # Update Q-values
-    [Q_low, Q_high, TS, action, correct, reward, p_low] =\
-        update_Qs_sim(season, alien,
-                           Q_low, Q_high,
-                           beta, beta_high, alpha, alpha_high, forget, forget_high,
-                           n_sim, n_actions, n_TS, task, verbose=verbose)
-
-    # Store trial data
-    seasons[trial] = season
-    TSs[trial] = TS
-    aliens[trial] = alien
-    actions[trial] = action
-    rewards[trial] = reward
-    corrects[trial] = correct
-    # Q_lows[trial] = Q_low
-    Q_highs[trial] = Q_high[np.arange(n_sim), season, TS]
-    p_lows[trial] = p_low
+# Simulate all agents on all trials
+[Q_low, Q_high, seasons, TSs, aliens, actions, rewards, corrects, p_lows, Q_highs] =\
+    simulate_aliens(task, np.sum(n_trials),
+                    Q_low, Q_high,
+                    beta, beta_high, alpha, alpha_high, forget, forget_high,
+                    n_sim, n_actions, n_TS, verbose=verbose)
 
 # Save data
 for sID in range(n_sim):
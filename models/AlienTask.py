@@ -3,6 +3,7 @@ import pandas as pd
 import glob
 import os
 import re
+from data_cache import read_csv_columns, split_by_file
 
 
 class Task(object):
@@ -42,29 +43,22 @@ class Task(object):
         '''
 
         filenames = glob.glob(os.path.join(file_path, '*.csv'))
-        n_trials = 100000
-        for filename in np.array(filenames)[subset_of_subj][:n_subj]:
-            agent_data = pd.read_csv(filename)
-
-            # Remove all rows that do not contain 1InitialLearning data (-> jsPysch format)
-            TS_names = [str(TS) for TS in range(3)]
-            agent_data = agent_data.loc[(agent_data['TS'].isin(TS_names)) &
-                                        (agent_data['phase'].isin(phases))]
-
-            # Read out sequence of seasons and aliens
-            try:
-                seasons = np.hstack([seasons, agent_data["TS"]])
-                aliens = np.hstack([aliens, agent_data["sad_alien"]])
-                phase = np.hstack([phase, agent_data["phase"]])
-                correct = np.hstack([correct, agent_data["correct"]])
-                actions = np.hstack([actions, agent_data["item_chosen"]])
-            except NameError:
-                seasons = agent_data["TS"]
-                aliens = agent_data["sad_alien"]
-                phase = agent_data["phase"]
-                correct = agent_data["correct"]
-                actions = agent_data["item_chosen"]
-            n_trials = np.min([n_trials, agent_data.shape[0]])
+        filenames = list(np.array(filenames)[subset_of_subj][:n_subj])
+        data, files = read_csv_columns(filenames, ['TS', 'sad_alien', 'phase', 'correct', 'item_chosen'])
+
+        # Remove all rows that do not contain 1InitialLearning data (-> jsPysch format)
+        TS_names = [str(TS) for TS in range(3)]
+        data = data.loc[(data['TS'].isin(TS_names)) &
+                        (data['phase'].isin(phases))]
+
+        # Read out sequence of seasons and aliens (all files at once)
+        seasons = data["TS"].values
+        aliens = data["sad_alien"].values
+        correct = data["correct"].values
+        actions = data["item_chosen"].values
+        file_starts = split_by_file(data, len(filenames))
+        n_trials = np.min(np.append(np.diff(file_starts), 100000))
+        agent_data = data.iloc[file_starts[-2]:file_starts[-1]]  # last file
 
         # Bring into right shape
         seasons = np.tile(seasons, n_sim_per_subj)
@@ -1,3 +1,4 @@
+import compile_cache  # sets Theano's compile directory (setting compile_dir); has to come before theano
 import pymc3 as pm
 import theano
 import theano.tensor as T
@@ -10,10 +11,13 @@ import pandas as pd
 from AlienTask import Task
 from shared_aliens import alien_initial_Q, update_Qs, update_Qs_th_sim
 from modeling_helpers import load_aliens_data, get_save_dir_and_save_id, plot_gen_rec
+from shared_modeling_simulation import get_alien_paths
+from slcn_config import get_config
 
-# Switches for this script
+# Switches for this script (settings given in the config file, environment, or command line take precedence)
+config = get_config()
 verbose = False
-run_on_cluster = False
+run_on_cluster = config.get('run_on_cluster', False)
 print_logps = False
 file_name_suff = 'f_mse_MAP'
 param_names = ['alpha', 'beta', 'forget', 'alpha_high', 'beta_high', 'forget_high']
@@ -28,15 +32,15 @@ max_n_subj = 31  # set > 31 to include all subjects
 n_sim_per_subj = 2
 max_n_trials = 440  # 440 / 960
 if run_on_cluster:
-    n_cores = 4
-    n_chains = 2
-    n_samples = 100
-    n_tune = 100
+    n_cores = config.get('n_cores', 4)
+    n_chains = config.get('n_chains', 2)
+    n_samples = config.get('n_samples', 100)
+    n_tune = config.get('n_tune', 100)
 else:
-    n_cores = 1
-    n_samples = 100
-    n_tune = 20
-    n_chains = n_cores
+    n_cores = config.get('n_cores', 1)
+    n_samples = config.get('n_samples', 100)
+    n_tune = config.get('n_tune', 20)
+    n_chains = config.get('n_chains', n_cores)
 
 def_TS = np.array([[[1, 6, 1],  # alien0, items0-2
                     [1, 1, 4],  # alien1, items0-2
@@ -62,7 +66,7 @@ else:
                          verbose)
 
     task = Task(n_subj)
-    _, hum_corrects = task.get_trial_sequence("C:/Users/maria/MEGAsync/Berkeley/TaskSets/Data/version3.1/", n_subj, 1)
+    _, hum_corrects = task.get_trial_sequence(get_alien_paths(run_on_cluster)['task sequences'], n_subj, 1)
     hum_corrects = theano.shared(hum_corrects[:n_trials])
 
 if 'fs' in file_name_suff:
@@ -1,14 +1,16 @@
+import compile_cache  # sets Theano's compile directory (setting compile_dir); has to come before theano
 import pymc3 as pm
-import theano
-import theano.tensor as T
 import numpy as np
 import matplotlib.pyplot as plt
 import seaborn as sns
-import pickle
 import pandas as pd
 
-from shared_aliens import alien_initial_Q, update_Qs
+from chunked_trace import sample_chunked
+from convergence import ConvergenceCheck
+from model_factory import get_model, get_step, set_data
 from modeling_helpers import load_aliens_data, get_save_dir_and_save_id, plot_gen_rec
+from slcn_config import get_config
+from trace_reader import save_fit
 
 # TODO
 # backend = pymc3.backends.sqlite.SQLite('aliens_trace')
@@ -25,13 +27,16 @@ from modeling_helpers import load_aliens_data, get_save_dir_and_save_id, plot_ge
 # figure out theano.config.floatX==float32 (http://deeplearning.net/software/theano/library/config.html)
 # debug theano: http://deeplearning.net/software/theano/cifarSC2011/advanced_theano.html#debugging
 
-# Switches for this script
+# Switches for this script (settings given in the config file, environment, or command line take precedence)
+config = get_config()
 verbose = False
-run_on_cluster = False
+run_on_cluster = config.get('run_on_cluster', False)
 print_logps = False
 file_name_suff = 'f_abf'
 param_names = ['alpha', 'beta', 'forget', 'alpha_high', 'beta_high', 'forget_high']  # Don't change
 use_fake_data = False
+flat_fast_path = False  # flat agent (TS = season) with Q-values from get_flat_Q_low_sub instead of theano.scan
+marginalize_TS = False  # likelihood marginalized over TSs (update_Qs_marg; deterministic) instead of sampling a TS
 
 # Which data should be fitted?
 fitted_data_name = 'humans'  # 'humans', 'simulations'
@@ -41,15 +46,19 @@ n_seasons, n_TS, n_aliens, n_actions = 3, 3, 4, 3
 max_n_subj = 31  # set > 31 to include all subjects
 max_n_trials = 440  # 440 / 960
 if run_on_cluster:
-    n_cores = 4
-    n_chains = 2
-    n_samples = 100
-    n_tune = 100
+    n_cores = config.get('n_cores', 4)
+    n_chains = config.get('n_chains', 2)
+    n_samples = config.get('n_samples', 100)
+    n_tune = config.get('n_tune', 100)
 else:
-    n_cores = 1
-    n_samples = 10
-    n_tune = 5
-    n_chains = n_cores
+    n_cores = config.get('n_cores', 1)
+    n_samples = config.get('n_samples', 10)
+    n_tune = config.get('n_tune', 5)
+    n_chains = config.get('n_chains', n_cores)
+trace_dir = config.get('trace_dir')  # stream draws to this folder while sampling (see chunked_trace.py); rerun to continue
+stop_when_converged = False  # stop before n_samples once split-R-hat <= max_rhat and bulk / tail ESS >= min_ess
+max_rhat = 1.01
+min_ess = 400
 
 if use_fake_data:
     n_subj, n_trials = 2, 5
@@ -77,78 +86,21 @@ else:
 if 'fs' in file_name_suff:
     seasons = np.zeros(seasons.shape, dtype=int)
 
-trials, subj = np.meshgrid(range(n_trials), range(n_subj))
-trials = T.as_tensor_variable(trials.T)
-subj = T.as_tensor_variable(subj.T)
-
-# Convert data to tensor variables
-seasons = theano.shared(np.asarray(seasons, dtype='int32'))
-aliens = theano.shared(np.asarray(aliens, dtype='int32'))
-actions = theano.shared(np.asarray(actions, dtype='int32'))
-rewards = theano.shared(np.asarray(rewards, dtype='int32'))
-
 # Get save directory and identifier
 save_dir, save_id = get_save_dir_and_save_id(run_on_cluster, file_name_suff, fitted_data_name, n_samples)
+if stop_when_converged and not trace_dir:
+    trace_dir = save_dir + save_id + '_trace'  # ConvergenceCheck reads the draws from there
 
 # Fit models
 print("Compiling model: {4} {0}, {1} samples, {2} tuning steps, {3} trials\n".
       format(fitted_data_name, n_samples, n_tune, max_n_trials, max_n_subj))
 
-with pm.Model() as model:
-
-    # RL parameters: softmax temperature beta; learning rate alpha; forgetting of Q-values
-    beta_shape = (n_subj, 1)  # Q_sub.shape inside scan -> [n_subj, n_actions]
-    forget_shape = (n_subj, 1, 1, 1)  # Q_low.shape inside scan -> [n_subj, n_TS, n_aliens, n_actions]
-    beta_high_shape = (n_subj, 1)  # Q_high_sub.shape inside scan -> [n_subj, n_TS]
-    forget_high_shape = (n_subj, 1, 1)  # Q_high.shape inside scan -> [n_subj, n_seasons, n_TS]
-
-    alpha_mu = pm.HalfNormal('alpha_mu', sd=0.1)
-    alpha_sd = pm.HalfNormal('alpha_sd', sd=0.1)
-    beta_mu = pm.Bound(pm.Normal, lower=0)('beta_mu', mu=1, sd=2)
-    beta_sd = pm.HalfNormal('beta_sd', sd=1)
-    forget_mu = pm.HalfNormal('forget_mu', sd=0.05)
-    forget_sd = pm.HalfNormal('forget_sd', sd=0.05)
-
-    # alpha_high_mu = pm.HalfNormal('alpha_high_mu', sd=0.1)
-    # alpha_high_sd = pm.HalfNormal('alpha_high_sd', sd=0.1)
-    # beta_high_mu = pm.Bound(pm.Normal, lower=0)('beta_high_mu', mu=1, sd=2)
-    # beta_high_sd = pm.HalfNormal('beta_high_sd', sd=1)
-    # forget_high_mu = pm.HalfNormal('forget_high_mu', sd=0.05)
-    # forget_high_sd = pm.HalfNormal('forget_high_sd', sd=0.05)
-
-    alpha = pm.Beta('alpha', mu=alpha_mu, sd=alpha_sd, shape=n_subj)
-    beta = pm.Bound(pm.Normal, lower=0)('beta', mu=beta_mu, sd=beta_sd, shape=beta_shape)
-    forget = pm.Beta('forget', mu=forget_mu, sd=forget_sd, shape=forget_shape)
-    # alpha = pm.HalfNormal('alpha', sd=0.1, shape=n_subj)
-    # beta = pm.Bound(pm.Normal, lower=0)('beta', mu=1, sd=2, shape=beta_shape)
-    # forget = pm.HalfNormal('forget', sd=0.05, shape=forget_shape)
-
-    # alpha_high = pm.Deterministic('alpha_high', alpha.copy())
-    # beta_high = pm.Deterministic('beta_high', beta.flatten().reshape(beta_shape))
-    # forget_high = pm.Deterministic('forget_high', forget.flatten().reshape(forget_high_shape))
-    # alpha_high = pm.Beta('alpha_high', mu=alpha_high_mu, sd=alpha_high_sd, shape=n_subj)
-    # beta_high = pm.Bound(pm.Normal, lower=0)('beta_high', mu=beta_high_mu, sd=beta_high_sd, shape=beta_shape)
-    # forget_high = pm.Beta('forget_high', mu=forget_high_mu, sd=forget_high_sd, shape=forget_high_shape)
-    # alpha_high = pm.HalfNormal('alpha_high', sd=0.1, shape=n_subj)
-    # beta_high = pm.Bound(pm.Normal, lower=0)('beta_high', mu=1, sd=2, shape=beta_high_shape)
-    # forget_high = pm.HalfNormal('forget_high', sd=0.05, shape=forget_high_shape)
-    alpha_high = pm.Deterministic('alpha_high', 0.2 * T.ones(n_subj))  # Flat agent
-    beta_high = pm.Deterministic('beta_high', 2 * T.ones(beta_high_shape))
-    forget_high = pm.Deterministic('forget_high', T.zeros(forget_high_shape))
-
-    # Calculate Q_high and Q_low for each trial
-    Q_low0 = alien_initial_Q * T.ones([n_subj, n_TS, n_aliens, n_actions])
-    Q_high0 = alien_initial_Q * T.ones([n_subj, n_seasons, n_TS])
-    [Q_low, _, TS, p_low], _ = theano.scan(fn=update_Qs,
-                                           sequences=[seasons, aliens, actions, rewards],
-                                           outputs_info=[Q_low0, Q_high0, None, None],
-                                           non_sequences=[beta, beta_high, alpha, alpha_high, forget, forget_high, n_subj, n_TS])
-
-    # Relate calculated p_low to observed actions
-    actions = pm.Categorical('actions',
-                             p=p_low.reshape([n_trials * n_subj, n_actions]),
-                             observed=actions.flatten())
+# Get the model (built and compiled once per process, see model_factory) and fill in the data
+model, data = get_model('Aliens', n_subj, n_trials, flat_fast_path=flat_fast_path, marginalize_TS=marginalize_TS)
+data_arrays = {'seasons': seasons, 'aliens': aliens, 'actions': actions, 'rewards': rewards}
+set_data(data, **data_arrays)
 
+# with model:
 #     # Draw samples
 #     map_estimate = pm.find_MAP()
 #
@@ -156,9 +108,14 @@ with pm.Model() as model:
 # map_gen_rec.to_csv(save_dir + save_id + '_map_gen_rec.csv')
 # if not run_on_cluster:
 #     plot_gen_rec(param_names=param_names, gen_rec=map_gen_rec, save_name=save_dir + save_id + '_map_gen_rec_plot.png')
-#
-# with model:
-    MCMC_trace = pm.sample(n_samples, tune=n_tune, chains=n_chains, cores=n_cores)  #, start=map_estimate
+
+with model:
+    if trace_dir:
+        MCMC_trace = sample_chunked(trace_dir, model, get_step(model), n_samples, n_tune, n_chains, n_cores,
+                                    model_spec=model.model_spec, data_arrays=data_arrays,
+                                    stop_check=ConvergenceCheck(max_rhat, min_ess) if stop_when_converged else None)
+    else:
+        MCMC_trace = pm.sample(n_samples, tune=n_tune, chains=n_chains, cores=n_cores, step=get_step(model))  #, start=map_estimate
 
 print("WAIC: {0}".format(pm.waic(MCMC_trace, model).WAIC))
 MCMC_model_summary = pm.summary(MCMC_trace)
@@ -177,7 +134,5 @@ if not run_on_cluster:
     plot_gen_rec(param_names=param_names, gen_rec=mcmc_gen_rec, save_name=save_dir + save_id + '_mcmc_gen_rec_plot.png')
 
 # Save results
-print('Saving trace, trace plot, model, and model summary to {0}{1}...\n'.format(save_dir, save_id + model.name))
-with open(save_dir + save_id + model.name + '.pickle', 'wb') as handle:
-    pickle.dump({'trace': MCMC_trace, 'model': model, 'summary': MCMC_model_summary},
-                handle, protocol=pickle.HIGHEST_PROTOCOL)
+print('Saving trace, trace plot, and model summary to {0}{1}...\n'.format(save_dir, save_id + model.name))
+save_fit(save_dir + save_id + model.name, MCMC_model_summary, MCMC_trace, model.model_spec, data_arrays, trace_dir)
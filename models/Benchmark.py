@@ -0,0 +1,351 @@
+import datetime
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+import scipy.io as spio
+
+
+# Switches for this script
+seed = 0  # every benchmark re-seeds np.random with this before it runs, so all commits see the same synthetic data
+n_repeats = 5  # timings are the median over n_repeats runs (after one warm-up run that also compiles theano)
+n_subj = 31
+n_trials = 440  # trials of the Aliens benchmarks
+n_ps_trials = 200  # trials of the PS benchmarks (PStask has 200 scheduled rewards per subject)
+n_candidates = 1000  # parameter sets evaluated together by FitParameters.calculate_NLL_batch
+n_sim_per_subj = 100  # simulated agents per subject in AlienMSEFitting.calculate_mse
+measure_memory = True  # peak memory is measured with tracemalloc in an extra (untimed) run
+save_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmarks')
+compare_to = None  # path of an earlier results file, e.g. 'benchmarks/benchmark_b5d88ef.json'
+
+n_seasons, n_TS, n_aliens, n_actions = 3, 3, 4, 3
+
+
+# Synthetic data
+def make_ps_data(n_trials):
+
+    # Choices and rewards of one participant of the probabilistic switching task
+    return pd.DataFrame({'selected_box': np.random.binomial(1, 0.5, n_trials),
+                         'reward': np.random.binomial(1, 0.5, n_trials),
+                         'RT': np.random.rand(n_trials)})
+
+
+def make_aliens_data(n_trials):
+
+    # Seasons change in blocks of 13 trials, aliens are random, as are choices; rewards follow the TS table
+    from main_helper_functions import get_task_stuff
+    TS = get_task_stuff('Aliens')['TS']
+    contexts = np.arange(n_trials) // 13 % n_seasons
+    aliens = np.random.choice(n_aliens, n_trials)
+    actions = np.random.choice(n_actions, n_trials)
+    return pd.DataFrame({'context': contexts,
+                         'sad_alien': aliens,
+                         'item_chosen': actions,
+                         'reward': TS[contexts, aliens, actions],
+                         'correct': TS[contexts, aliens, actions] > 1})
+
+
+def make_ps_info_path(info_path):
+
+    # Randomization versions in the format that PStask.Task reads (run_length<v>.mat and coin_win<v>.mat)
+    for version in range(4):
+        spio.savemat(os.path.join(info_path, 'run_length{0}.mat'.format(version)),
+                     {'run_length': np.random.randint(7, 16, 200)})
+        spio.savemat(os.path.join(info_path, 'coin_win{0}.mat'.format(version)),
+                     {'coin_win': np.random.binomial(1, 0.75, 200)})
+    return info_path
+
+
+# Benchmarks: each returns a function that runs the operation once, and the number of trials that this processes
+def get_fit_parameters(data_set, learning_style, fit_par_names):
+
+    from fit_parameters import FitParameters
+    from main_helper_functions import get_agent_stuff, get_task_stuff, get_comp_stuff, get_parameter_stuff
+
+    parameters = get_parameter_stuff(data_set, fit_par_names, learning_style)
+    return FitParameters(data_set, learning_style, parameters, get_task_stuff(data_set), get_comp_stuff(data_set),
+                         get_agent_stuff(data_set, learning_style, fit_par_names))
+
+
+def bench_ps_calculate_NLL():
+
+    fit_params = get_fit_parameters('PS', 'RL', ['alpha', 'beta', 'epsilon'])
+    agent_data = make_ps_data(n_ps_trials)
+    vary_pars = np.array([0.3, 0.5, 0.05])
+    return lambda: fit_params.calculate_NLL(vary_pars, agent_data), n_ps_trials
+
+
+def bench_ps_calculate_NLL_batch():
+
+    fit_params = get_fit_parameters('PS', 'RL', ['alpha', 'beta', 'epsilon'])
+    agent_data = make_ps_data(n_ps_trials)
+    vary_pars = np.random.rand(n_candidates, 3)
+    return lambda: fit_params.calculate_NLL_batch(vary_pars, agent_data), n_ps_trials * n_candidates
+
+
+def bench_aliens_calculate_NLL():
+
+    fit_params = get_fit_parameters('Aliens', 'hierarchical', ['alpha', 'beta', 'forget'])
+    agent_data = make_aliens_data(n_trials)
+    vary_pars = np.array([0.3, 0.5, 0.05])
+    return lambda: fit_params.calculate_NLL(vary_pars, agent_data), n_trials
+
+
+def bench_aliens_calculate_mse():
+
+    # Same simulate-and-score steps as AlienMSEFitting.calculate_mse, which loads human data when it is imported
+    from AlienTask import Task
+    from shared_aliens import alien_initial_Q, simulate_aliens, get_action_frequencies, get_action_likelihoods
+
+    n_sim = n_subj * n_sim_per_subj
+    task = Task(n_subj)
+    seasons = np.array([make_aliens_data(n_trials)['context'].values for _ in range(n_subj)]).T
+    aliens = np.array([make_aliens_data(n_trials)['sad_alien'].values for _ in range(n_subj)]).T
+    task.seasons, task.aliens = np.tile(seasons, n_sim_per_subj), np.tile(aliens, n_sim_per_subj)
+    hum_actions = np.random.choice(n_actions, [n_trials, n_subj])
+    hum_corrects = np.random.binomial(1, 0.5, [n_trials, n_subj])
+
+    def calculate_mse():
+        [_, _, _, _, _, sim_actions, _, sim_corrects, _, _] = \
+            simulate_aliens(task, n_trials,
+                            alien_initial_Q * np.ones([n_sim, n_TS, n_aliens, n_actions]),
+                            alien_initial_Q * np.ones([n_sim, n_seasons, n_TS]),
+                            2 * np.ones((n_sim, 1)), 2 * np.ones((n_sim, 1)), 0.2 * np.ones(n_sim), 0.2 * np.ones(n_sim),
+                            0.01 * np.ones((n_sim, 1, 1, 1)), 0.01 * np.ones((n_sim, 1, 1)),
+                            n_sim, n_actions, n_TS)
+        liks = get_action_likelihoods(get_action_frequencies(sim_actions, n_subj, n_actions), hum_actions)
+        liks[liks == 0] = 0.001
+        return np.sum(np.log(liks)), np.mean((np.mean(hum_corrects, axis=1) - np.mean(sim_corrects, axis=1)) ** 2)
+
+    return calculate_mse, n_trials * n_sim
+
+
+def bench_ps_theano_LL(update_Q_method='scan'):
+
+    # Log likelihood of the RL model in PSModel.py (theano.scan over update_Q, or update_Q_prefix), and its gradient
+    import theano
+    import theano.tensor as T
+    from shared_modeling_simulation import update_Q, update_Q_prefix, p_from_Q
+
+    rewards = theano.shared(np.random.binomial(1, 0.5, [n_ps_trials, n_subj]).astype('int32'))
+    choices = theano.shared(np.random.binomial(1, 0.5, [n_ps_trials, n_subj]).astype('int32'))
+    alpha, nalpha, beta = T.dvector('alpha'), T.dvector('nalpha'), T.dvector('beta')
+    calpha, cnalpha = 0 * alpha, 0 * nalpha
+
+    Q_left, Q_right = 0.5 * T.ones(n_subj), 0.5 * T.ones(n_subj)
+    if update_Q_method == 'prefix':
+        Q_left, Q_right = update_Q_prefix(rewards, choices, Q_left, Q_right, alpha, nalpha, calpha, cnalpha, n_ps_trials)
+    else:
+        [Q_left, Q_right], _ = theano.scan(fn=update_Q,
+                                           sequences=[rewards, choices],
+                                           outputs_info=[Q_left, Q_right],
+                                           non_sequences=[alpha, nalpha, calpha, cnalpha])
+    p_right = p_from_Q(Q_left, Q_right, beta, T.as_tensor_variable(0))
+    p_right = T.concatenate([0.5 * T.ones((1, n_subj)), p_right[:-1]], axis=0)
+    LL = T.sum(choices * T.log(p_right) + (1 - choices) * T.log(1 - p_right))
+    get_LL = theano.function([alpha, nalpha, beta], [LL] + T.grad(LL, [alpha, nalpha, beta]))  # as in NUTS
+
+    pars = [np.random.rand(n_subj), np.random.rand(n_subj), 10 * np.random.rand(n_subj)]
+    return lambda: get_LL(*pars), n_ps_trials * n_subj
+
+
+def bench_aliens_theano_LL(updater='update_Qs'):
+
+    # Log likelihood in AliensModelManySubj.py (theano.scan over update_Qs / update_Qs_marg), compiled into a function
+    import theano
+    import theano.tensor as T
+    import shared_aliens
+    from shared_aliens import alien_initial_Q
+    update_Qs = getattr(shared_aliens, updater)
+
+    data = [make_aliens_data(n_trials) for _ in range(n_subj)]
+    seasons, aliens, actions, rewards = \
+        [theano.shared(np.array([d[col].values for d in data]).T.astype('int32'))
+         for col in ['context', 'sad_alien', 'item_chosen', 'reward']]
+    alpha, beta, forget = T.dvector('alpha'), T.dmatrix('beta'), T.dtensor4('forget')
+    alpha_high, beta_high, forget_high = 0.2 * T.ones(n_subj), 2 * T.ones((n_subj, 1)), T.zeros((n_subj, 1, 1))
+
+    Q_low0 = alien_initial_Q * T.ones([n_subj, n_TS, n_aliens, n_actions])
+    Q_high0 = alien_initial_Q * T.ones([n_subj, n_seasons, n_TS])
+    [_, _, _, p_low], _ = theano.scan(fn=update_Qs,
+                                      sequences=[seasons, aliens, actions, rewards],
+                                      outputs_info=[Q_low0, Q_high0, None, None],
+                                      non_sequences=[beta, beta_high, alpha, alpha_high, forget, forget_high,
+                                                     n_subj, n_TS])
+    p_low = p_low.reshape([n_trials * n_subj, n_actions])
+    LL = T.sum(T.log(p_low[T.arange(n_trials * n_subj), actions.flatten()]))
+    get_LL = theano.function([alpha, beta, forget], LL)
+
+    pars = [np.random.rand(n_subj), 5 * np.random.rand(n_subj, 1), 0.1 * np.random.rand(n_subj, 1, 1, 1)]
+    return lambda: get_LL(*pars), n_trials * n_subj
+
+
+def bench_ps_task():
+
+    from PStask import Task
+
+    info_path = make_ps_info_path(tempfile.mkdtemp())
+    actions = np.random.binomial(1, 0.5, [n_ps_trials, n_subj])
+
+    def step_task():
+        task = Task(info_path, n_subj)
+        for trial in range(n_ps_trials):
+            task.prepare_trial()
+            task.produce_reward(actions[trial])
+
+    return step_task, n_ps_trials * n_subj
+
+
+def bench_ps_record_data():
+
+    from ps_record_data import RecordData
+
+    class SyntheticTask(object):
+        pass
+    task = SyntheticTask()
+    task.n_trials = n_ps_trials
+    agent_data = make_ps_data(n_ps_trials)
+
+    def write_record():
+        record_data = RecordData(mode='create_from_scratch', task=task)
+        for trial in range(n_ps_trials):
+            record_data.add_behavior(agent_data['selected_box'][trial], agent_data['reward'][trial], 1, 0, trial)
+        return record_data.get()
+
+    return write_record, n_ps_trials
+
+
+def bench_aliens_record_data():
+
+    from alien_record_data import RecordData
+
+    agent_data = make_aliens_data(n_trials)
+
+    def write_record():
+        record_data = RecordData(mode='add_to_existing_data', agent_data=agent_data.copy())
+        for trial in range(n_trials):
+            record_data.add_behavior([agent_data['context'][trial], agent_data['sad_alien'][trial]],
+                                     agent_data['item_chosen'][trial], agent_data['reward'][trial],
+                                     agent_data['correct'][trial], trial, '1InitialLearning', suff='_sim')
+        return record_data.get()
+
+    return write_record, n_trials
+
+
+benchmarks = [('fit_parameters.calculate_NLL PS', bench_ps_calculate_NLL),
+              ('fit_parameters.calculate_NLL_batch PS', bench_ps_calculate_NLL_batch),
+              ('fit_parameters.calculate_NLL Aliens', bench_aliens_calculate_NLL),
+              ('AlienMSEFitting.calculate_mse', bench_aliens_calculate_mse),
+              ('PSModel theano.scan LL', bench_ps_theano_LL),
+              ('PSModel update_Q_prefix LL', lambda: bench_ps_theano_LL('prefix')),
+              ('AliensModelManySubj theano.scan LL', bench_aliens_theano_LL),
+              ('AliensModelManySubj TS-marginalized LL', lambda: bench_aliens_theano_LL('update_Qs_marg')),
+              ('PStask.Task stepping', bench_ps_task),
+              ('ps_record_data.RecordData writes', bench_ps_record_data),
+              ('alien_record_data.RecordData writes', bench_aliens_record_data)]
+
+
+# Timing
+def run_benchmark(get_benchmark):
+
+    # Set up (with fixed seed), warm up, then time n_repeats runs and measure peak memory of one more run
+    np.random.seed(seed)
+    try:
+        run, n_trials_run = get_benchmark()
+        run()
+    except ImportError as error:
+        return {'skipped': str(error)}
+
+    times = []
+    for _ in range(n_repeats):
+        np.random.seed(seed)
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+
+    result = {'n_trials': n_trials_run,
+              'median_sec': np.median(times),
+              'min_sec': np.min(times),
+              'trials_per_sec': n_trials_run / np.median(times)}
+    if measure_memory:
+        np.random.seed(seed)
+        tracemalloc.start()
+        run()
+        result['peak_memory_mb'] = tracemalloc.get_traced_memory()[1] / 1e6
+        tracemalloc.stop()
+    return result
+
+
+def get_commit():
+
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def run_all_benchmarks():
+
+    results = {}
+    for name, get_benchmark in benchmarks:
+        print("Running {0}...".format(name))
+        results[name] = run_benchmark(get_benchmark)
+        if 'skipped' in results[name]:
+            print("\tskipped ({0})".format(results[name]['skipped']))
+        else:
+            print("\t{0:.0f} trials/sec, {1:.4f} sec, {2}".format(
+                results[name]['trials_per_sec'], results[name]['median_sec'],
+                '{0:.2f} MB'.format(results[name]['peak_memory_mb']) if measure_memory else ''))
+
+    return {'commit': get_commit(),
+            'date': datetime.datetime.now().isoformat(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'settings': {'seed': seed, 'n_repeats': n_repeats, 'n_subj': n_subj,
+                         'n_trials': n_trials, 'n_ps_trials': n_ps_trials,
+                         'n_candidates': n_candidates, 'n_sim_per_subj': n_sim_per_subj},
+            'results': results}
+
+
+def save_results(results):
+
+    if not os.path.isdir(save_dir):
+        os.makedirs(save_dir)
+    file_name = os.path.join(save_dir, 'benchmark_{0}.json'.format(results['commit']))
+    with open(file_name, 'w') as f:
+        json.dump(results, f, indent=2)
+    print("Saved benchmark results to {0}".format(file_name))
+    return file_name
+
+
+def compare_results(old_file_name, new_results):
+
+    # Speed-up (> 1 means faster) and memory ratio of each benchmark, relative to an earlier results file
+    with open(old_file_name) as f:
+        old_results = json.load(f)
+    if old_results['settings'] != new_results['settings']:
+        print("Warning: settings differ from {0}; results may not be comparable.".format(old_file_name))
+
+    print("\nComparison with commit {0}:".format(old_results['commit']))
+    for name, new in new_results['results'].items():
+        old = old_results['results'].get(name, {'skipped': 'missing'})
+        if 'skipped' in old or 'skipped' in new:
+            print("\t{0}: -".format(name))
+            continue
+        memory = ', memory x{0:.2f}'.format(new['peak_memory_mb'] / old['peak_memory_mb']) \
+            if 'peak_memory_mb' in old and 'peak_memory_mb' in new else ''
+        print("\t{0}: speed-up x{1:.2f}{2}".format(name, new['trials_per_sec'] / old['trials_per_sec'], memory))
+
+
+if __name__ == '__main__':
+    results = run_all_benchmarks()
+    save_results(results)
+    if compare_to:
+        compare_results(compare_to, results)
@@ -1,138 +1,72 @@
-import pickle
+import compile_cache  # sets Theano's compile directory (setting compile_dir); has to come before theano
 import numpy as np
 
-import theano
-import theano.tensor as T
 import matplotlib.pyplot as plt
 
-from shared_modeling_simulation import get_likelihoods, post_from_lik
-from modeling_helpers import load_data, get_save_dir_and_save_id, print_logp_info
+from chunked_trace import sample_chunked
+from convergence import ConvergenceCheck
+from model_factory import get_model, get_step, set_data, fit_variational
+from modeling_helpers import load_data, get_save_dir_and_save_id
+from slcn_config import get_config
+from trace_reader import save_fit
 import pymc3 as pm
 
 
-# Switches for this script
-run_on_cluster = False
+# Switches for this script (settings given in the config file, environment, or command line take precedence)
+config = get_config()
+run_on_cluster = config.get('run_on_cluster', False)
 verbose = False
 file_name_suff = 'betperswirew'
 
-upper = 1000
-
 # Which data should be fitted?
 fitted_data_name = 'humans'  # 'humans', 'simulations'
 kids_and_teens_only = False
 adults_only = False
 
 # Sampling details
-n_samples = 50
-n_tune = 10
-n_cores = 1
-n_chains = 1
+n_samples = config.get('n_samples', 50)
+n_tune = config.get('n_tune', 10)
+n_cores = config.get('n_cores', 1)
+n_chains = config.get('n_chains', 1)
+trace_dir = config.get('trace_dir')  # stream draws to this folder while sampling (see chunked_trace.py); rerun to continue
+stop_when_converged = False  # stop before n_samples once split-R-hat <= max_rhat and bulk / tail ESS >= min_ess
+max_rhat = 1.01
+min_ess = 400
 target_accept = 0.8
+fitting_method = 'NUTS'  # 'NUTS', 'advi' (mean-field ADVI), or 'fullrank_advi' (fast; for screening model variants)
+n_advi_iterations = 30000
 
 # Load to-be-fitted data
 n_subj, rewards, choices, group, n_groups = load_data(run_on_cluster, fitted_data_name, kids_and_teens_only, adults_only, verbose)
-persev_bonus = 2 * choices - 1  # recode as -1 for left and +1 for right
-persev_bonus = np.concatenate([np.zeros((1, n_subj)), persev_bonus])  # add 0 bonus for first trial
-
-rewards = theano.shared(np.asarray(rewards, dtype='int32'))
-choices = theano.shared(np.asarray(choices, dtype='int32'))
-group = theano.shared(np.asarray(group, dtype='int32'))
-persev_bonus = theano.shared(np.asarray(persev_bonus, dtype='int32'))
+n_trials = choices.shape[0]
 
 # Prepare things for saving
 save_dir, save_id = get_save_dir_and_save_id(run_on_cluster, file_name_suff, fitted_data_name, n_samples)
+if fitting_method != 'NUTS':
+    save_id += '_' + fitting_method
+if stop_when_converged and not trace_dir:
+    trace_dir = save_dir + save_id + '_trace'  # ConvergenceCheck reads the draws from there
 
 # Fit models
 model_dict = {}
 print("Compiling models for {0} with {1} samples and {2} tuning steps...\n".format(fitted_data_name, n_samples, n_tune))
 
-with pm.Model() as model:
-
-    # Get population-level and individual parameters
-    eps = T.as_tensor_variable(0)
-    p_noisy = 1e-5 * T.as_tensor_variable(1)
-
-    beta_a_a = pm.Uniform('beta_a_a', lower=0, upper=upper)
-    beta_a_b = pm.Uniform('beta_a_b', lower=0, upper=upper)
-    beta_b_a = pm.Uniform('beta_b_a', lower=0, upper=upper)
-    beta_b_b = pm.Uniform('beta_b_b', lower=0, upper=upper)
-    beta_a = pm.Gamma('beta_a', alpha=beta_a_a, beta=beta_a_b, shape=n_groups)
-    beta_b = pm.Gamma('beta_b', alpha=beta_b_a, beta=beta_b_b, shape=n_groups)
-
-    persev_mu_mu = pm.Uniform('persev_mu_mu', lower=-1, upper=1)
-    persev_mu_sd = pm.HalfNormal('persev_mu_sd', sd=0.5)
-    persev_sd_sd = pm.HalfNormal('persev_sd_sd', sd=0.1)
-
-    p_switch_a_a = pm.Uniform('p_switch_a_a', lower=0, upper=upper)
-    p_switch_a_b = pm.Uniform('p_switch_a_b', lower=0, upper=upper)
-    p_switch_b_a = pm.Uniform('p_switch_b_a', lower=0, upper=upper)
-    p_switch_b_b = pm.Uniform('p_switch_b_b', lower=0, upper=upper)
-    p_switch_a = pm.Gamma('p_switch_a', alpha=p_switch_a_a, beta=p_switch_a_b, shape=n_groups)
-    p_switch_b = pm.Gamma('p_switch_b', alpha=p_switch_b_a, beta=p_switch_b_b, shape=n_groups)
-
-    p_reward_a_a = pm.Uniform('p_reward_a_a', lower=0, upper=upper)
-    p_reward_a_b = pm.Uniform('p_reward_a_b', lower=0, upper=upper)
-    p_reward_b_a = pm.Uniform('p_reward_b_a', lower=0, upper=upper)
-    p_reward_b_b = pm.Uniform('p_reward_b_b', lower=0, upper=upper)
-    p_reward_a = pm.Gamma('p_reward_a', alpha=p_reward_a_a, beta=p_reward_a_b, shape=n_groups)
-    p_reward_b = pm.Gamma('p_reward_b', alpha=p_reward_b_a, beta=p_reward_b_b, shape=n_groups)
-
-    # Parameter mu and var and group differences
-    beta_mu = pm.Deterministic('beta_mu', beta_a / beta_b)
-    beta_var = pm.Deterministic('beta_var', beta_a / T.square(beta_b))
-    persev_mu = pm.Bound(pm.Normal, lower=-1, upper=1)('persev_mu', mu=persev_mu_mu, sd=persev_mu_sd, shape=n_groups)
-    persev_sd = pm.HalfNormal('persev_sd', sd=persev_sd_sd, shape=n_groups)
-    p_switch_mu = pm.Deterministic('p_switch_mu', p_switch_a / (p_switch_a + p_switch_b))
-    p_switch_var = pm.Deterministic('p_switch_var', p_switch_a * p_switch_b / (T.square(p_switch_a + p_switch_b) * (p_switch_a + p_switch_b + 1)))
-    p_reward_mu = pm.Deterministic('p_reward_mu', p_reward_a / (p_reward_a + p_reward_b))
-    p_reward_var = pm.Deterministic('p_reward_var', p_reward_a * p_reward_b / (T.square(p_reward_a + p_reward_b) * (p_reward_a + p_reward_b + 1)))
-
-    # Individual parameters
-    beta = pm.Gamma('beta', alpha=beta_a[group], beta=beta_b[group], shape=n_subj)
-    persev = pm.Bound(pm.Normal, lower=-1, upper=1)('persev', mu=persev_mu[group], sd=persev_sd[group], shape=(1, n_subj), testval=0.1 * T.ones((1, n_subj)))
-    scaled_persev_bonus = persev_bonus * persev
-    T.printing.Print('choices')(choices)
-    T.printing.Print('scaled_persev_bonus')(scaled_persev_bonus)
-    p_switch = pm.Beta('p_switch', alpha=p_switch_a[group], beta=p_switch_b[group], shape=n_subj)
-    p_reward = pm.Beta('p_reward', alpha=p_reward_a[group], beta=p_reward_b[group], shape=n_subj)
-
-    # Group differences
-    beta_mu_diff01 = pm.Deterministic('beta_mu_diff01', beta_mu[0] - beta_mu[1])
-    beta_mu_diff02 = pm.Deterministic('beta_mu_diff02', beta_mu[0] - beta_mu[2])
-    beta_mu_diff12 = pm.Deterministic('beta_mu_diff12', beta_mu[1] - beta_mu[2])
-    persev_mu_diff01 = pm.Deterministic('persev_mu_diff01', persev_mu[0] - persev_mu[1])
-    persev_mu_diff02 = pm.Deterministic('persev_mu_diff02', persev_mu[0] - persev_mu[2])
-    persev_mu_diff12 = pm.Deterministic('persev_mu_diff12', persev_mu[1] - persev_mu[2])
-    p_switch_mu_diff01 = pm.Deterministic('p_switch_mu_diff01', p_switch_mu[0] - p_switch_mu[1])
-    p_switch_mu_diff02 = pm.Deterministic('p_switch_mu_diff02', p_switch_mu[0] - p_switch_mu[2])
-    p_switch_mu_diff12 = pm.Deterministic('p_switch_mu_diff12', p_switch_mu[1] - p_switch_mu[2])
-    p_reward_mu_diff01 = pm.Deterministic('p_reward_mu_diff01', p_reward_mu[0] - p_reward_mu[1])
-    p_reward_mu_diff02 = pm.Deterministic('p_reward_mu_diff02', p_reward_mu[0] - p_reward_mu[2])
-    p_reward_mu_diff12 = pm.Deterministic('p_reward_mu_diff12', p_reward_mu[1] - p_reward_mu[2])
-
-    # Get likelihoods
-    lik_cor, lik_inc = get_likelihoods(rewards, choices, p_reward, p_noisy)
-
-    # Get posterior, calculate probability of subsequent trial, add eps noise
-    p_right = 0.5 * T.ones(n_subj, dtype='int32')
-    p_right, _ = theano.scan(fn=post_from_lik,
-                             sequences=[lik_cor, lik_inc, scaled_persev_bonus],
-                             outputs_info=[p_right],
-                             non_sequences=[p_switch, eps, beta])
-
-    # Add initial p=0.5 at the beginning of p_right
-    initial_p = 0.5 * T.ones((1, n_subj))
-    p_right = T.concatenate([initial_p, p_right[:-1]], axis=0)
-
-    # Use Bernoulli to sample responses
-    model_choices = pm.Bernoulli('model_choices', p=p_right, observed=choices)
+# Get the model (built and compiled once per process, see model_factory) and fill in the data
+model, data = get_model('PSBayes', n_subj, n_trials, n_groups)
+data_arrays = {'rewards': rewards, 'choices': choices, 'group': group}
+set_data(data, **data_arrays)
 
-    # Check model logp and RV logps (will crash if they are nan or -inf)
-    # if verbose:
-    #     print_logp_info(model)
+with model:
 
-    # Sample the model
-    trace = pm.sample(n_samples, tune=n_tune, chains=n_chains, cores=n_cores, nuts_kwargs=dict(target_accept=.8))
+    # Sample the model (or approximate it with ADVI)
+    if fitting_method == 'NUTS' and trace_dir:
+        trace = sample_chunked(trace_dir, model, get_step(model, target_accept), n_samples, n_tune, n_chains, n_cores,
+                               model_spec=model.model_spec, data_arrays=data_arrays,
+                               stop_check=ConvergenceCheck(max_rhat, min_ess) if stop_when_converged else None)
+    elif fitting_method == 'NUTS':
+        trace = pm.sample(n_samples, tune=n_tune, chains=n_chains, cores=n_cores, step=get_step(model, target_accept))
+    else:
+        trace = fit_variational(model, fitting_method, n_advi_iterations, n_samples)
 
 # Get results
 model_summary = pm.summary(trace)
@@ -142,7 +76,6 @@ if not run_on_cluster:
     plt.savefig(save_dir + 'plot_' + save_id + '.png')
 
 # Save results
-print('Saving trace, trace plot, model, and model summary to {0}{1}...\n'.format(save_dir, save_id))
-with open(save_dir + save_id + '.pickle', 'wb') as handle:
-    pickle.dump({'trace': trace, 'model': model, 'summary': model_summary},
-                handle, protocol=pickle.HIGHEST_PROTOCOL)
+print('Saving trace, trace plot, and model summary to {0}{1}...\n'.format(save_dir, save_id))
+save_fit(save_dir + save_id, model_summary, trace, model.model_spec, data_arrays,
+         trace_dir if fitting_method == 'NUTS' and trace_dir else None)
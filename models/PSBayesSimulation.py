@@ -1,13 +1,16 @@
-import pickle
 import os
 
 import pandas as pd
 import numpy as np
 
 from shared_modeling_simulation import get_paths, get_likelihoods, post_from_lik
+from slcn_config import get_config
+from trace_reader import open_trace
 from PStask import Task
 
-# Switches for this script
+# Switches for this script (settings given in the config file, environment, or command line take precedence)
+config = get_config()
+run_on_cluster = config.get('run_on_cluster', False)
 verbose = False
 n_trials = 128  # humans: 128
 n_sim_per_subj = 2
@@ -17,10 +20,10 @@ n_sim = n_sim_per_subj * n_subj
 # TODO: comment out `p_right = 1 / (1 + np.exp(-beta * (p_right - (1 - p_right))))`
 # TODO: in shared_mod_sim when running swirew model (no beta)!
 model_to_be_simulated = 'none'  # 'Bayes_3groups/swirew_2018_10_10_17_29_humans_n_samples5000'  # 'none'  #
-ages = pd.read_csv(get_paths(False)['ages'], index_col=0)
+ages = pd.read_csv(get_paths(run_on_cluster)['ages'], index_col=0)
 
 # Get save path
-save_dir = get_paths(False)['simulations']
+save_dir = get_paths(run_on_cluster)['simulations']
 if not os.path.exists(save_dir):
     os.makedirs(save_dir)
 
@@ -36,7 +39,7 @@ if model_to_be_simulated == 'none':
 
 # Load fitted parameters
 else:
-    parameter_dir = get_paths(run_on_cluster=False)['fitting results']
+    parameter_dir = get_paths(run_on_cluster)['fitting results']
     print('Loading {0}{1}.\n'.format(parameter_dir, model_to_be_simulated))
 
     # model_summary = pd.read_csv(parameter_dir + model_to_be_simulated + 'model_summary.csv', index_col=0)
@@ -48,11 +51,7 @@ else:
     # parameters = pd.DataFrame(np.array(parameters, dtype=float))
     # parameters.columns = np.append(param_names, ['sID'])
 
-    with open(parameter_dir + model_to_be_simulated + '.pickle', 'rb') as handle:
-        data = pickle.load(handle)
-        trace = data['trace']
-        model = data['model']
-        model_summary = data['summary']
+    trace = open_trace(parameter_dir + model_to_be_simulated)  # only the sampled draws are read from disk
 
     for sim_id in range(n_sim_per_subj):
         rand_idx = np.random.randint(0, trace[param_names[0]].shape[0])
@@ -70,7 +69,7 @@ if verbose:
     print("Parameters: {0}".format(parameters.round(3)))
 
 # Make sure that simulated agents get the same reward versions as humans
-reward_versions = pd.read_csv(get_paths(run_on_cluster=False)['PS reward versions'], index_col=0)
+reward_versions = pd.read_csv(get_paths(run_on_cluster)['PS reward versions'], index_col=0)
 assert np.all((reward_versions["sID"] % 4) == (reward_versions["rewardversion"]))
 
 # Set up data frames
@@ -81,7 +80,7 @@ ps_right = np.zeros(rewards.shape)
 LLs = np.zeros(rewards.shape)
 
 # Initialize task
-task_info_path = get_paths(run_on_cluster=False)['PS task info']
+task_info_path = get_paths(run_on_cluster)['PS task info']
 task = Task(task_info_path, n_sim_per_subj * n_subj, parameters['sID'])
 LL = np.zeros(n_sim_per_subj * n_subj)
 
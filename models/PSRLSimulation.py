@@ -1,13 +1,16 @@
-import pickle
 import os
 
 import pandas as pd
 import numpy as np
 
 from shared_modeling_simulation import get_paths, update_Q, p_from_Q
+from slcn_config import get_config
+from trace_reader import open_trace
 from PStask import Task
 
-# Switches for this script
+# Switches for this script (settings given in the config file, environment, or command line take precedence)
+config = get_config()
+run_on_cluster = config.get('run_on_cluster', False)
 verbose = False
 n_trials = 128  # humans: 128
 n_sim_per_subj = 10
@@ -15,10 +18,10 @@ param_names = np.array(['alpha', 'beta', 'nalpha', 'calpha', 'cnalpha'])
 n_subj = 233  # 233 as of 2018-10-03
 max_n_subj = n_sim_per_subj * n_subj
 model_to_be_simulated = 'RL_3groups/abcn_2018_10_3_19_35_humans_n_samples5000'  # 'none'  #
-ages = pd.read_csv(get_paths(False)['ages'], index_col=0)
+ages = pd.read_csv(get_paths(run_on_cluster)['ages'], index_col=0)
 
 # Get save path
-save_dir = get_paths(False)['simulations']
+save_dir = get_paths(run_on_cluster)['simulations']
 if not os.path.exists(save_dir):
     os.makedirs(save_dir)
 
@@ -38,24 +41,21 @@ if model_to_be_simulated == 'none':
 
 # Load fitted parameters
 else:
-    parameter_dir = get_paths(run_on_cluster=False)['fitting results']
+    parameter_dir = get_paths(run_on_cluster)['fitting results']
     print('Loading {0}{1}.\n'.format(parameter_dir, model_to_be_simulated))
     # model_summary = pd.read_csv(parameter_dir + model_to_be_simulated + '_summary.csv', index_col=0)
 
-    with open(parameter_dir + model_to_be_simulated + '.pickle', 'rb') as handle:
-        data = pickle.load(handle)
-        trace = data['trace']
-        model = data['model']
-        model_summary = data['summary']
+    trace = open_trace(parameter_dir + model_to_be_simulated)  # only the sampled draws are read from disk
 
     for sim_id in range(n_sim_per_subj):
-        rand_idx = np.random.randint(0, trace[param_names[0]].shape[0])
-        sample_params = pd.DataFrame(np.array([trace[param_name][rand_idx] for param_name in param_names]).T, columns=param_names)
+        rand_idx = np.random.randint(0, len(trace) * trace.nchains)
+        sample_params = pd.DataFrame(np.array([trace.get_draw(param_name, rand_idx) for param_name in param_names]).T,
+                                     columns=param_names)
         sample_params['sID'] = ages['sID']  # index of ages == PyMC's file order == samples_params' order
         parameters = pd.concat([parameters, sample_params], axis=0)
 
     print('Model contains {0} participants, ages.csv {1}.'
-          .format(trace[param_names[0]].shape[1], ages.shape[0]))
+          .format(trace.get_shape(param_names[0])[0], ages.shape[0]))
 
     # for param_name in param_names[param_names != 'eps']:
     #
@@ -69,7 +69,7 @@ if verbose:
     print("Parameters: {0}".format(parameters.round(3)))
 
 # Make sure that simulated agents get the same reward versions as humans
-reward_versions = pd.read_csv(get_paths(run_on_cluster=False)['PS reward versions'], index_col=0)
+reward_versions = pd.read_csv(get_paths(run_on_cluster)['PS reward versions'], index_col=0)
 assert np.all((reward_versions["sID"] % 4) == (reward_versions["rewardversion"]))
 
 # Set up data frames
@@ -83,7 +83,7 @@ Qs_left = np.zeros(rewards.shape)
 Qs_right = np.zeros(rewards.shape)
 
 # Initialize task
-task_info_path = get_paths(run_on_cluster=False)['PS task info']
+task_info_path = get_paths(run_on_cluster)['PS task info']
 task = Task(task_info_path, n_sim_per_subj * n_subj, parameters['sID'])
 LL = np.zeros(n_sim_per_subj * n_subj)
 
@@ -1,12 +1,15 @@
-import pickle
 import os
 
 import pandas as pd
 
 from shared_modeling_simulation import *
+from slcn_config import get_config
+from trace_reader import open_trace, summarize
 from PStask import Task
 
-# Switches for this script
+# Switches for this script (settings given in the config file, environment, or command line take precedence)
+config = get_config()
+run_on_cluster = config.get('run_on_cluster', False)
 verbose = False
 n_trials = 128  # humans: 128
 max_n_subj = 227  # must be > 1  # TODO figure out if 227 or 231
@@ -15,7 +18,7 @@ learning_style = 'RL'  # 'Bayes' or 'RL'
 model_to_be_simulated = 'none'
 
 # Get save path
-save_dir = get_paths(False)['simulations']
+save_dir = get_paths(run_on_cluster)['simulations']
 if not os.path.exists(save_dir):
     os.makedirs(save_dir)
 
@@ -33,12 +36,9 @@ if model_to_be_simulated == 'none':
 
 # Load fitted parameters
 else:
-    parameter_dir = get_paths(run_on_cluster=False)['fitting results']
+    parameter_dir = get_paths(run_on_cluster)['fitting results']
     print('Loading {0}{1}...\n'.format(parameter_dir, model_to_be_simulated))
-    with open(parameter_dir + model_to_be_simulated + '.pickle', 'rb') as handle:
-        data = pickle.load(handle)
-        model_summary = data['summary']
-        model = data['model']
+    model_summary = summarize(open_trace(parameter_dir + model_to_be_simulated))
 
     beta_idx = [idx for idx in model_summary.index if 'beta' in idx and '_mu' not in idx]
     beta = model_summary.loc[beta_idx[:max_n_subj], 'mean'].values
@@ -102,7 +102,7 @@ if learning_style == 'RL':
     Qs_right = np.zeros(rewards.shape)
 
 # Initialize task
-task_info_path = get_paths(run_on_cluster=False)['PS task info']
+task_info_path = get_paths(run_on_cluster)['PS task info']
 task = Task(task_info_path, n_subj)
 LL = np.zeros(n_subj)
 
@@ -21,18 +21,21 @@ class Task(object):
         # Load task specifics
         self.info_path = info_path  # path where randomization versions are stored
         n_runs = 200
-        reward_versions = [str(i % 4) for i in self.subj_ids]
-        self.run_lengths = np.array([spio.loadmat(self.info_path + '/run_length' + version + '.mat',
-                                                  squeeze_me=True)['run_length'][:n_runs]
-                                     for version in reward_versions]).T
-        self.coin_wins = np.array([spio.loadmat(self.info_path + '/coin_win' + version + '.mat',
-                                                squeeze_me=True)['coin_win'][:n_runs]
-                                   for version in reward_versions], dtype=bool).T
+        versions, version_idx = np.unique([str(i % 4) for i in self.subj_ids], return_inverse=True)
+        version_run_lengths = np.array([spio.loadmat(self.info_path + '/run_length' + version + '.mat',
+                                                     squeeze_me=True)['run_length'][:n_runs]
+                                        for version in versions])
+        version_coin_wins = np.array([spio.loadmat(self.info_path + '/coin_win' + version + '.mat',
+                                                   squeeze_me=True)['coin_win'][:n_runs]
+                                      for version in versions], dtype=bool)
+        self.run_lengths = version_run_lengths[version_idx].T  # [n_runs, n_subj]; each version is loaded only once
+        self.coin_wins = version_coin_wins[version_idx].T  # [n_runs, n_subj]
+        self.subj_idx = np.arange(n_subj)
 
     def prepare_trial(self):
 
         # Switch sides if necessary
-        current_run_lengths = np.array([self.run_lengths[self.i_episode[subj], subj] for subj in range(self.n_subj)])
+        current_run_lengths = self.run_lengths[self.i_episode, self.subj_idx]
         self.switched = self.n_rewards == current_run_lengths
         self.correct_box[self.switched] = 1 - self.correct_box[self.switched]
 
@@ -46,19 +49,26 @@ class Task(object):
         correct_choice = action == self.correct_box
 
         # Look up the rewards that are scheduled for the current trial
-        scheduled_coin_wins = np.array([self.coin_wins[self.n_correct[subj], subj] for subj in range(self.n_subj)])
+        scheduled_coin_wins = self.coin_wins[self.n_correct, self.subj_idx]
 
         # Check for which subjects rewards need to be exchanged
-        needs_reward_switch = np.array(self.switched * np.invert(scheduled_coin_wins))
-        for subj in self.subj_ids:
-            if needs_reward_switch[subj]:
-                subj_scheduled_rewards = np.argwhere(self.coin_wins[:, subj])
-                next_scheduled_reward = min(subj_scheduled_rewards[subj_scheduled_rewards > self.n_correct[subj]])
-                self.coin_wins[self.n_correct[subj], subj] = True  # add reward to current index
-                self.coin_wins[next_scheduled_reward, subj] = False  # remove reward from next index
+        needs_reward_switch = self.subj_idx[self.switched & np.invert(scheduled_coin_wins)]
+        if len(needs_reward_switch):
+
+            # Find the next scheduled reward after the current index for all of them at once
+            n_correct = self.n_correct[needs_reward_switch]
+            later_rewards = self.coin_wins[:, needs_reward_switch] & \
+                (np.arange(self.coin_wins.shape[0])[:, np.newaxis] > n_correct)
+            has_next = np.any(later_rewards, axis=0)
+            if not np.all(has_next):
+                raise ValueError("No later reward is scheduled for subjects {0} (correct choices: {1}).".format(
+                    needs_reward_switch[~has_next], n_correct[~has_next]))  # like the original min([]) error
+            next_scheduled_reward = np.argmax(later_rewards, axis=0)
+            self.coin_wins[n_correct, needs_reward_switch] = True  # add reward to current index
+            self.coin_wins[next_scheduled_reward, needs_reward_switch] = False  # remove reward from next index
 
         # Recalculate scheduled rewards based on updated coin_wins
-        scheduled_coin_wins = np.array([self.coin_wins[self.n_correct[subj], subj] for subj in range(self.n_subj)])
+        scheduled_coin_wins = self.coin_wins[self.n_correct, self.subj_idx]
         scheduled_coin_wins[np.invert(correct_choice)] = False  # no coins for incorrect actions
 
         # Keep track of things
@@ -1,9 +1,10 @@
+import compile_cache  # sets Theano's compile directory (setting compile_dir); has to come before theano
 import pymc3 as pm
 import numpy as np
 import theano
 import theano.tensor as T
 
-from shared_aliens import alien_initial_Q
+from shared_aliens import alien_initial_Q, get_flat_Q_pairs, get_flat_Q_low_sub
 from modeling_helpers import load_aliens_data
 
 # Which data should be fitted?
@@ -185,6 +186,9 @@ def update_Qs_1subj_hier_e(season, alien, action, reward,
 n_subj, n_trials, seasons, aliens, actions, rewards =\
     load_aliens_data(False, fitted_data_name, max_n_subj, max_n_trials, False)
 
+# Q-value updates that each trial's likelihood depends on (for flat_model_affine)
+flat_Q_pairs = get_flat_Q_pairs(np.asarray(seasons, dtype=int), np.asarray(aliens, dtype=int), np.asarray(actions, dtype=int))
+
 # Convert data to tensor variables
 seasons = theano.shared(np.asarray(seasons, dtype='int32'))
 aliens = theano.shared(np.asarray(aliens, dtype='int32'))
@@ -254,6 +258,22 @@ with pm.Model() as flat_model_e:
 
 flat_model_e.profile(flat_model_e.logpt).summary()
 
+with pm.Model() as flat_model_affine:
+
+    ## Same model as flat_model_e, but Q-values come from per-cell decay products instead of scan
+    beta = pm.Bound(pm.Normal, lower=0)('beta', mu=1, sd=5, testval=1.5)
+    alpha = pm.Uniform('alpha', lower=0, upper=1, testval=0.1)
+    forget = pm.Uniform('forget', lower=0, upper=1, testval=0.001)
+
+    Q_low_sub = get_flat_Q_low_sub(flat_Q_pairs, rewards, alpha * T.ones(max_n_subj), forget * T.ones(max_n_subj),
+                                   n_trials, max_n_subj, n_actions)
+    p_low = T.nnet.softmax(beta * Q_low_sub.reshape([n_trials * max_n_subj, n_actions]))
+    actions_affine = pm.Categorical('actions', p=p_low, observed=actions.flatten())
+
+    flat_trace_affine = pm.sample(20, tune=20, chains=1, cores=1)
+
+flat_model_affine.profile(flat_model_affine.logpt).summary()
+
 # with pm.Model() as hier_model:
 #
 #     ## RL parameters: softmax temperature beta; learning rate alpha; forgetting of Q-values
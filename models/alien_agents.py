@@ -1,5 +1,6 @@
 import numpy as np
 import math
+from shared_softmax import softmax_with_epsilon
 
 
 class Agent(object):
@@ -123,16 +124,8 @@ class Agent(object):
 
     def get_p_from_Q(self, Q, beta, epsilon):
 
-        # Softmax
-        p_actions = np.empty(len(Q))
-        for i in range(len(Q)):
-            denominator = 1. + sum([np.exp(beta * (Q[j] - Q[i])) for j in range(len(Q)) if j != i])
-            p_actions[i] = 1. / denominator
-
-        # Add epsilon noise
-        p_actions = epsilon / len(self.p_actions) + (1 - epsilon) * p_actions
-        assert np.round(sum(p_actions), 3) == 1
-        return p_actions
+        # Softmax and epsilon noise (spread over the number of actions)
+        return softmax_with_epsilon(Q, beta, epsilon, n_options=len(self.p_actions))
 
     def forget_Qs(self):
         self.Q_low -= self.forget * (self.Q_low - 1)  # decays toward 1 (average of incorrect responses)
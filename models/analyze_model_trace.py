@@ -1,6 +1,6 @@
 # Model comparison: https://docs.pymc.io/notebooks/model_comparison.html
 
-import pickle
+import compile_cache  # sets Theano's compile directory (setting compile_dir); has to come before theano
 import string
 import pandas as pd
 import seaborn as sns
@@ -11,9 +11,13 @@ import matplotlib.pyplot as plt
 
 from shared_modeling_simulation import get_paths
 from modeling_helpers import plot_gen_rec
+from trace_reader import open_trace, summarize, waic, compare_waic
+from slcn_config import get_config
 
 
 # Which models should be analyzed and compared?
+config = get_config()
+run_on_cluster = config.get('run_on_cluster', False)
 create_pairplot = False
 analyze_indiv_models = True
 test_group_differences = False
@@ -34,21 +38,17 @@ file_names = [
 model_names = ['betswirew', 'betswirew', 'swirew', 'soft']  # ['betswirew', 'swirew', 'betswirew']  # string.ascii_lowercase  # ['abn', 'abcncn']
 
 # Load fitted parameters
-paths = get_paths(run_on_cluster=False)
+paths = get_paths(run_on_cluster)
 parameter_dir = paths['fitting results']
 save_dir = paths['fitting results']
 print("Working on {0}.\n".format(file_names))
 
-model_dict = {}
+waic_dict = {}
 for file_name, model_name in zip(file_names, model_names):
 
+    # Open the trace (memory-mapped; variables are only read from disk when they are used)
     print('\n\tMODEL {0}'.format(model_name))
-    with open(parameter_dir + file_name + '.pickle', 'rb') as handle:
-        data = pickle.load(handle)
-        trace = data['trace']
-        model = data['model']
-        model_summary = data['summary']
-        model.name = model_name
+    trace = open_trace(parameter_dir + file_name)
 
     if do_plot_gen_rec:
         # map_gen_rec = pd.read_csv(save_dir + file_name + '_map_gen_rec.csv', index_col=0, header=0)
@@ -59,9 +59,6 @@ for file_name, model_name in zip(file_names, model_names):
         plot_gen_rec(param_names=param_names, gen_rec=mcmc_gen_rec,
                      save_name=save_dir + file_name + '_mcmc_gen_rec_plot.png')
 
-    # Add model to model_dict
-    model_dict.update({model: trace})
-
     if analyze_indiv_models:
 
         # Compare true parameters and estimates
@@ -76,7 +73,7 @@ for file_name, model_name in zip(file_names, model_names):
         #         plt.xlabel(param_name)
         #     plt.savefig(save_dir + file_name + param_name + 'MCMC_gen_rec.png')
 
-        par_names = [str(RV_name) for RV_name in model.free_RVs]
+        par_names = [varname for varname in trace.varnames if not varname.endswith('__')]
 
         # Graph (does not seem to exist any more in PyMC3)
         # pydotprint(model.logpt)
@@ -94,12 +91,13 @@ for file_name, model_name in zip(file_names, model_names):
         #     plt.savefig(save_dir + file_name + '_' + par_name + '_cumsumplot.png')
 
         # display the total number and percentage of divergent
-        divergent = trace['diverging']
-        print('Number of Divergent %d' % divergent.nonzero()[0].size)
+        if 'diverging' in trace.stat_names:  # not for ADVI fits
+            divergent = trace['diverging']
+            print('Number of Divergent %d' % divergent.nonzero()[0].size)
 
         # Rhat should be close to one; number of effective samples > 200
         print('Saving summary of {0} model.'.format(model_name))
-        pd.DataFrame(model_summary).to_csv(save_dir + file_name + '_summary.csv')
+        summarize(trace).to_csv(save_dir + file_name + '_summary.csv')
 
         # print(model.basic_RVs)
         # pm.pairplot(trace, sub_varnames=['alpha_sd', 'beta_sd'], divergences=True, color='C3',
@@ -113,10 +111,10 @@ for file_name, model_name in zip(file_names, model_names):
         # plt.savefig(save_dir + file_name + '_forestplot.png')
         print("Saved traces for {0} model to {1}{2}.".format(model_name, save_dir, file_name))
 
-        # Get model WAICs
-        if calculate_waic:
-            waic = pm.waic(trace, model)
-            print("WAIC of {0} model: {1}".format(model_name, waic.WAIC))
+    # Get model WAICs (streamed over the draws; needs the model, which is only unpickled here)
+    if calculate_waic or compare_models:
+        waic_dict[model_name] = waic(trace, trace.load_model())
+        print("WAIC of {0} model: {1}".format(model_name, waic_dict[model_name].WAIC))
 
     # Plot divergent samples to identify problematic neighborhoods in parameter space
     if create_pairplot:
@@ -137,7 +135,7 @@ for file_name, model_name in zip(file_names, model_names):
             'cnalpha_sc_a_diff01', 'cnalpha_sc_a_diff02', 'cnalpha_sc_a_diff12',
             'cnalpha_sc_b_diff01', 'cnalpha_sc_b_diff02', 'cnalpha_sc_b_diff12'
         ]
-        pd.DataFrame(pm.summary(trace, diffs)).to_csv(save_dir + file_name + '_diff_summary.csv')
+        summarize(trace, diffs).to_csv(save_dir + file_name + '_diff_summary.csv')
         diff_plot = pm.plot_posterior(trace, varnames=diffs,
                                       ref_val=0,
                                       color='#87ceeb')
@@ -145,7 +143,7 @@ for file_name, model_name in zip(file_names, model_names):
 
 # Compare WAIC scores
 if compare_models:
-    model_comparison_summary = pm.compare(model_dict)
+    model_comparison_summary = compare_waic(waic_dict)
     pd.DataFrame(model_comparison_summary).to_csv(save_dir + file_name + '_model_comparison_summary.csv')
 
     pm.compareplot(model_comparison_summary)
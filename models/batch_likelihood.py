@@ -0,0 +1,613 @@
+import hashlib
+
+import numpy as np
+from scipy.ndimage import minimum_filter
+from shared_softmax import softmax_with_epsilon
+
+
+def get_ps_rl_LLs(all_pars, actions, rewards, agent_stuff, task_stuff):
+    """Trial-wise log likelihoods of ps_agents.RLAgent for many parameter vectors at once.
+
+    :param all_pars: parameters in the order of get_parameter_stuff; shape [n_candidates, n_pars]
+    :param actions: selected boxes; int array of shape [n_trials]
+    :param rewards: rewards; int array of shape [n_trials]
+    :return: log likelihoods; shape [n_candidates, n_trials]
+    """
+
+    # Get parameters on the right scale (same as RLAgent.__init__ and RLAgent.adjust_parameters)
+    [alpha, alpha_high, beta, beta_high, epsilon, forget] = np.array(all_pars, dtype=float).T
+    alpha_high = np.where(alpha_high == 99, alpha, alpha_high)
+    beta_high = np.where(beta_high == 99, beta, beta_high)
+    forget_high = forget.copy()
+    beta = beta * agent_stuff['beta_scaler']
+    beta_high = beta_high * agent_stuff['beta_high_scaler']
+    alpha_high = np.where(alpha_high == 99, alpha, alpha_high)
+    beta_high = np.where(beta_high == 99, beta, beta_high)
+
+    # Set up value tables for all candidates
+    n_cand, n_trials = len(alpha), len(actions)
+    n_actions, n_TS = task_stuff['n_actions'], agent_stuff['n_TS']
+    initial_Q = 1. / n_actions
+    Q_high = np.tile([1., 0.], (n_cand, 1))  # [n_cand, n_TS]
+    Q_low = initial_Q * np.ones([n_cand, n_TS, n_actions])
+    counter = 'counter' in agent_stuff['learning_style']
+
+    LLs = np.zeros([n_cand, n_trials])
+    for trial in range(n_trials):
+        action, reward = actions[trial], rewards[trial]
+
+        # Calculate probabilities for each TS from Q_high, and for each action from the weighted Q_low
+        p_TS = np.clip(softmax_with_epsilon(Q_high, beta_high[:, np.newaxis]), 0, 1)
+        Q_actions = np.einsum('ct,cta->ca', p_TS, Q_low)
+        p_actions = softmax_with_epsilon(Q_actions, beta[:, np.newaxis], epsilon[:, np.newaxis])
+        p_actions = np.clip(p_actions, 0, 1)
+
+        # Forget Q-values
+        Q_low -= forget[:, np.newaxis, np.newaxis] * (Q_low - initial_Q)
+        Q_high -= forget_high[:, np.newaxis] * (Q_high - initial_Q)
+
+        # Calculate trial log likelihood, RPEs, and update Q-values
+        LLs[:, trial] = np.log(p_actions[:, action])
+        RPEs_high = reward - Q_high
+        RPEs_low = reward - Q_low[:, :, action]
+        Q_high += alpha_high[:, np.newaxis] * p_TS * RPEs_high
+        update_low = alpha[:, np.newaxis] * p_TS * RPEs_low
+        Q_low[:, :, action] += update_low
+        if counter:
+            Q_low[:, :, 1 - action] -= update_low
+
+    return LLs
+
+
+def get_ps_rl_LL_grads(all_pars, actions, rewards, agent_stuff, task_stuff, grad_idx):
+    """Log likelihoods of get_ps_rl_LLs and their gradient, from forward-mode sensitivities: the derivatives of all
+    values with respect to the parameters are carried along the trials with the values.
+
+    :param grad_idx: columns of all_pars (parameters) that the gradient is taken with respect to
+    :return: log likelihoods, shape [n_candidates, n_trials]; gradient of their sum, shape [n_candidates, n_grad]
+    """
+
+    # Get parameters on the right scale (same as get_ps_rl_LLs) and their derivatives
+    all_pars = np.array(all_pars, dtype=float)
+    [alpha, alpha_high, beta, beta_high, epsilon, forget] = all_pars.T
+    [d_alpha, d_alpha_high, d_beta, d_beta_high, d_epsilon, d_forget] = get_par_tangents(all_pars, grad_idx)
+    d_alpha_high = np.where(alpha_high[:, np.newaxis] == 99, d_alpha, d_alpha_high)
+    alpha_high = np.where(alpha_high == 99, alpha, alpha_high)
+    d_beta_high = np.where(beta_high[:, np.newaxis] == 99, d_beta, d_beta_high)
+    beta_high = np.where(beta_high == 99, beta, beta_high)
+    beta, d_beta = beta * agent_stuff['beta_scaler'], d_beta * agent_stuff['beta_scaler']
+    beta_high, d_beta_high = beta_high * agent_stuff['beta_high_scaler'], d_beta_high * agent_stuff['beta_high_scaler']
+
+    # Set up value tables for all candidates, and their derivatives (last axis)
+    n_cand, n_trials, n_grad = len(alpha), len(actions), len(grad_idx)
+    n_actions, n_TS = task_stuff['n_actions'], agent_stuff['n_TS']
+    initial_Q = 1. / n_actions
+    Q_high = np.tile([1., 0.], (n_cand, 1))
+    Q_low = initial_Q * np.ones([n_cand, n_TS, n_actions])
+    d_Q_high = np.zeros([n_cand, n_TS, n_grad])
+    d_Q_low = np.zeros([n_cand, n_TS, n_actions, n_grad])
+    keep_low, keep_high = (1 - forget)[:, np.newaxis, np.newaxis, np.newaxis], (1 - forget)[:, np.newaxis, np.newaxis]
+    counter = 'counter' in agent_stuff['learning_style']
+
+    LLs = np.zeros([n_cand, n_trials])
+    d_LL = np.zeros([n_cand, n_grad])
+    for trial in range(n_trials):
+        action, reward = actions[trial], rewards[trial]
+
+        # Calculate probabilities for each TS from Q_high, and for each action from the weighted Q_low
+        p_TS, d_p_TS = get_softmax_grad(Q_high, d_Q_high, beta_high, d_beta_high)  # in [0, 1] without clipping
+        Q_actions = np.einsum('ct,cta->ca', p_TS, Q_low)
+        d_Q_actions = np.einsum('ctd,cta->cad', d_p_TS, Q_low) + np.einsum('ct,ctad->cad', p_TS, d_Q_low)
+        p_actions, d_p_actions = get_softmax_grad(Q_actions, d_Q_actions, beta, d_beta, epsilon, d_epsilon)
+        d_p_actions[(p_actions < 0) | (p_actions > 1)] = 0
+        p_actions = np.clip(p_actions, 0, 1)
+
+        # Forget Q-values
+        forgotten_low, forgotten_high = Q_low - initial_Q, Q_high - initial_Q
+        Q_low -= forget[:, np.newaxis, np.newaxis] * forgotten_low
+        Q_high -= forget[:, np.newaxis] * forgotten_high
+        d_Q_low = keep_low * d_Q_low - d_forget[:, np.newaxis, np.newaxis] * forgotten_low[..., np.newaxis]
+        d_Q_high = keep_high * d_Q_high - d_forget[:, np.newaxis] * forgotten_high[..., np.newaxis]
+
+        # Calculate trial log likelihood, RPEs, and update Q-values
+        LLs[:, trial] = np.log(p_actions[:, action])
+        d_LL += d_p_actions[:, action] / p_actions[:, action, np.newaxis]
+        update_high, d_update_high = get_update_grad(alpha_high, d_alpha_high, p_TS, d_p_TS,
+                                                     reward - Q_high, -d_Q_high)
+        Q_high += update_high
+        d_Q_high += d_update_high
+        update_low, d_update_low = get_update_grad(alpha, d_alpha, p_TS, d_p_TS,
+                                                   reward - Q_low[:, :, action], -d_Q_low[:, :, action])
+        Q_low[:, :, action] += update_low
+        d_Q_low[:, :, action] += d_update_low
+        if counter:
+            Q_low[:, :, 1 - action] -= update_low
+            d_Q_low[:, :, 1 - action] -= d_update_low
+
+    return LLs, d_LL
+
+
+def get_ps_bayes_LLs(all_pars, actions, rewards, task_stuff):
+    """Trial-wise log likelihoods of ps_agents.BayesAgent for many parameter vectors at once.
+
+    :param all_pars: parameters in the order of get_parameter_stuff; shape [n_candidates, n_pars]
+    :param actions: selected boxes; int array of shape [n_trials]
+    :param rewards: rewards; int array of shape [n_trials]
+    :return: log likelihoods; shape [n_candidates, n_trials]
+    """
+
+    epsilon = np.array(all_pars, dtype=float)[:, 4, np.newaxis]
+    p_switch = task_stuff['p_reward'] / np.mean(task_stuff['av_run_length'])
+    p_reward = task_stuff['p_reward']
+
+    n_cand, n_trials, n_actions = len(epsilon), len(actions), task_stuff['n_actions']
+    p_actions = np.ones([n_cand, n_actions]) / n_actions
+
+    LLs = np.zeros([n_cand, n_trials])
+    for trial in range(n_trials):
+        action, reward = actions[trial], rewards[trial]
+        LLs[:, trial] = np.log(p_actions[:, action])
+
+        # Get likelihood [P(r|non_chosen_box==magic), P(r|chosen_box=magic)]
+        if reward:
+            lik_boxes = np.zeros(n_actions) + 0.001
+            lik_boxes[action] = p_reward
+        else:
+            lik_boxes = np.ones(n_actions) - 0.001
+            lik_boxes[action] = 1 - p_reward
+
+        # Get posterior, take switches into account, and add epsilon noise
+        posterior = lik_boxes * p_actions / np.sum(lik_boxes * p_actions, axis=1, keepdims=True)
+        p_actions = (1 - p_switch) * posterior + p_switch * (1 - posterior)
+        p_actions = epsilon / n_actions + (1 - epsilon) * p_actions
+
+        # Candidates with probabilities outside [0, 1] get p=0 (same as BayesAgent)
+        out_of_range = np.any((p_actions > 1) | (p_actions < 0), axis=1)
+        p_actions[out_of_range] = 0
+
+    return LLs
+
+
+def get_ps_bayes_LL_grads(all_pars, actions, rewards, task_stuff, grad_idx):
+    """Log likelihoods of get_ps_bayes_LLs and their gradient, from forward-mode sensitivities (see get_ps_rl_LL_grads).
+
+    :param grad_idx: columns of all_pars (parameters) that the gradient is taken with respect to
+    :return: log likelihoods, shape [n_candidates, n_trials]; gradient of their sum, shape [n_candidates, n_grad]
+    """
+
+    all_pars = np.array(all_pars, dtype=float)
+    epsilon, d_epsilon = all_pars[:, 4, np.newaxis], get_par_tangents(all_pars, grad_idx)[4][:, np.newaxis]
+    p_switch = task_stuff['p_reward'] / np.mean(task_stuff['av_run_length'])
+    p_reward = task_stuff['p_reward']
+
+    n_cand, n_trials, n_actions, n_grad = len(epsilon), len(actions), task_stuff['n_actions'], len(grad_idx)
+    p_actions = np.ones([n_cand, n_actions]) / n_actions
+    d_p_actions = np.zeros([n_cand, n_actions, n_grad])
+
+    LLs = np.zeros([n_cand, n_trials])
+    d_LL = np.zeros([n_cand, n_grad])
+    for trial in range(n_trials):
+        action, reward = actions[trial], rewards[trial]
+        LLs[:, trial] = np.log(p_actions[:, action])
+        d_LL += d_p_actions[:, action] / p_actions[:, action, np.newaxis]
+
+        # Get likelihood [P(r|non_chosen_box==magic), P(r|chosen_box=magic)]
+        if reward:
+            lik_boxes = np.zeros(n_actions) + 0.001
+            lik_boxes[action] = p_reward
+        else:
+            lik_boxes = np.ones(n_actions) - 0.001
+            lik_boxes[action] = 1 - p_reward
+
+        # Get posterior, take switches into account, and add epsilon noise
+        joint, d_joint = lik_boxes * p_actions, lik_boxes[:, np.newaxis] * d_p_actions
+        evidence, d_evidence = np.sum(joint, axis=1, keepdims=True), np.sum(d_joint, axis=1, keepdims=True)
+        posterior = joint / evidence
+        d_posterior = (d_joint - posterior[..., np.newaxis] * d_evidence) / evidence[..., np.newaxis]
+        p_actions = (1 - p_switch) * posterior + p_switch * (1 - posterior)
+        d_p_actions = (1 - 2 * p_switch) * d_posterior
+        d_p_actions = d_epsilon * (1 / n_actions - p_actions[..., np.newaxis]) + \
+            (1 - epsilon[..., np.newaxis]) * d_p_actions
+        p_actions = epsilon / n_actions + (1 - epsilon) * p_actions
+
+        # Candidates with probabilities outside [0, 1] get p=0 (same as BayesAgent)
+        out_of_range = np.any((p_actions > 1) | (p_actions < 0), axis=1)
+        p_actions[out_of_range] = 0
+        d_p_actions[out_of_range] = 0
+
+    return LLs, d_LL
+
+
+def get_aliens_LLs(all_pars, contexts, aliens, actions, rewards, agent_stuff, task_stuff):
+    """Trial-wise log likelihoods of alien_agents.Agent in 1InitialLearning for many parameter vectors at once.
+
+    :param all_pars: parameters in the order of get_parameter_stuff; shape [n_candidates, n_pars]
+    :param contexts, aliens, actions, rewards: int arrays of shape [n_trials]
+    :return: log likelihoods; shape [n_candidates, n_trials]
+    """
+
+    # Get parameters on the right scale (same as Agent.__init__ and Agent.adjust_parameters)
+    [alpha, alpha_high, beta, beta_high, epsilon, forget, TS_bias] = np.array(all_pars, dtype=float).T
+    forget_high = forget.copy()
+    beta = beta * agent_stuff['beta_scaler']
+    beta_high = beta_high * agent_stuff['beta_high_scaler']
+    TS_bias = TS_bias * agent_stuff['TS_bias_scaler']
+    alpha_high = np.where(alpha_high == 99, alpha, alpha_high)
+    beta_high = np.where(beta_high == 99, beta, beta_high)
+
+    # Set up value tables for all candidates
+    n_cand, n_trials = len(alpha), len(actions)
+    n_actions, n_contexts, n_aliens, n_TS = \
+        task_stuff['n_actions'], task_stuff['n_contexts'], task_stuff['n_aliens'], agent_stuff['n_TS']
+    Q_high = np.zeros([n_cand, n_contexts + 2, n_TS + 2])
+    Q_low = np.zeros([n_cand, n_contexts + 2, n_aliens, n_actions])
+    initial_Q = 5. / 3.
+
+    # Find the trials in which the agent creates a new TS (depends on the data only, not on parameters)
+    new_TS = get_new_TS_trials(contexts)
+
+    LLs = np.zeros([n_cand, n_trials])
+    for trial in range(n_trials):
+        context, alien, action, reward = contexts[trial], aliens[trial], actions[trial], rewards[trial]
+
+        # Initialize a new TS column in Q_high (biased for the new context) and new TS in Q_low
+        if new_TS[trial] >= 0:
+            TS = new_TS[trial]
+            Q_high[:, :, TS] = initial_Q
+            Q_high[:, TS, TS] *= TS_bias
+            Q_low[:, TS] = initial_Q
+
+        # Calculate probabilities for each TS from Q_high, and for each action from the weighted Q_low
+        p_TS = softmax_with_epsilon(Q_high[:, context], beta_high[:, np.newaxis])
+        Q_actions = np.einsum('ct,cta->ca', p_TS, Q_low[:, :, alien])
+        p_actions = softmax_with_epsilon(Q_actions, beta[:, np.newaxis], epsilon[:, np.newaxis])
+
+        # Forget Q-values (decay toward 1)
+        Q_low -= forget[:, np.newaxis, np.newaxis, np.newaxis] * (Q_low - 1)
+        Q_high -= forget_high[:, np.newaxis, np.newaxis] * (Q_high - 1)
+
+        # Calculate RPEs, update Q-values, and calculate trial log likelihood
+        RPEs_high = reward - Q_high[:, context]
+        RPEs_low = reward - Q_low[:, :, alien, action]
+        Q_low[:, :, alien, action] += alpha[:, np.newaxis] * p_TS * RPEs_low
+        Q_high[:, context] += alpha_high[:, np.newaxis] * p_TS * RPEs_high
+        LLs[:, trial] = np.log(p_actions[:, action])
+
+    return LLs
+
+
+def get_aliens_LL_grads(all_pars, contexts, aliens, actions, rewards, agent_stuff, task_stuff, grad_idx):
+    """Log likelihoods of get_aliens_LLs and their gradient, from forward-mode sensitivities (see get_ps_rl_LL_grads).
+
+    :param grad_idx: columns of all_pars (parameters) that the gradient is taken with respect to
+    :return: log likelihoods, shape [n_candidates, n_trials]; gradient of their sum, shape [n_candidates, n_grad]
+    """
+
+    # Get parameters on the right scale (same as get_aliens_LLs) and their derivatives
+    all_pars = np.array(all_pars, dtype=float)
+    [alpha, alpha_high, beta, beta_high, epsilon, forget, TS_bias] = all_pars.T
+    [d_alpha, d_alpha_high, d_beta, d_beta_high, d_epsilon, d_forget, d_TS_bias] = \
+        get_par_tangents(all_pars, grad_idx)
+    beta, d_beta = beta * agent_stuff['beta_scaler'], d_beta * agent_stuff['beta_scaler']
+    beta_high, d_beta_high = beta_high * agent_stuff['beta_high_scaler'], d_beta_high * agent_stuff['beta_high_scaler']
+    TS_bias, d_TS_bias = TS_bias * agent_stuff['TS_bias_scaler'], d_TS_bias * agent_stuff['TS_bias_scaler']
+    d_alpha_high = np.where(alpha_high[:, np.newaxis] == 99, d_alpha, d_alpha_high)
+    alpha_high = np.where(alpha_high == 99, alpha, alpha_high)
+    d_beta_high = np.where(beta_high[:, np.newaxis] == 99, d_beta, d_beta_high)
+    beta_high = np.where(beta_high == 99, beta, beta_high)
+
+    # Set up value tables for all candidates, and their derivatives (last axis)
+    n_cand, n_trials, n_grad = len(alpha), len(actions), len(grad_idx)
+    n_actions, n_contexts, n_aliens, n_TS = \
+        task_stuff['n_actions'], task_stuff['n_contexts'], task_stuff['n_aliens'], agent_stuff['n_TS']
+    Q_high = np.zeros([n_cand, n_contexts + 2, n_TS + 2])
+    Q_low = np.zeros([n_cand, n_contexts + 2, n_aliens, n_actions])
+    d_Q_high = np.zeros([n_cand, n_contexts + 2, n_TS + 2, n_grad])
+    d_Q_low = np.zeros([n_cand, n_contexts + 2, n_aliens, n_actions, n_grad])
+    initial_Q = 5. / 3.
+    keep_low, keep_high = (1 - forget)[:, np.newaxis, np.newaxis, np.newaxis, np.newaxis], \
+        (1 - forget)[:, np.newaxis, np.newaxis, np.newaxis]
+    new_TS = get_new_TS_trials(contexts)
+
+    LLs = np.zeros([n_cand, n_trials])
+    d_LL = np.zeros([n_cand, n_grad])
+    for trial in range(n_trials):
+        context, alien, action, reward = contexts[trial], aliens[trial], actions[trial], rewards[trial]
+
+        # Initialize a new TS column in Q_high (biased for the new context) and new TS in Q_low
+        if new_TS[trial] >= 0:
+            TS = new_TS[trial]
+            Q_high[:, :, TS] = initial_Q
+            d_Q_high[:, :, TS] = 0
+            d_Q_high[:, TS, TS] = initial_Q * d_TS_bias
+            Q_high[:, TS, TS] *= TS_bias
+            Q_low[:, TS] = initial_Q
+            d_Q_low[:, TS] = 0
+
+        # Calculate probabilities for each TS from Q_high, and for each action from the weighted Q_low
+        p_TS, d_p_TS = get_softmax_grad(Q_high[:, context], d_Q_high[:, context], beta_high, d_beta_high)
+        Q_actions = np.einsum('ct,cta->ca', p_TS, Q_low[:, :, alien])
+        d_Q_actions = np.einsum('ctd,cta->cad', d_p_TS, Q_low[:, :, alien]) + \
+            np.einsum('ct,ctad->cad', p_TS, d_Q_low[:, :, alien])
+        p_actions, d_p_actions = get_softmax_grad(Q_actions, d_Q_actions, beta, d_beta, epsilon, d_epsilon)
+
+        # Forget Q-values (decay toward 1)
+        forgotten_low, forgotten_high = Q_low - 1, Q_high - 1
+        Q_low -= forget[:, np.newaxis, np.newaxis, np.newaxis] * forgotten_low
+        Q_high -= forget[:, np.newaxis, np.newaxis] * forgotten_high
+        d_Q_low = keep_low * d_Q_low - d_forget[:, np.newaxis, np.newaxis, np.newaxis] * forgotten_low[..., np.newaxis]
+        d_Q_high = keep_high * d_Q_high - d_forget[:, np.newaxis, np.newaxis] * forgotten_high[..., np.newaxis]
+
+        # Calculate RPEs, update Q-values, and calculate trial log likelihood
+        update_low, d_update_low = get_update_grad(alpha, d_alpha, p_TS, d_p_TS, reward - Q_low[:, :, alien, action],
+                                                   -d_Q_low[:, :, alien, action])
+        update_high, d_update_high = get_update_grad(alpha_high, d_alpha_high, p_TS, d_p_TS,
+                                                     reward - Q_high[:, context], -d_Q_high[:, context])
+        Q_low[:, :, alien, action] += update_low
+        d_Q_low[:, :, alien, action] += d_update_low
+        Q_high[:, context] += update_high
+        d_Q_high[:, context] += d_update_high
+        LLs[:, trial] = np.log(p_actions[:, action])
+        d_LL += d_p_actions[:, action] / p_actions[:, action, np.newaxis]
+
+    return LLs, d_LL
+
+
+def get_new_TS_trials(contexts):
+
+    # Replay Agent.handle_context and Agent.create_new_TS: index of the new TS in each trial, or -1
+    new_TS = np.full(len(contexts), -1, dtype=int)
+    context_ext = 99
+    seen_seasons = []
+    for trial, context in enumerate(contexts):
+        if context != context_ext and context not in seen_seasons:
+            new_TS[trial] = len(seen_seasons)
+            seen_seasons.append(context)
+        context_ext = context
+    return new_TS
+
+
+def get_par_tangents(all_pars, grad_idx):
+
+    # Derivatives of each parameter (column of all_pars) with respect to the parameters in grad_idx: [n_cand, n_grad]
+    n_cand, n_pars = all_pars.shape
+    return list(np.tile(np.eye(n_pars)[:, grad_idx], (n_cand, 1, 1)).transpose(1, 0, 2))
+
+
+def get_softmax_grad(Q, d_Q, beta, d_beta, epsilon=None, d_epsilon=None):
+
+    # softmax_with_epsilon over the last axis of Q ([n_cand, n_options]; same operations) and its sensitivities
+    # ([n_cand, n_options, n_grad]), given those of Q ([n_cand, n_options, n_grad]), beta, and epsilon ([n_cand] and
+    # [n_cand, n_grad]); without epsilon noise if epsilon is None
+    y = beta[:, np.newaxis] * Q
+    p = np.exp(y - y.max(axis=-1, keepdims=True))
+    p /= p.sum(axis=-1, keepdims=True)
+    d_y = d_beta[:, np.newaxis] * Q[..., np.newaxis] + beta[:, np.newaxis, np.newaxis] * d_Q
+    d_p = p[..., np.newaxis] * (d_y - np.einsum('co,cod->cd', p, d_y)[:, np.newaxis])
+    if epsilon is not None:
+        n_options = Q.shape[-1]
+        d_p = d_epsilon[:, np.newaxis] * (1 / n_options - p[..., np.newaxis]) + \
+            (1 - epsilon[:, np.newaxis, np.newaxis]) * d_p
+        p = epsilon[:, np.newaxis] / n_options + (1 - epsilon[:, np.newaxis]) * p
+    return p, d_p
+
+
+def get_update_grad(alpha, d_alpha, p_TS, d_p_TS, RPEs, d_RPEs):
+
+    # Q-value update alpha * p_TS * RPEs ([n_cand, n_TS]) and its sensitivities ([n_cand, n_TS, n_grad])
+    update = alpha[:, np.newaxis] * p_TS * RPEs
+    d_update = d_alpha[:, np.newaxis] * (p_TS * RPEs)[..., np.newaxis] + \
+        alpha[:, np.newaxis, np.newaxis] * (d_p_TS * RPEs[..., np.newaxis] + p_TS[..., np.newaxis] * d_RPEs)
+    return update, d_update
+
+
+def batch_differential_evolution(func, bounds, args=(), pop_size=15, max_generations=1000, mutation=0.7,
+                                 crossover=0.9, tol=1e-6, callback=None, init=None):
+    """Differential evolution (DE/rand/1/bin) that scores each generation with a single call of func.
+
+    :param func: function that takes an array of shape [n_points, n_dims] (and args) and returns n_points values
+    :param bounds: [(min, max)] of each dimension; candidates never leave them
+    :param pop_size: population size per dimension (like scipy.optimize.differential_evolution's popsize)
+    :param callback: called with (population, values) of every generation, including the initial one
+    :param init: points that replace the first members of the random initial population (e.g., best grid points)
+    :return: (x0, fval) of the best candidate
+    """
+
+    # Initial population spread over the whole parameter space
+    lower, upper = np.array(bounds, dtype=float).T
+    n_pop, n_dims = max(5, pop_size * len(bounds)), len(bounds)
+    population = lower + np.random.rand(n_pop, n_dims) * (upper - lower)
+    if init is not None:
+        init = np.atleast_2d(init)[:n_pop // 2]  # keep at least half of the population random
+        population[:len(init)] = init
+    values = get_finite(func(population, *args))
+    if callback:
+        callback(population, values)
+
+    for generation in range(max_generations):
+
+        # Mutants from three other random members; crossover keeps each coordinate of the member with p=1-crossover
+        others = np.array([np.random.choice(np.delete(np.arange(n_pop), i), 3, replace=False) for i in range(n_pop)])
+        mutants = population[others[:, 0]] + mutation * (population[others[:, 1]] - population[others[:, 2]])
+        cross = np.random.rand(n_pop, n_dims) < crossover
+        cross[np.arange(n_pop), np.random.randint(n_dims, size=n_pop)] = True  # at least one coordinate changes
+        trials = np.where(cross, mutants, population)
+
+        # Coordinates outside the bounds are drawn again uniformly
+        outside = (trials < lower) | (trials > upper)
+        trials[outside] = (lower + np.random.rand(n_pop, n_dims) * (upper - lower))[outside]
+
+        # Score the whole generation at once; trials that are at least as good replace their member
+        trial_values = get_finite(func(trials, *args))
+        better = trial_values <= values
+        population[better], values[better] = trials[better], trial_values[better]
+        if callback:
+            callback(trials, trial_values)
+
+        # Stop when the population has converged (same criterion as scipy)
+        if np.std(values) <= tol * np.abs(np.mean(values)):
+            break
+
+    best = np.argmin(values)
+    return population[best], values[best]
+
+
+def get_finite(values):
+
+    # Candidates with NLL nan or inf (e.g., p=0 for an observed action) lose every comparison
+    values = np.array(values, dtype=float)
+    values[~np.isfinite(values)] = np.inf
+    return values
+
+
+def batch_adaptive_grid(func, ranges, budget, n_keep=10, args=()):
+    """Coarse-to-fine grid search with a fixed budget of function evaluations (instead of Ns ** n_dims for a full grid).
+
+    A coarse grid (about a third of the budget) is refined around the n_keep best points found so far: each level
+    halves the grid spacing and evaluates the 3 ** n_dims - 1 neighbors of every kept point, each level in one call.
+
+    :param func: function that takes an array of shape [n_points, n_dims] (and args) and returns n_points values
+    :return: dict with 'x0', 'fval', and all evaluated 'points' ([n_points, n_dims]) and 'values' ([n_points]),
+        the 'ranges' (a sparse grid; see PlotMinimizerHeatmap.get_min_projection), and the 'coarse_shape' of the
+        coarse grid, whose points come first (see get_grid_seeds)
+    """
+
+    # Coarse grid
+    lower, upper = np.array(ranges, dtype=float).T
+    n_dims = len(ranges)
+    n_coarse = max(2, int((budget / 3) ** (1 / n_dims)))
+    points = np.mgrid[tuple(slice(lo, hi, complex(n_coarse)) for lo, hi in ranges)].reshape(n_dims, -1).T
+    values = get_finite(func(points, *args))
+    spacing = (upper - lower) / (n_coarse - 1)
+    evaluated = set(map(tuple, np.round(points, 10).tolist()))
+
+    # Neighbors of a point at the current spacing (all combinations of -1, 0, 1 along each axis, except 0, ..., 0)
+    offsets = np.mgrid[(slice(-1, 2),) * n_dims].reshape(n_dims, -1).T
+    offsets = offsets[np.any(offsets != 0, axis=1)]
+
+    # Refine around the best points until the budget is used up
+    all_points, all_values = [points], [values]
+    n_left = budget - len(points)
+    while n_left >= len(offsets) and np.all(spacing > 1e-6 * (upper - lower)):
+        spacing = spacing / 2
+        points, values = np.concatenate(all_points), np.concatenate(all_values)
+        centers = points[np.argsort(values)[:min(n_keep, n_left // len(offsets))]]
+        new_points = np.clip((centers[:, np.newaxis] + offsets * spacing).reshape(-1, n_dims), lower, upper)
+        new_points = np.array([point for point in np.unique(np.round(new_points, 10), axis=0)
+                               if tuple(point) not in evaluated])
+        if len(new_points) == 0:
+            continue
+        evaluated.update(map(tuple, new_points.tolist()))
+        all_points.append(new_points)
+        all_values.append(get_finite(func(new_points, *args)))
+        n_left -= len(new_points)
+
+    points, values = np.concatenate(all_points), np.concatenate(all_values)
+    best = np.argmin(values)
+    return {'x0': points[best], 'fval': values[best], 'points': points, 'values': values, 'ranges': ranges,
+            'coarse_shape': (n_coarse,) * n_dims}
+
+
+def get_grid_seeds(grid_results, n_seeds):
+    """Starting points for a minimizer from batch_adaptive_grid: the n_seeds best local minima of the coarse grid
+    (neighbors of a chosen minimum are skipped), each replaced by the best point evaluated in its coarse cell.
+    The best points of the whole grid would all lie in the same refined cell. Returns [n_found, n_dims] points,
+    with n_found <= n_seeds.
+    """
+
+    # Local minima of the coarse grid, best first
+    coarse_shape = grid_results['coarse_shape']
+    coarse_values = grid_results['values'][:int(np.prod(coarse_shape))].reshape(coarse_shape)
+    is_minimum = (coarse_values == minimum_filter(coarse_values, size=3, mode='nearest')) & np.isfinite(coarse_values)
+    minima = np.flatnonzero(is_minimum)
+    minima = minima[np.argsort(coarse_values.ravel()[minima])]
+
+    # Keep minima that are not next to a better one, and refine each within its coarse cell
+    points, values = grid_results['points'], grid_results['values']
+    lower, upper = np.array(grid_results['ranges'], dtype=float).T
+    spacing = (upper - lower) / (np.array(coarse_shape) - 1)
+    chosen, seeds = [], []
+    for minimum in minima:
+        cell = np.array(np.unravel_index(minimum, coarse_shape))
+        if any(np.all(np.abs(cell - other) <= 1) for other in chosen):
+            continue
+        chosen.append(cell)
+        in_cell = np.all(np.abs(points - points[minimum]) <= spacing / 2 + 1e-10, axis=1)
+        seeds.append(points[in_cell][np.argmin(values[in_cell])])
+        if len(seeds) == n_seeds:
+            break
+    return np.array(seeds).reshape(-1, len(coarse_shape))
+
+
+class BatchLikelihood(object):
+    def __init__(self, data_set, learning_style, task_stuff, agent_stuff, agent_data, batch_size=10000):
+        self.data_set = data_set
+        self.learning_style = learning_style
+        self.task_stuff = task_stuff
+        self.agent_stuff = agent_stuff
+        self.agent_data = agent_data
+        self.batch_size = batch_size  # max. number of candidates that are evaluated together (limits memory)
+
+        # Read the trial sequence into int arrays once
+        if data_set == 'Aliens':
+            self.contexts = agent_data['context'].astype(float).values.astype(int)
+            self.aliens = agent_data['sad_alien'].astype(float).values.astype(int)
+            self.actions = agent_data['item_chosen'].astype(float).values.astype(int)
+            self.rewards = agent_data['reward'].astype(float).values.astype(int)
+        else:
+            self.actions = agent_data['selected_box'].astype(float).values.astype(int)
+            self.rewards = agent_data['reward'].astype(float).values.astype(int)
+        self.n_trials = len(self.actions)
+
+        # Identifies the data in NLL caches (nll_cache.NLLCache)
+        trial_arrays = [self.contexts, self.aliens, self.actions, self.rewards] if data_set == 'Aliens' \
+            else [self.actions, self.rewards]
+        self.data_hash = hashlib.md5(np.array(trial_arrays, dtype=np.int64).tobytes()).hexdigest()
+
+    def get_LLs(self, all_pars):
+        """Trial-wise log likelihoods; all_pars.shape -> [n_candidates, n_pars]; returns [n_candidates, n_trials]"""
+
+        all_pars = np.atleast_2d(all_pars)
+        with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            if self.data_set == 'Aliens':
+                return get_aliens_LLs(all_pars, self.contexts, self.aliens, self.actions, self.rewards,
+                                      self.agent_stuff, self.task_stuff)
+            elif self.learning_style == 'Bayes':
+                return get_ps_bayes_LLs(all_pars, self.actions, self.rewards, self.task_stuff)
+            else:
+                return get_ps_rl_LLs(all_pars, self.actions, self.rewards, self.agent_stuff, self.task_stuff)
+
+    def get_LL(self, all_pars):
+        """Summed log likelihoods; all_pars.shape -> [n_candidates, n_pars]; returns [n_candidates]"""
+
+        all_pars = np.atleast_2d(all_pars)
+        return np.concatenate([np.sum(self.get_LLs(all_pars[i:i + self.batch_size]), axis=1)
+                               for i in range(0, len(all_pars), self.batch_size)])
+
+    def get_LL_and_grad(self, all_pars, grad_idx):
+        """Summed log likelihoods and their gradient with respect to the parameters in grad_idx (columns of all_pars),
+        from forward-mode sensitivities; returns [n_candidates] and [n_candidates, len(grad_idx)]"""
+
+        all_pars = np.atleast_2d(all_pars)
+        with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            if self.data_set == 'Aliens':
+                LLs, d_LL = get_aliens_LL_grads(all_pars, self.contexts, self.aliens, self.actions, self.rewards,
+                                                self.agent_stuff, self.task_stuff, grad_idx)
+            elif self.learning_style == 'Bayes':
+                LLs, d_LL = get_ps_bayes_LL_grads(all_pars, self.actions, self.rewards, self.task_stuff, grad_idx)
+            else:
+                LLs, d_LL = get_ps_rl_LL_grads(all_pars, self.actions, self.rewards, self.agent_stuff,
+                                               self.task_stuff, grad_idx)
+        return np.sum(LLs, axis=1), d_LL
+
+    def get_numerical_grad(self, all_pars, grad_idx, step=1e-6):
+        """Central differences of get_LL, to check get_LL_and_grad; returns [n_candidates, len(grad_idx)]"""
+
+        all_pars = np.atleast_2d(np.array(all_pars, dtype=float))
+        grad = np.zeros([len(all_pars), len(grad_idx)])
+        for i, par in enumerate(grad_idx):
+            pars_plus, pars_minus = all_pars.copy(), all_pars.copy()
+            pars_plus[:, par] += step
+            pars_minus[:, par] -= step
+            grad[:, i] = (self.get_LL(pars_plus) - self.get_LL(pars_minus)) / (2 * step)
+        return grad
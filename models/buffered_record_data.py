@@ -0,0 +1,57 @@
+import numpy as np
+import pandas as pd
+
+
+class BufferedRecordData(object):
+    """
+    Base of the RecordData classes (ps_record_data, alien_record_data): trial-wise values are collected in numpy
+    column buffers and only moved into the data frame subj_file when columns are set or the data is read (get).
+    """
+
+    def __init__(self, subj_file):
+        self.buffers = dict()
+        self.subj_file = subj_file
+        self.n_rows = self.subj_file.shape[0]
+
+    def set_value(self, trial, col, value):
+
+        # Write into the column buffer (created on first use from the existing column, or filled with NaN)
+        if col not in self.buffers:
+            if col in self.subj_file.columns:
+                buffer = self.subj_file[col].to_numpy(copy=True)
+                if buffer.dtype.kind in 'biu':
+                    buffer = buffer.astype(float)
+            else:
+                buffer = np.full(self.n_rows, np.nan)
+            self.buffers[col] = buffer
+        if isinstance(value, str) and self.buffers[col].dtype != object:
+            self.buffers[col] = self.buffers[col].astype(object)
+        self.buffers[col][trial] = value
+
+    def get_value(self, trial, col):
+        if col in self.buffers:
+            return self.buffers[col][trial]
+        return self.subj_file[col].iloc[trial]
+
+    def set_column(self, col, value):
+
+        # Flush buffers first, such that columns keep the order in which they were first written
+        self.flush()
+        self.subj_file[col] = value
+
+    def flush(self):
+
+        # Move all buffers into the data frame at once (new columns are added in the order they were first written)
+        new_cols = dict()
+        for col, buffer in self.buffers.items():
+            if col in self.subj_file.columns:
+                self.subj_file[col] = buffer
+            else:
+                new_cols[col] = buffer
+        if new_cols:
+            self.subj_file = pd.concat([self.subj_file, pd.DataFrame(new_cols, index=self.subj_file.index)], axis=1)
+        self.buffers = dict()
+
+    def get(self):
+        self.flush()
+        return self.subj_file.copy()
@@ -0,0 +1,268 @@
+import os
+import pickle
+
+import numpy as np
+import pymc3 as pm
+from pymc3.backends.base import BaseTrace, MultiTrace
+from pymc3.backends.ndarray import NDArray
+
+from trace_reader import TraceReader, read_json, write_json, write_atomic
+
+
+# Layout of a trace folder:
+# run.json                     draws, tune, chains, tuning draws, and model_spec (model_factory.get_model_from_spec)
+# data.npz                     the data arrays of the model (model_factory.set_data); see TraceReader.load_model
+# chain_<c>/meta.json          names, shapes, dtypes, and number of draws written
+# chain_<c>/<name>.bin         draws of one variable or sampler stat (raw, C order, shape [n_draws] + var_shape)
+# chain_<c>/checkpoint.pickle  step size / mass matrix adaptation at the last write (for resuming)
+
+
+class ChunkedTrace(BaseTrace):
+    """
+    PyMC3 trace backend that appends draws to per-variable files on disk while sampling (every chunk_size draws),
+    rather than keeping the trace in memory until sampling ends, so that an interrupted run keeps its draws and can be
+    continued (sample_chunked). With chain given, an existing chain is opened for reading; draw_idxs selects the
+    draws that are visible (e.g., without tuning draws).
+    """
+
+    supports_sampler_stats = True
+
+    def __init__(self, directory, model=None, vars=None, test_point=None, chunk_size=100, chain=None, draw_idxs=None):
+        super(ChunkedTrace, self).__init__(directory, model, vars, test_point)
+        self.directory = directory
+        self.chunk_size = chunk_size
+        self.draw_idxs = draw_idxs
+        self.resume_from = None  # number of draws of an interrupted run to keep (set by sample_chunked)
+        self.step = None  # step method whose adaptation is checkpointed (only when sampling in this process)
+        self.stop_check = None  # called after each write; sampling stops when it returns True (see convergence.py)
+        self.buffer = {}
+        self.n_draws = 0
+        if chain is not None:
+            self.open_chain(chain)
+            self._set_sampler_vars([{name: np.dtype(dtype) for name, dtype in sampler_stats}
+                                    for sampler_stats in self.meta['sampler_stats']] or None)
+            self.n_draws = self.meta['n_draws']
+
+    # Writing
+    def setup(self, draws, chain, sampler_vars=None):
+        super(ChunkedTrace, self).setup(draws, chain, sampler_vars)
+        self.open_chain(chain)
+        self.meta['sampler_stats'] = [[[name, np.dtype(dtype).str] for name, dtype in sampler_stats.items()]
+                                      for sampler_stats in sampler_vars or []]
+        self.files.update(get_stat_files(self.meta['sampler_stats']))
+
+        # Continue an interrupted run after its last complete write (drop anything written after it), or start anew
+        self.n_draws = min(self.meta['n_draws'], self.resume_from or 0)
+        for name in self.files:
+            with open(self.get_file_name(name), 'ab') as f:
+                f.truncate(self.n_draws * self.get_row_size(name))
+        self.meta['n_draws'] = self.n_draws
+        write_json(os.path.join(self.chain_dir, 'meta.json'), self.meta)
+        self.buffer = {name: [] for name in self.files}
+
+    def record(self, point, sampler_stats=None):
+        for varname, value in zip(self.varnames, self.fn(point)):
+            self.buffer[varname].append(value)
+        for sampler_idx, stats in enumerate(sampler_stats or []):
+            for stat_name, value in stats.items():
+                self.buffer[get_stat_file(sampler_idx, stat_name)].append(value)
+        if len(self.buffer[self.varnames[0]]) >= self.chunk_size:
+            self.flush()
+            if self.stop_check is not None and self.stop_check(self):
+                raise KeyboardInterrupt  # pm.sample ends sampling on KeyboardInterrupt and closes all chains
+
+    def flush(self):
+
+        # Append buffered draws to the files, then update meta.json and the checkpoint
+        n_new = len(self.buffer[self.varnames[0]])
+        if n_new == 0:
+            return
+        for name, values in self.buffer.items():
+            with open(self.get_file_name(name), 'ab') as f:
+                f.write(np.asarray(values, dtype=self.files[name][1]).tobytes())
+            values.clear()
+        self.n_draws += n_new
+        self.meta['n_draws'] = self.n_draws
+        write_json(os.path.join(self.chain_dir, 'meta.json'), self.meta)
+
+        checkpoint = {'n_draws': self.n_draws}
+        if hasattr(self.step, 'potential') and hasattr(self.step, 'step_adapt'):
+            checkpoint.update({'potential': self.step.potential, 'step_adapt': self.step.step_adapt})
+        write_atomic(os.path.join(self.chain_dir, 'checkpoint.pickle'), pickle.dumps(checkpoint))
+
+    def close(self):
+        self.flush()
+
+    # Reading
+    def __len__(self):
+        if self.draw_idxs is not None:
+            return len(self.draw_idxs)
+        return self.n_draws + len(self.buffer.get(self.varnames[0], []))
+
+    def read(self, name):
+
+        # All draws of variable or stat file name (memory-mapped; buffered draws are appended)
+        shape, dtype = self.files[name]
+        if self.n_draws > 0:
+            values = np.memmap(self.get_file_name(name), dtype=dtype, mode='r', shape=(self.n_draws,) + tuple(shape))
+        else:
+            values = np.zeros((0,) + tuple(shape), dtype=dtype)
+        if self.buffer.get(name):
+            values = np.concatenate([values, np.asarray(self.buffer[name], dtype=dtype)])
+        if self.draw_idxs is not None:
+            values = values[self.draw_idxs]
+        return values
+
+    def get_values(self, varname, burn=0, thin=1):
+        return np.array(self.read(varname)[burn::thin])
+
+    def get_sampler_stats(self, varname, sampler_idx=None, burn=0, thin=1):
+        if sampler_idx is not None:
+            return np.array(self.read(get_stat_file(sampler_idx, varname))[burn::thin])
+        values = [np.array(self.read(get_stat_file(i, varname))[burn::thin])
+                  for i, sampler_vars in enumerate(self.sampler_vars) if varname in sampler_vars]
+        return values[0] if len(values) == 1 else np.column_stack(values)
+
+    def point(self, idx):
+        idx = int(idx)
+        return {varname: np.array(self.read(varname)[idx]) for varname in self.varnames}
+
+    def _slice(self, idx):
+
+        # Slices are loaded into memory (pymc3's NDArray)
+        idx = slice(*idx.indices(len(self)))
+        sliced = NDArray(model=self.model, vars=self.vars)
+        sliced.chain = self.chain
+        sliced.samples = {varname: self.get_values(varname)[idx] for varname in self.varnames}
+        sliced.sampler_vars = self.sampler_vars
+        sliced.draw_idx = (idx.stop - idx.start) // idx.step
+        if self.sampler_vars is not None:
+            sliced._stats = [{name: self.get_sampler_stats(name, i)[idx] for name in sampler_vars}
+                             for i, sampler_vars in enumerate(self.sampler_vars)]
+        return sliced
+
+    # Files
+    def open_chain(self, chain):
+        self.chain = chain
+        self.chain_dir = os.path.join(self.directory, 'chain_{0}'.format(chain))
+        if not os.path.isdir(self.chain_dir):
+            os.makedirs(self.chain_dir)
+        meta_file = os.path.join(self.chain_dir, 'meta.json')
+        if os.path.isfile(meta_file):
+            self.meta = read_json(meta_file)
+        else:
+            self.meta = {'n_draws': 0, 'sampler_stats': [],
+                         'vars': [[varname, list(self.var_shapes[varname]), np.dtype(self.var_dtypes[varname]).str]
+                                  for varname in self.varnames]}
+        self.files = {name: [tuple(shape), np.dtype(dtype)] for name, shape, dtype in self.meta['vars']}
+        self.files.update(get_stat_files(self.meta['sampler_stats']))
+
+    def get_file_name(self, name):
+        return os.path.join(self.chain_dir, name + '.bin')
+
+    def get_row_size(self, name):
+        shape, dtype = self.files[name]
+        return int(np.prod(shape)) * dtype.itemsize
+
+
+def get_stat_file(sampler_idx, stat_name):
+    return 'sampler{0}_{1}'.format(sampler_idx, stat_name)
+
+
+def get_stat_files(sampler_stats):
+
+    # Sampler stats (e.g., diverging, step_size) are scalars per draw
+    return {get_stat_file(i, name): [(), np.dtype(dtype)]
+            for i, stats in enumerate(sampler_stats) for name, dtype in stats}
+
+
+def keep_adaptation(*args, **kwargs):
+    pass  # replaces step.reset_tuning when a run continues with the step size / mass matrix of its checkpoint
+
+
+def sample_chunked(directory, model, step, draws, tune, chains=1, cores=1, chunk_size=100, model_spec=None,
+                   data_arrays=None, n_retune=200, stop_check=None, **kwargs):
+    """
+    pm.sample(draws, tune=tune, chains=chains, cores=cores, step=step, **kwargs), writing to a ChunkedTrace in
+    directory. If directory holds an interrupted run, that run is continued (with its own draws, tune, and chains):
+    all chains go on from the last draw that every chain has written. When sampling ran in this process (cores=1),
+    the checkpoint also restores step size and mass matrix; otherwise, or when the run was interrupted during tuning,
+    the chains are tuned again for at least n_retune draws (which are dropped like the first tuning draws).
+    stop_check (e.g., convergence.ConvergenceCheck) can end sampling before all draws are done. model_spec and data_arrays (the arguments of set_data) are saved such that the model
+    can be rebuilt for analysis instead of being pickled. step is left as it was (e.g., for the next run with
+    model_factory.get_step). Returns the trace without tuning draws (see load_chunked_trace).
+    """
+
+    run_file = os.path.join(directory, 'run.json')
+    if os.path.isfile(run_file):
+        run = read_json(run_file)
+        checkpoints = [read_checkpoint(directory, chain) for chain in range(run['chains'])]
+        n_done = min(checkpoint['n_draws'] if checkpoint else 0 for checkpoint in checkpoints)
+        print("Continuing the run in {0} after {1} of {2} draws.".format(directory, n_done, run['tune'] + run['draws']))
+    else:
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        run = {'draws': draws, 'tune': tune, 'chains': chains, 'tuning_draws': [[0, tune]], 'model_spec': model_spec}
+        write_json(run_file, run)
+        if data_arrays is not None:
+            np.savez(os.path.join(directory, 'data.npz'), **data_arrays)
+        checkpoints, n_done = [None] * chains, 0
+
+    # How many draws are left (none after a stop_check has ended the run), and how many of them tune
+    n_left = 0 if 'converged_after' in run else run['tune'] + run['draws'] - n_done
+    n_tune = max([0] + [last - n_done for first, last in run['tuning_draws']])  # also after an earlier retuning
+    start = None
+    adaptation = None  # step size / mass matrix of step, while the checkpoint's are used
+    if n_done > 0 and n_left > 0:
+        start = [ChunkedTrace(directory, model=model, chain=chain).point(n_done - 1) for chain in range(run['chains'])]
+        if n_tune == 0 and cores == 1 and 'potential' in checkpoints[0]:
+            adaptation = step.potential, step.step_adapt
+            step.potential, step.step_adapt = checkpoints[0]['potential'], checkpoints[0]['step_adapt']
+            step.reset_tuning = keep_adaptation
+        else:
+
+            # pm.sample adapts from scratch, also when the run was interrupted during tuning: tune for at least
+            # n_retune draws (or what is left of the first tuning, if that is more); extra draws make up for them
+            n_extra = max(n_tune, min(n_retune, n_left)) - n_tune
+            n_tune += n_extra
+            run['draws'] += n_extra
+            n_left += n_extra
+            run['tuning_draws'].append([n_done, n_done + n_tune])
+            write_json(run_file, run)
+
+    if n_left > 0:
+        trace = ChunkedTrace(directory, model=model, chunk_size=chunk_size)
+        trace.resume_from = n_done
+        trace.step = step if cores == 1 else None
+        trace.stop_check = stop_check
+        try:
+            pm.sample(n_left - n_tune, tune=n_tune, chains=run['chains'], cores=cores, step=step, start=start,
+                      trace=trace, discard_tuned_samples=False, model=model, **kwargs)
+        finally:
+
+            # step can be shared by later runs (model_factory.get_step), which have to adapt from scratch
+            if adaptation is not None:
+                step.potential, step.step_adapt = adaptation
+                del step.reset_tuning  # back to the step method's own reset_tuning
+
+    return load_chunked_trace(directory, model)
+
+
+def load_chunked_trace(directory, model):
+    """
+    The draws in directory (written by sample_chunked) as a pymc3 MultiTrace, without tuning draws and cut to the
+    length of the shortest chain; values are read from disk when they are used. model is the model that was sampled
+    (e.g., TraceReader(directory).load_model()).
+    """
+
+    reader = TraceReader(directory)
+    return MultiTrace([ChunkedTrace(directory, model=model, chain=chain, draw_idxs=reader.draw_idxs[chain])
+                       for chain in reader.chains])
+
+
+def read_checkpoint(directory, chain):
+    file_name = os.path.join(directory, 'chain_{0}'.format(chain), 'checkpoint.pickle')
+    if not os.path.isfile(file_name):
+        return None
+    with open(file_name, 'rb') as f:
+        return pickle.load(f)
@@ -0,0 +1,74 @@
+import hashlib
+import os
+import sys
+import time
+
+from slcn_config import get_config
+
+
+# Model variants that prewarm compiles: [variant, n_subj, n_trials, options] (see model_factory.get_model).
+# Theano's C code does not depend on n_subj and n_trials, so any size fills the cache for all datasets.
+prewarm_models = [['PSRL', 31, 128, {}],
+                  ['PSRL', 31, 128, {'update_Q_method': 'prefix'}],
+                  ['PS', 31, 128, {'model_name': 'RL'}],
+                  ['PS', 31, 128, {'model_name': 'RL', 'update_Q_method': 'prefix'}],
+                  ['PS', 31, 128, {'model_name': 'Bayes'}],
+                  ['PSBayes', 31, 128, {}],
+                  ['PSBayesNonCentered', 31, 128, {}],
+                  ['Aliens', 31, 440, {}],
+                  ['Aliens', 31, 440, {'marginalize_TS': True}],
+                  ['Aliens', 31, 440, {'flat_fast_path': True}]]
+
+
+def use_compile_cache(compile_dir=None):
+    """
+    Keep Theano's compiled C modules in compile_dir (setting compile_dir, e.g., on a shared or local SSD), rather
+    than in a fresh ~/.theano of every job. Each combination of Theano flags gets its own subfolder, and Theano adds
+    one per Theano / python version and platform. Has to run before theano is imported.
+    """
+
+    compile_dir = compile_dir or get_config().get('compile_dir')
+    if not compile_dir:
+        return
+
+    # Key the cache by all other Theano flags (floatX, optimizer, gcc flags, etc.)
+    flags = sorted(flag for flag in os.environ.get('THEANO_FLAGS', '').split(',')
+                   if flag and not flag.startswith(('base_compiledir=', 'compiledir=')))
+    flags_id = hashlib.md5(','.join(flags).encode()).hexdigest()[:8]
+    base_compiledir = os.path.join(os.path.expanduser(compile_dir), 'flags_' + flags_id)
+    if 'base_compiledir=' + base_compiledir in os.environ.get('THEANO_FLAGS', ''):
+        return
+    if 'theano' in sys.modules:
+        print("Theano was imported before the compile cache was set; using Theano's default compile directory.")
+        return
+
+    if not os.path.isdir(base_compiledir):
+        os.makedirs(base_compiledir, exist_ok=True)  # several jobs might create it at the same time
+    os.environ['THEANO_FLAGS'] = ','.join(flags + ['base_compiledir=' + base_compiledir])
+
+
+def prewarm(models=prewarm_models):
+    """
+    Compile every model variant in models once (model, NUTS step, and the functions pm.sample uses), such that
+    later jobs find all C modules in the cache. Jobs then only read the cache and do not wait for Theano's compile
+    lock, which is only taken for modules that have not been compiled yet.
+    """
+
+    import pymc3 as pm
+    import theano
+    from model_factory import get_model, get_step
+
+    print("Compiling {0} model variants into {1}...\n".format(len(models), theano.config.compiledir))
+    for variant, n_subj, n_trials, options in models:
+        start = time.time()
+        model, data = get_model(variant, n_subj, n_trials, **options)
+        with model:
+            pm.sample(1, tune=1, chains=1, cores=1, step=get_step(model), progressbar=False)
+        print("{0} {1}: {2:.1f} seconds\n".format(variant, options, time.time() - start))
+
+
+# Set the compile directory when this module is imported (scripts import it before theano)
+use_compile_cache()
+
+if __name__ == '__main__':
+    prewarm()
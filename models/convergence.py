@@ -0,0 +1,122 @@
+import os
+import time
+
+import numpy as np
+from scipy.stats import norm, rankdata
+
+from trace_reader import TraceReader, get_rhat, read_json, write_json
+
+
+# Convergence diagnostics of Vehtari, Gelman, Simpson, Carpenter & Buerkner (2021): rank-normalized split-R-hat and
+# bulk / tail effective sample sizes. All functions take draws with shape [n_chains, n_draws, n_elements].
+def get_split_rhat(values):
+
+    # Maximum of the R-hats of the rank-normalized draws and of the rank-normalized, folded draws (|draw - median|)
+    values = split_chains(values)
+    folded = np.abs(values - np.median(values.reshape(-1, values.shape[2]), axis=0))
+    return np.maximum(get_rhat(rank_normalize(values)), get_rhat(rank_normalize(folded)))
+
+
+def get_ess_bulk(values):
+    return get_ess(rank_normalize(split_chains(values)))
+
+
+def get_ess_tail(values):
+
+    # Smaller ESS of the 5% and 95% quantiles (ESS of the indicators draw <= quantile)
+    values = split_chains(values)
+    flat_values = values.reshape(-1, values.shape[2])
+    return np.minimum(get_ess((values <= np.percentile(flat_values, 5, axis=0)).astype(float)),
+                      get_ess((values <= np.percentile(flat_values, 95, axis=0)).astype(float)))
+
+
+def split_chains(values):
+
+    # Each chain becomes two chains (first and second half; the middle draw is dropped for odd lengths)
+    n_half = values.shape[1] // 2
+    return np.concatenate([values[:, :n_half], values[:, -n_half:]])
+
+
+def rank_normalize(values):
+
+    # Normal scores of the ranks over all chains
+    n_chains, n_draws, n_elements = values.shape
+    ranks = rankdata(values.reshape(-1, n_elements), axis=0).reshape(values.shape)
+    return norm.ppf((ranks - 3 / 8) / (n_chains * n_draws + 1 / 4))
+
+
+def get_ess(values):
+
+    # Autocovariances of every chain (FFT), combined over chains
+    n_chains, n_draws, n_elements = values.shape
+    centered = values - values.mean(axis=1, keepdims=True)
+    n_fft = 2 ** int(np.ceil(np.log2(2 * n_draws)))
+    spectrum = np.fft.rfft(centered, n=n_fft, axis=1)
+    autocov = np.fft.irfft(spectrum * np.conjugate(spectrum), n=n_fft, axis=1)[:, :n_draws] / n_draws
+    mean_var = autocov[:, 0].mean(axis=0) * n_draws / (n_draws - 1)
+    var_plus = mean_var * (n_draws - 1) / n_draws
+    if n_chains > 1:
+        var_plus += values.mean(axis=1).var(axis=0, ddof=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rho = 1 - (mean_var - autocov.mean(axis=0)) / var_plus  # [n_draws, n_elements]
+
+    # Geyer's initial monotone sequence: sums of pairs of autocorrelations, up to the first negative one
+    n_pairs = n_draws // 2
+    pair_sums = rho[:2 * n_pairs].reshape(n_pairs, 2, n_elements).sum(axis=1)
+    pair_sums = np.where(np.cumprod(pair_sums > 0, axis=0).astype(bool), pair_sums, 0)
+    pair_sums = np.minimum.accumulate(pair_sums, axis=0)
+    tau = np.maximum(-1 + 2 * pair_sums.sum(axis=0), 1 / np.log10(n_chains * n_draws))
+    return n_chains * n_draws / tau
+
+
+class ConvergenceCheck(object):
+    """
+    Stopping rule for sample_chunked (stop_check): every check_every posterior draws (of all chains), computes
+    split-R-hat, bulk ESS, and tail ESS of varnames (default: all untransformed variables) from the trace folder,
+    logs them with ESS per second to convergence_log.csv, and stops sampling once max(R-hat) <= max_rhat and
+    min(ESS) >= min_ess. Chains are only compared at equal lengths, so with cores=1 (chains sampled one after the
+    other), only the last chain stops early.
+    """
+
+    def __init__(self, max_rhat=1.01, min_ess=400, check_every=200, varnames=None):
+        self.max_rhat = max_rhat
+        self.min_ess = min_ess
+        self.check_every = check_every
+        self.varnames = varnames
+        self.start_time = time.time()
+        self.n_checked = 0
+
+    def __call__(self, trace):
+
+        # Only check when all chains have check_every more posterior draws on disk than at the last check
+        reader = TraceReader(trace.directory)
+        if reader.nchains < reader.run['chains'] or len(reader) < self.n_checked + self.check_every:
+            return False
+        self.n_checked = n_draws = len(reader)
+
+        # Diagnostics of all variables (each read from disk and checked separately)
+        max_rhat, min_ess_bulk, min_ess_tail = 0, np.inf, np.inf
+        for varname in self.varnames or [varname for varname in reader.varnames if not varname.endswith('__')]:
+            values = np.array(reader.get_values(varname, combine=False, squeeze=False))
+            values = values.reshape(values.shape[:2] + (-1,))
+            max_rhat = max(max_rhat, np.nanmax(get_split_rhat(values), initial=0))
+            min_ess_bulk = min(min_ess_bulk, np.nanmin(get_ess_bulk(values), initial=np.inf))
+            min_ess_tail = min(min_ess_tail, np.nanmin(get_ess_tail(values), initial=np.inf))
+
+        # Log, and decide whether to stop
+        seconds = time.time() - self.start_time
+        converged = max_rhat <= self.max_rhat and min(min_ess_bulk, min_ess_tail) >= self.min_ess
+        log_file = os.path.join(trace.directory, 'convergence_log.csv')
+        with open(log_file, 'a') as f:
+            if f.tell() == 0:
+                f.write('seconds,draws_per_chain,max_rhat,min_ess_bulk,min_ess_tail,ess_bulk_per_second\n')
+            f.write('{0:.1f},{1},{2:.4f},{3:.1f},{4:.1f},{5:.3f}\n'.format(
+                seconds, n_draws, max_rhat, min_ess_bulk, min_ess_tail, min_ess_bulk / seconds))
+        print("{0} draws per chain: max split-R-hat {1:.3f}, min bulk ESS {2:.0f}, min tail ESS {3:.0f}{4}".format(
+            n_draws, max_rhat, min_ess_bulk, min_ess_tail, " -> converged, stopping." if converged else ""))
+
+        if converged:
+            run = read_json(os.path.join(trace.directory, 'run.json'))
+            run['converged_after'] = n_draws
+            write_json(os.path.join(trace.directory, 'run.json'), run)
+        return converged
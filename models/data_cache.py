@@ -0,0 +1,86 @@
+import hashlib
+import os
+
+import numpy as np
+import pandas as pd
+
+from slcn_config import get_config
+
+
+def read_csv_columns(filenames, columns, cache_dir=None):
+    """
+    Read some columns of many csv files, using a columnar .npz cache that is rebuilt automatically
+    whenever one of the files changes (file names, modification times, or sizes differ).
+
+    :param filenames: list of csv files (order is kept)
+    :param columns: names of the columns that should be read; columns that are missing in a file are NaN
+    :param cache_dir: where to store the cache (default: cache_dir of the config, or folder "cache" next to the first file)
+    :return: data: DataFrame with all rows of all files (columns + 'file_idx', the position of the file in filenames)
+             files: DataFrame with one row per file ('filename', 'n_rows', and 'has_<column>' for each column)
+    """
+
+    columns = list(columns)
+    if cache_dir is None:
+        cache_dir = get_config().get('cache_dir', os.path.join(os.path.dirname(filenames[0]), 'cache'))
+    key = hashlib.md5('\n'.join(list(filenames) + ['columns:'] + columns).encode()).hexdigest()
+    cache_file = os.path.join(cache_dir, 'columns_' + key + '.npz')
+    signature = get_signature(filenames)
+
+    # Read from the cache if it is up to date
+    if os.path.isfile(cache_file):
+        with np.load(cache_file, allow_pickle=True) as cache:
+            if np.array_equal(cache['signature'], signature):
+                return unpack(cache, filenames, columns)
+
+    # Otherwise, read all csv files and (re)build the cache
+    print("Building data cache for {0} files in {1}...".format(len(filenames), cache_file))
+    arrays = pack(filenames, columns)
+    arrays['signature'] = signature
+    try:
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        temp_file = cache_file + '.tmp' + str(os.getpid())
+        with open(temp_file, 'wb') as f:
+            np.savez(f, **arrays)
+        os.replace(temp_file, cache_file)  # atomic, such that parallel jobs never read half-written caches
+    except OSError as error:
+        print("Could not write data cache {0}: {1}".format(cache_file, error))
+    return unpack(arrays, filenames, columns)
+
+
+def get_signature(filenames):
+    return np.array(['{0}|{1}|{2}'.format(filename, os.stat(filename).st_mtime_ns, os.stat(filename).st_size)
+                     for filename in filenames])
+
+
+def pack(filenames, columns):
+
+    # Read files and concatenate columns; object (string) columns are kept as they come out of read_csv
+    agent_datas = [pd.read_csv(filename, usecols=lambda col: col in columns) for filename in filenames]
+    arrays = {'n_rows': np.array([agent_data.shape[0] for agent_data in agent_datas], dtype=int)}
+    for col_idx, col in enumerate(columns):
+        has_col = np.array([col in agent_data.columns for agent_data in agent_datas])
+        values = [agent_data[col].to_numpy() if col in agent_data.columns else np.full(agent_data.shape[0], np.nan)
+                  for agent_data in agent_datas]
+        is_numeric = all([value.dtype.kind in 'biuf' for value in values])
+        arrays['has_{0}'.format(col_idx)] = has_col
+        arrays['col_{0}'.format(col_idx)] = \
+            np.concatenate([value.astype(float if is_numeric else object) for value in values]) if values else np.zeros(0)
+    return arrays
+
+
+def unpack(arrays, filenames, columns):
+
+    n_rows = arrays['n_rows']
+    data = pd.DataFrame({col: arrays['col_{0}'.format(col_idx)] for col_idx, col in enumerate(columns)})
+    data['file_idx'] = np.repeat(np.arange(len(filenames)), n_rows)
+    files = pd.DataFrame({'filename': filenames, 'n_rows': n_rows})
+    for col_idx, col in enumerate(columns):
+        files['has_' + col] = arrays['has_{0}'.format(col_idx)]
+    return data, files
+
+
+def split_by_file(data, n_files):
+
+    # Start and end row of each file in data (rows of data must be sorted by file_idx)
+    return np.searchsorted(data['file_idx'].values, np.arange(n_files + 1))
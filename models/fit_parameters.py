@@ -1,9 +1,10 @@
 import numpy as np
 import pandas as pd
-from scipy.optimize import brute
-from scipy.optimize import basinhopping
+from scipy.optimize import basinhopping, minimize
 from basinhopping_specifics import MyTakeStep, MyBounds
+from batch_likelihood import BatchLikelihood, batch_adaptive_grid, batch_differential_evolution, get_grid_seeds
 from minimizer_heatmap import PlotMinimizerHeatmap, CollectPaths, CollectMinima
+from nll_cache import NLLCache
 from simulate_interactive import SimulateInteractive
 
 
@@ -16,6 +17,8 @@ class FitParameters(object):
         self.n_fit_par = sum(parameters['fit_pars'])
         self.data_set = data_set
         self.learning_style = learning_style
+        self.batch_likelihood = None
+        self.NLL_cache = None  # set up by get_optimal_pars, shared by all of its NLL calculations
 
     def simulate_agent(self, all_pars, agent_id, interactive=False):
 
@@ -51,9 +54,83 @@ class FitParameters(object):
         record_data.add_parameters(agent, agent_id)  # add parameters (alpha, beta, etc.) only
         return record_data.get()
 
+    def get_batch_likelihood(self, agent_data):
+
+        # Read agent_data into arrays only once per data set
+        if self.batch_likelihood is None or self.batch_likelihood.agent_data is not agent_data:
+            self.batch_likelihood = BatchLikelihood(self.data_set, self.learning_style,
+                                                    self.task_stuff, self.agent_stuff, agent_data)
+        return self.batch_likelihood
+
+    def get_all_pars(self, vary_pars):
+
+        # Combine parameters that are fit (vary_pars; shape [n_candidates, n_fit_par]) with fixed default parameters
+        vary_pars = np.atleast_2d(vary_pars)
+        all_pars = np.tile(self.parameters['default_pars'], (len(vary_pars), 1))
+        all_pars[:, self.parameters['fit_pars']] = vary_pars
+        return all_pars
+
+    def calculate_NLL_batch(self, vary_pars, agent_data):
+
+        # Calculate NLLs of many sets of parameters at once (vary_pars.shape -> [n_candidates, n_fit_par])
+        batch_likelihood = self.get_batch_likelihood(agent_data)
+        all_pars = self.get_all_pars(vary_pars)
+        if self.NLL_cache is None:
+            return -batch_likelihood.get_LL(all_pars)
+
+        # Look up every candidate in the cache; the missing ones are calculated together
+        keys = self.NLL_cache.get_keys(batch_likelihood.data_hash, self.learning_style, all_pars)
+        NLLs = [self.NLL_cache.get(key) for key in keys]
+        missing = [i for i, NLL in enumerate(NLLs) if NLL is None]
+        if missing:
+            for i, NLL in zip(missing, -batch_likelihood.get_LL(all_pars[missing])):
+                NLLs[i] = NLL
+                self.NLL_cache.put(keys[i], NLL)
+        return np.array(NLLs, dtype=float)
+
+    def calculate_NLL_and_grad(self, vary_pars, agent_data, collect_paths=None, verbose=False):
+
+        # NLL and its gradient with respect to the fit parameters, from the forward-mode sensitivities of the batch
+        # likelihood (BatchLikelihood.get_numerical_grad checks them against central differences)
+        batch_likelihood = self.get_batch_likelihood(agent_data)
+        fit_par_idx = np.argwhere(self.parameters['fit_pars']).T[0]
+        LL, d_LL = batch_likelihood.get_LL_and_grad(self.get_all_pars(vary_pars), fit_par_idx)
+        NLL, grad = -LL[0], -d_LL[0]
+
+        # p=0 for an observed choice gives NLL=inf and no gradient; L-BFGS-B needs finite values, and steps back
+        # from a huge NLL in its line search
+        if not np.isfinite(NLL):
+            NLL, grad = 1e10, np.zeros(len(fit_par_idx))
+
+        if verbose:
+            print(NLL, vary_pars)
+        if collect_paths:
+            collect_paths.add_point(np.array(vary_pars))
+        return NLL, grad
+
+    def get_fit_par_bounds(self):
+        fit_par_idx = np.argwhere(self.parameters['fit_pars']).T[0]
+        return [self.parameters['par_hard_limits'][i] for i in fit_par_idx]
+
     def calculate_NLL(self, vary_pars, agent_data, collect_paths=None, verbose=False,
                       goal='calculate_NLL', suff='_rec'):
 
+        # Calculate NLL and fit with the vectorized likelihood; the agent only needs to play for add_decisions_and_fit
+        if goal in ['calculate_NLL', 'calculate_fit']:
+            NLL = self.calculate_NLL_batch(vary_pars, agent_data)[0]
+            n_trials = len(agent_data)
+            BIC = 2 * NLL + self.n_fit_par * np.log(n_trials)
+            AIC = 2 * NLL + self.n_fit_par
+
+            if goal == 'calculate_NLL':
+                if verbose:
+                    print(NLL, vary_pars)
+                if collect_paths:
+                    collect_paths.add_point(np.array(vary_pars))
+                return NLL
+            else:
+                return [NLL, BIC, AIC]
+
         # Import the right agent and task
         if self.data_set == 'Aliens':
             from alien_task import Task
@@ -103,58 +180,68 @@ class FitParameters(object):
         BIC = - 2 * agent.LL + self.n_fit_par * np.log(n_trials)
         AIC = - 2 * agent.LL + self.n_fit_par
 
-        if goal == 'calculate_NLL':
-            if verbose:
-                print(-agent.LL, vary_pars)
-            if collect_paths:
-                collect_paths.add_point(np.array(vary_pars))
-            return -agent.LL
-        elif goal == 'calculate_fit':
-            return [-agent.LL, BIC, AIC]
-        elif goal == 'add_decisions_and_fit':
+        if goal == 'add_decisions_and_fit':
             record_data.add_parameters(agent, None, self.parameters, suff=suff)  # add parameters and fit_pars
             record_data.add_fit(-agent.LL, BIC, AIC, suff=suff)
             return record_data.get()
 
     def get_optimal_pars(self, agent_data, minimizer_stuff, heatmap_data_path):
 
+        # Brute grid and minimizer share one NLL cache (e.g., basinhopping steps clipped to the same bounds)
+        self.NLL_cache = NLLCache(minimizer_stuff['NLL_cache_size'], minimizer_stuff['NLL_cache_decimals'])
+
+        # Coarse-to-fine grid, for the heatmaps (save_plot_data) and / or as starting points of the minimizer
+        # (grid_seeds); only grid_seeds changes the fit
+        seeds = None
+        if minimizer_stuff['save_plot_data'] or minimizer_stuff['grid_seeds']:
+            grid_results = batch_adaptive_grid(func=self.calculate_NLL_batch,
+                                               ranges=self.get_fit_par_bounds(),
+                                               budget=minimizer_stuff['grid_budget'],
+                                               n_keep=minimizer_stuff['grid_n_keep'],
+                                               args=(agent_data,))
+            print('Finished grid search ({0} points)!'.format(len(grid_results['values'])))
+            if minimizer_stuff['grid_seeds']:
+                seeds = get_grid_seeds(grid_results, minimizer_stuff['grid_seeds'])
+                seeds = seeds if len(seeds) else None
+
         if minimizer_stuff['save_plot_data']:
             plot_heatmap = PlotMinimizerHeatmap(heatmap_data_path)
-            hoppin_paths = CollectPaths(colnames=self.parameters['fit_par_names'])
-            fit_par_idx = np.argwhere(self.parameters['fit_pars']).T[0]
-            brute_results = brute(func=self.calculate_NLL,
-                                  ranges=([self.parameters['par_hard_limits'][i] for i in fit_par_idx]),
-                                  args=(agent_data, hoppin_paths, minimizer_stuff['verbose']),
-                                  Ns=minimizer_stuff['brute_Ns'],
-                                  full_output=True,
-                                  finish=None,
-                                  disp=True)
-            print('Finished brute!')
-            plot_heatmap.pickle_brute_results(brute_results)
-            hoppin_minima = CollectMinima(colnames=self.parameters['fit_par_names'])
-            hoppin_paths = CollectPaths(colnames=self.parameters['fit_par_names'])  # reinitialize
+            plot_heatmap.pickle_brute_results(grid_results)
+
+            # Population optimizers also record the NLL of every point
+            colnames = self.parameters['fit_par_names'] + (['NLL'] if minimizer_stuff['method'] == 'DE' else [])
+            hoppin_minima = CollectMinima(colnames=colnames)
+            hoppin_paths = CollectPaths(colnames=colnames, spill_file=heatmap_data_path + 'hoppin_paths.bin')
         else:
             hoppin_minima = None
             hoppin_paths = None
 
-        n_free_pars = np.sum(self.parameters['fit_pars'])
-        bounds = MyBounds(xmax=np.ones(n_free_pars), xmin=np.zeros(n_free_pars))
-        takestep = MyTakeStep(stepsize=minimizer_stuff['hoppin_stepsize'],
-                              bounds=self.parameters['par_hard_limits'][0])
-        hoppin_results = basinhopping(func=self.calculate_NLL,
-                                      x0=.5 * np.ones(n_free_pars),
-                                      niter=minimizer_stuff['NM_niter'],
-                                      T=minimizer_stuff['hoppin_T'],
-                                      minimizer_kwargs={'method': 'Nelder-Mead',
-                                                        'args': (agent_data, hoppin_paths, minimizer_stuff['verbose']),
-                                                        'options': {'xatol': minimizer_stuff['NM_xatol'],
-                                                                    'fatol': minimizer_stuff['NM_fatol'],
-                                                                    'maxfev': minimizer_stuff['NM_maxfev']}},
-                                      take_step=takestep,
-                                      accept_test=bounds,
-                                      callback=hoppin_minima,
-                                      disp=True)
-        hoppin_fit_par, hoppin_NLL = [hoppin_results.x, hoppin_results.fun]
+        if minimizer_stuff['method'] == 'L-BFGS-B':
+            hoppin_fit_par, hoppin_NLL = self.minimize_multistart(agent_data, minimizer_stuff,
+                                                                  hoppin_paths, hoppin_minima, seeds)
+        elif minimizer_stuff['method'] == 'DE':
+            hoppin_fit_par, hoppin_NLL = self.minimize_population(agent_data, minimizer_stuff,
+                                                                  hoppin_paths, hoppin_minima, seeds)
+        else:
+            n_free_pars = np.sum(self.parameters['fit_pars'])
+            bounds = MyBounds(xmax=np.ones(n_free_pars), xmin=np.zeros(n_free_pars))
+            takestep = MyTakeStep(stepsize=minimizer_stuff['hoppin_stepsize'],
+                                  bounds=self.parameters['par_hard_limits'][0])
+            hoppin_results = basinhopping(func=self.calculate_NLL,
+                                          x0=.5 * np.ones(n_free_pars) if seeds is None else seeds[0],
+                                          niter=minimizer_stuff['NM_niter'],
+                                          T=minimizer_stuff['hoppin_T'],
+                                          minimizer_kwargs={'method': 'Nelder-Mead',
+                                                            'args': (agent_data, hoppin_paths,
+                                                                     minimizer_stuff['verbose']),
+                                                            'options': {'xatol': minimizer_stuff['NM_xatol'],
+                                                                        'fatol': minimizer_stuff['NM_fatol'],
+                                                                        'maxfev': minimizer_stuff['NM_maxfev']}},
+                                          take_step=takestep,
+                                          accept_test=bounds,
+                                          callback=hoppin_minima,
+                                          disp=True)
+            hoppin_fit_par, hoppin_NLL = [hoppin_results.x, hoppin_results.fun]
 
         if minimizer_stuff['save_plot_data']:
             fin_res = np.append(hoppin_fit_par, hoppin_NLL) * np.ones((1, len(hoppin_fit_par)+1))
@@ -162,9 +249,13 @@ class FitParameters(object):
             final_result.to_csv(plot_heatmap.get_save_path() + 'hoppin_result.csv')
             hoppin_paths.get().to_csv(plot_heatmap.get_save_path() + 'hoppin_paths.csv')
             hoppin_minima.get().to_csv(plot_heatmap.get_save_path() + 'hoppin_minima.csv')
+            hoppin_paths.close()
 
-        print("Finished basin hopping with values {0}, NLL {1}."
-              .format(np.round(hoppin_fit_par, 3), np.round(hoppin_NLL, 3)))
+        print("Finished {0} with values {1}, NLL {2}."
+              .format(minimizer_stuff['method'], np.round(hoppin_fit_par, 3), np.round(hoppin_NLL, 3)))
+        if minimizer_stuff['verbose']:
+            print(self.NLL_cache)
+        self.NLL_cache = None
 
         # Combine fit parameters and fixed parameters and return all
         fit_par_idx = np.argwhere(self.parameters['fit_pars']).T[0]
@@ -172,6 +263,48 @@ class FitParameters(object):
         minimized_pars[fit_par_idx] = hoppin_fit_par
         return minimized_pars
 
+    def minimize_multistart(self, agent_data, minimizer_stuff, hoppin_paths=None, hoppin_minima=None, seeds=None):
+
+        # L-BFGS-B from n_starts points (the grid seeds, or else the center of the parameter space, and random
+        # points for the remaining starts); keep the best minimum
+        bounds = self.get_fit_par_bounds()
+        lower, upper = np.array(bounds).T
+        starts = [(lower + upper) / 2] if seeds is None else list(seeds[:minimizer_stuff['n_starts']])
+        starts += [lower + np.random.rand(len(bounds)) * (upper - lower)
+                   for _ in range(minimizer_stuff['n_starts'] - len(starts))]
+        best_fit_par, best_NLL = None, np.inf
+        for start in starts:
+            result = minimize(self.calculate_NLL_and_grad, x0=start, jac=True, method='L-BFGS-B', bounds=bounds,
+                              args=(agent_data, hoppin_paths, minimizer_stuff['verbose']),
+                              options={'maxiter': minimizer_stuff['LBFGS_maxiter'],
+                                       'ftol': minimizer_stuff['LBFGS_ftol']})
+            if hoppin_minima:
+                hoppin_minima(result.x, result.fun, result.success)
+            if result.fun < best_NLL:
+                best_fit_par, best_NLL = result.x, result.fun
+        return best_fit_par, best_NLL
+
+    def minimize_population(self, agent_data, minimizer_stuff, hoppin_paths=None, hoppin_minima=None, seeds=None):
+
+        # Record every generation: all candidates in hoppin_paths, the generation's best in hoppin_minima
+        def record_generation(population, NLLs):
+            if hoppin_paths:
+                hoppin_paths.add_points(np.column_stack([population, NLLs]))
+            if hoppin_minima:
+                best = np.argmin(NLLs)
+                hoppin_minima(np.append(population[best], NLLs[best]), NLLs[best], True)
+
+        return batch_differential_evolution(func=self.calculate_NLL_batch,
+                                            bounds=self.get_fit_par_bounds(),
+                                            args=(agent_data,),
+                                            pop_size=minimizer_stuff['DE_popsize'],
+                                            max_generations=minimizer_stuff['DE_maxiter'],
+                                            mutation=minimizer_stuff['DE_mutation'],
+                                            crossover=minimizer_stuff['DE_crossover'],
+                                            tol=minimizer_stuff['DE_tol'],
+                                            callback=record_generation,
+                                            init=seeds)
+
     @staticmethod
     def simulate_PS(task, agent, record_data, interactive, sim_int):
         for trial in range(task.n_trials):
@@ -14,8 +14,10 @@ import pandas as pd
 from fit_parameters import FitParameters
 from minimizer_heatmap import PlotMinimizerHeatmap
 from main_helper_functions import *
+from slcn_config import get_config
 import os
 import re
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 
 def interactive_game(sets, prob_switch_randomized_sequences):
@@ -60,11 +62,16 @@ def simulate(sets, agent_id, save_path, prob_switch_randomized_sequences):
     agent_data.to_csv(created_file_name)
 
 
-def fit(sets, file_name, fitted_data_path, heatmap_data_path, prob_switch_randomized_sequences):
+def fit(sets, file_name, fitted_data_path, heatmap_data_path, prob_switch_randomized_sequences, seed=None):
+
+    # Seed the random number generator (basinhopping steps, L-BFGS-B starting points), such that each subject's fit is reproducible
+    if seed is not None:
+        np.random.seed(seed)
 
     # Get info about RL model parameters and minimizer
     parameters = get_parameter_stuff(sets['data_set'], sets['fit_par_names'], sets['learning_style'])
-    minimizer_stuff = get_minimizer_stuff(sets['run_on_cluster'], heatmap_data_path)
+    minimizer_stuff = get_minimizer_stuff(sets['run_on_cluster'], heatmap_data_path,
+                                          sets.get('minimizer', 'basinhopping'))
 
     # Get info about agent and task
     agent_stuff = get_agent_stuff(sets['data_set'], sets['learning_style'], sets['fit_par_names'])
@@ -112,10 +119,62 @@ def fit(sets, file_name, fitted_data_path, heatmap_data_path, prob_switch_random
                                           suff='_rec')
     agent_data['model_name_rec'] = '_'.join([sets['learning_style'], '_'.join(parameters['fit_par_names'])])
 
-    # Write agent_data as csv
-    created_file_name = fitted_data_path + sets['data_set'] + sets['learning_style'] + str(agent_stuff['id']) + ".csv"
+    # Write agent_data as csv (atomically, such that killed jobs never leave half-written files)
+    created_file_name = get_fitted_file_name(sets, file_name, fitted_data_path)
     print("Saving fitted data to {0}".format(created_file_name))
-    agent_data.to_csv(created_file_name)
+    save_csv_atomically(agent_data, created_file_name)
+
+
+def fit_all(sets, file_names, fitted_data_path, heatmap_data_path, prob_switch_randomized_sequences,
+            n_workers=1, seed=0):
+
+    # Skip subjects that have already been fitted (e.g., when resuming a killed job)
+    to_fit = [file_name for file_name in file_names
+              if not os.path.isfile(get_fitted_file_name(sets, file_name, fitted_data_path))]
+    print("Fitting {0} files ({1} already fitted) with {2} workers.".format(
+        len(to_fit), len(file_names) - len(to_fit), n_workers))
+
+    # Each subject gets its own seed (seed + subject id), such that results do not depend on the worker
+    seeds = [seed + int(re.findall('\d+', file_name)[0]) for file_name in to_fit]
+
+    # Fit one subject after the other, or distribute subjects over a pool of processes
+    failed = []
+    if n_workers == 1:
+        for file_name, file_seed in zip(to_fit, seeds):
+            try:
+                fit(sets, file_name, fitted_data_path, heatmap_data_path, prob_switch_randomized_sequences, file_seed)
+            except Exception as error:
+                print("Fitting {0} failed: {1}".format(file_name, error))
+                failed.append(file_name)
+    else:
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            futures = {executor.submit(fit, sets, file_name, fitted_data_path, heatmap_data_path,
+                                       prob_switch_randomized_sequences, file_seed): file_name
+                       for file_name, file_seed in zip(to_fit, seeds)}
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                except Exception as error:
+                    print("Fitting {0} failed: {1}".format(futures[future], error))
+                    failed.append(futures[future])
+
+    if failed:
+        print("Fitting failed for {0} files: {1}".format(len(failed), failed))
+    return failed
+
+
+def get_fitted_file_name(sets, file_name, fitted_data_path):
+
+    agent_id = int(re.findall('\d+', file_name)[0])
+    return fitted_data_path + sets['data_set'] + sets['learning_style'] + str(agent_id) + ".csv"
+
+
+def save_csv_atomically(data, file_name):
+
+    # Write to a temporary file first, then move it into place in one step
+    temp_file_name = file_name + '.tmp' + str(os.getpid())
+    data.to_csv(temp_file_name)
+    os.replace(temp_file_name, file_name)
 
 
 def plot_heatmaps(sets, agent_id, heatmap_data_path, heatmap_plot_path):
@@ -157,9 +216,13 @@ def simulate_based_on_data(sets, file_name, simulation_data_path, prob_switch_ra
 
 def get_paths(use_humans, data_set, run_on_cluster):
 
-    # Cluster or laptop?
+    # Cluster or laptop? (the base folder can be set in the config: ps_data_root or aliens_data_root, the folder with
+    # <data_set>humanData/; shared_modeling_simulation.get_paths / get_alien_paths use the same folder)
     paths = dict()
-    if run_on_cluster:
+    data_root = get_config().get('ps_data_root' if data_set == 'PS' else 'aliens_data_root')
+    if data_root:
+        paths['base_path'] = os.path.join(data_root, '')
+    elif run_on_cluster:
         paths['base_path'] = '/home/bunge/maria/Desktop/'
     else:
         paths['base_path'] = 'C:/Users/maria/MEGAsync/SLCN/'
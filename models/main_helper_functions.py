@@ -102,31 +102,60 @@ def get_parameter_stuff(data_set, fit_par_names, learning_style):
             'fit_pars': np.array([par in fit_par_names for par in par_names])}
 
 
-def get_minimizer_stuff(run_on_cluster, heatmap_data_path):
+def get_minimizer_stuff(run_on_cluster, heatmap_data_path, method='basinhopping'):
 
+    # method: 'basinhopping' (Nelder-Mead steps), 'L-BFGS-B' (gradient-based, from n_starts starting points), or
+    # 'DE' (differential evolution; each generation of DE_popsize * n_fit_par candidates is scored in one batch)
     if run_on_cluster:
-        return {'save_plot_data': True,
+        return {'method': method,
+                'save_plot_data': True,
                 'heatmap_data_path': heatmap_data_path,
                 'verbose': False,
-                'brute_Ns': 50,
+                'grid_budget': 50000,  # NLL evaluations of the coarse-to-fine grid search
+                'grid_n_keep': 10,  # best points that are refined in each level of the grid search
+                'grid_seeds': 0,  # starting points from local minima of the grid search (0: center / random); the
+                                  # remaining starts of L-BFGS-B and the rest of DE's population are random
                 'hoppin_T': 10.0,
                 'hoppin_stepsize': 0.5,
                 'NM_niter': 300,
                 'NM_xatol': .01,
                 'NM_fatol': 1e-6,
-                'NM_maxfev': 1000}
+                'NM_maxfev': 1000,
+                'n_starts': 20,
+                'LBFGS_maxiter': 500,
+                'LBFGS_ftol': 1e-10,
+                'DE_popsize': 15,
+                'DE_maxiter': 1000,
+                'DE_mutation': 0.7,
+                'DE_crossover': 0.9,
+                'DE_tol': 1e-6,
+                'NLL_cache_size': 200000,  # NLLs kept in the LRU cache of get_optimal_pars
+                'NLL_cache_decimals': 8}
 
     else:
-        return {'save_plot_data': True,
+        return {'method': method,
+                'save_plot_data': True,
                 'heatmap_data_path': heatmap_data_path,
                 'verbose': False,
-                'brute_Ns': 15,
+                'grid_budget': 5000,
+                'grid_n_keep': 5,
+                'grid_seeds': 0,
                 'hoppin_T': 10.0,
                 'hoppin_stepsize': 0.5,
                 'NM_niter': 10,
                 'NM_xatol': .01,
                 'NM_fatol': 1e-5,
-                'NM_maxfev': 300}
+                'NM_maxfev': 300,
+                'n_starts': 5,
+                'LBFGS_maxiter': 200,
+                'LBFGS_ftol': 1e-8,
+                'DE_popsize': 10,
+                'DE_maxiter': 100,
+                'DE_mutation': 0.7,
+                'DE_crossover': 0.9,
+                'DE_tol': 1e-4,
+                'NLL_cache_size': 50000,  # NLLs kept in the LRU cache of get_optimal_pars
+                'NLL_cache_decimals': 8}
 
 
 def get_random_pars(parameters, set_specific_parameters, learning_style):
@@ -2,34 +2,67 @@ import matplotlib.pyplot as plt
 import seaborn as sns
 import pandas as pd
 import numpy as np
+from scipy.spatial import cKDTree
 from itertools import combinations
+import os
 import pickle
 
 
-class CollectPaths(object):
-    def __init__(self, colnames):
-        self.all_points = pd.DataFrame(columns=colnames)
-        self.row = 0
+class RecordPoints(object):
+    """
+    Rows of numbers (e.g., parameters and NLL of every minimizer step) in a float array that doubles its size when
+    full, rather than a DataFrame that grows by one row per point. With spill_file, every max_rows rows are appended
+    to that (raw float64) file and the array starts again, so that memory stays bounded. get() returns all rows as a
+    DataFrame with columns colnames.
+    """
 
-    def add_point(self, coordinates):
-        self.all_points.loc[self.row, :] = coordinates
-        self.row += 1
+    def __init__(self, colnames, spill_file=None, max_rows=100000):
+        self.colnames = list(colnames)
+        self.spill_file = spill_file
+        self.max_rows = max_rows
+        self.points = np.empty((64, len(self.colnames)))
+        self.row = 0
+        self.n_spilled = 0
+        if spill_file:
+            open(spill_file, 'wb').close()
+
+    def add_points(self, points):
+        points = np.atleast_2d(points)
+        while self.row + len(points) > len(self.points):
+            self.points = np.concatenate([self.points, np.empty_like(self.points)])
+        self.points[self.row:self.row + len(points)] = points
+        self.row += len(points)
+        if self.spill_file and self.row >= self.max_rows:
+            self.spill()
+
+    def spill(self):
+        with open(self.spill_file, 'ab') as f:
+            f.write(self.points[:self.row].tobytes())
+        self.n_spilled += self.row
+        self.row = 0
 
     def get(self):
-        return self.all_points
+        points = self.points[:self.row]
+        if self.n_spilled:
+            spilled = np.fromfile(self.spill_file).reshape(-1, len(self.colnames))
+            points = np.concatenate([spilled, points])
+        return pd.DataFrame(points, columns=self.colnames)
 
+    def close(self):
 
-class CollectMinima(object):
-    def __init__(self, colnames):
-        self.all_minima = pd.DataFrame(columns=colnames)
-        self.row = 0
+        # Delete the spill file (e.g., after get() was saved)
+        if self.spill_file and os.path.isfile(self.spill_file):
+            os.remove(self.spill_file)
 
-    def __call__(self, x, f, accept):
-        self.all_minima.loc[self.row, :] = x
-        self.row += 1
 
-    def get(self):
-        return self.all_minima
+class CollectPaths(RecordPoints):
+    def add_point(self, coordinates):
+        self.add_points(coordinates)
+
+
+class CollectMinima(RecordPoints):
+    def __call__(self, x, f, accept):
+        self.add_points(x)
 
 
 class PlotMinimizerHeatmap(object):
@@ -48,6 +81,31 @@ class PlotMinimizerHeatmap(object):
         with open(self.heatmap_data_path + 'brute_results.pickle', 'rb') as handle:
             return pickle.load(handle, encoding='latin1')
 
+    @staticmethod
+    def get_min_projection(brute_results, xi, yi, n_bins=50):
+
+        # Full grid of older fits, in the format of scipy's brute: (x0, fval, grid, Jout)
+        if not isinstance(brute_results, dict):
+            axes = tuple([ii for ii in range(brute_results[3].ndim) if ii not in (xi, yi)])
+            return [np.amin(brute_results[2][xi], axis=axes), np.amin(brute_results[2][yi], axis=axes),
+                    np.amin(brute_results[3], axis=axes)]
+
+        # Sparse grid of batch_adaptive_grid: minimum of the points in each of n_bins x n_bins cells; empty cells
+        # take the value of the nearest filled cell
+        points, values, ranges = brute_results['points'], brute_results['values'], brute_results['ranges']
+        edges = [np.linspace(ranges[i][0], ranges[i][1], n_bins + 1) for i in (xi, yi)]
+        cells = [np.clip(np.searchsorted(edge, points[:, i], side='right') - 1, 0, n_bins - 1)
+                 for edge, i in zip(edges, (xi, yi))]
+        min_jout = np.full((n_bins, n_bins), np.inf)
+        np.minimum.at(min_jout, (cells[0], cells[1]), values)
+        filled = np.argwhere(np.isfinite(min_jout))
+        empty = np.argwhere(np.isinf(min_jout))
+        if len(filled) and len(empty):
+            nearest = cKDTree(filled).query(empty)[1]
+            min_jout[tuple(empty.T)] = min_jout[tuple(filled[nearest].T)]
+        min_xgrid, min_ygrid = np.meshgrid(edges[0], edges[1], indexing='ij')
+        return min_xgrid, min_ygrid, min_jout
+
     @staticmethod
     def get_tril_positions(n):
 
@@ -77,17 +135,8 @@ class PlotMinimizerHeatmap(object):
             xi = fit_par_names.index(xname)
             yi = fit_par_names.index(yname)
 
-            # get the meshgrids for x and y
-            X = brute_results[2][xi]
-            Y = brute_results[2][yi]
-
-            # Find other axes to collapse
-            axes = tuple([ii for ii in range(brute_results[3].ndim) if ii not in (xi, yi)])
-
-            # Collapse to minimum Jout
-            min_jout = np.amin(brute_results[3], axis=axes)
-            min_xgrid = np.amin(X, axis=axes)
-            min_ygrid = np.amin(Y, axis=axes)
+            # Collapse to the minimum NLL over all other parameters
+            min_xgrid, min_ygrid, min_jout = self.get_min_projection(brute_results, xi, yi)
 
             # Create heatmap
             ax.pcolormesh(min_xgrid, min_ygrid, min_jout)
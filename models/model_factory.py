@@ -0,0 +1,525 @@
+import compile_cache  # sets Theano's compile directory (setting compile_dir); has to come before theano
+import numpy as np
+import theano
+import theano.tensor as T
+import pymc3 as pm
+
+from shared_modeling_simulation import update_Q, update_Q_prefix, p_from_Q, get_likelihoods, post_from_lik
+from shared_aliens import alien_initial_Q, update_Qs, update_Qs_marg, get_flat_Q_pairs, get_flat_Q_low_sub
+
+
+# Each model variant is built (and its logp / dlogp compiled) once per process and shape; datasets are swapped in
+# with set_data. Shorter datasets are padded: mask (shape [n_trials, n_subj]) is 0 for padded trials and subjects,
+# whose choices then have constant probability and do not inform any parameter.
+models = {}  # (variant, n_subj, n_trials, n_groups, options) -> [model, data]
+steps = {}  # (id(model), target_accept) -> NUTS step method with the compiled logp / dlogp
+upper = 1000
+n_seasons, n_TS, n_aliens, n_actions = 3, 3, 4, 3
+
+
+def get_model(variant, n_subj, n_trials, n_groups=3, **options):
+    """
+    The pymc3 model of variant (a key of model_builders) for up to n_subj subjects and n_trials trials.
+    The model is only built the first time; later calls with the same arguments return the same model.
+    Returns [model, data]: data maps 'rewards', 'choices', 'group', etc. to theano.shared containers (see set_data).
+    """
+
+    key = (variant, n_subj, n_trials, n_groups, tuple(sorted(options.items())))
+    if key not in models:
+        print("Building model {0} for {1} subjects and {2} trials...".format(variant, n_subj, n_trials))
+        data = get_data_containers(variant, n_subj, n_trials, **options)
+        with pm.Model() as model:
+            model_builders[variant](data, n_subj, n_trials, n_groups, **options)
+        model.model_spec = {'variant': variant, 'n_subj': n_subj, 'n_trials': n_trials, 'n_groups': n_groups,
+                            'options': options}  # get_model_from_spec rebuilds it (e.g., to read a chunked_trace)
+        models[key] = [model, data]
+    return models[key]
+
+
+def get_model_from_spec(model_spec):
+    return get_model(model_spec['variant'], model_spec['n_subj'], model_spec['n_trials'], model_spec['n_groups'],
+                     **model_spec['options'])
+
+
+def get_step(model, target_accept=0.8):
+
+    # NUTS compiles logp / dlogp when it is created, so it is created once and reused (pm.sample(step=...))
+    # for all datasets; pm.sample resets step size and mass matrix adaptation at the beginning of each run
+    key = (id(model), target_accept)
+    if key not in steps:
+        with model:
+            steps[key] = pm.NUTS(target_accept=target_accept)
+    return steps[key]
+
+
+def fit_variational(model, method='advi', n_iterations=30000, n_draws=1000):
+    """
+    Fit model with mean-field ('advi') or full-rank ADVI ('fullrank_advi') instead of NUTS, for fast screening of
+    model variants. Returns n_draws draws from the approximation as a trace (pm.summary, trace[name], pickling, and
+    pm.waic work as for pm.sample; there are no sampler stats such as 'diverging').
+    """
+
+    print("Fitting {0} with {1} iterations...".format(method, n_iterations))
+    with model:
+        approx = pm.fit(n_iterations, method=method,
+                        callbacks=[pm.callbacks.CheckParametersConvergence(diff='absolute')])
+
+    return approx.sample(n_draws)
+
+
+def get_data_containers(variant, n_subj, n_trials, flat_fast_path=False, **options):
+
+    # theano.shared containers for all data of variant (filled with set_data)
+    if variant == 'Aliens':
+        names = ['seasons', 'aliens', 'actions', 'rewards']
+    else:
+        names = ['rewards', 'choices']
+    data = {name: theano.shared(np.zeros((n_trials, n_subj), dtype='int32'), name=name) for name in names}
+    data['group'] = theano.shared(np.zeros(n_subj, dtype='int32'), name='group')
+    data['mask'] = theano.shared(np.zeros((n_trials, n_subj)), name='mask')
+    if flat_fast_path:
+        data['flat_Q_pairs'] = [theano.shared(np.zeros(0, dtype='int32')) for _ in range(6)]
+    return data
+
+
+def set_data(data, **arrays):
+    """
+    Put a new dataset into the shared containers of get_model, e.g., set_data(data, rewards=..., choices=...,
+    group=...). Arrays have shape [n_trials, n_subj] (group: [n_subj]) and can be smaller than the model;
+    the rest is padded and masked out. All arrays of the model must be given (group defaults to 0).
+    """
+
+    n_trials, n_subj = data['mask'].get_value().shape
+    data_n_trials, data_n_subj = np.shape([array for name, array in arrays.items() if name != 'group'][0])
+    assert data_n_trials <= n_trials and data_n_subj <= n_subj, \
+        "Data of shape {0} does not fit into a model for {1} trials and {2} subjects. Use get_model with more.".\
+        format((data_n_trials, data_n_subj), n_trials, n_subj)
+
+    for name, array in arrays.items():
+        padded = np.zeros(data[name].get_value().shape, dtype='int32')
+        padded[tuple(slice(0, size) for size in np.shape(array))] = array
+        data[name].set_value(padded)
+    if 'group' not in arrays:
+        data['group'].set_value(np.zeros(n_subj, dtype='int32'))
+
+    mask = np.zeros((n_trials, n_subj))
+    mask[:data_n_trials, :data_n_subj] = 1
+    data['mask'].set_value(mask)
+
+    # Which Q-value updates each trial depends on (data only; see get_flat_Q_pairs)
+    if 'flat_Q_pairs' in data:
+        pairs = get_flat_Q_pairs(data['seasons'].get_value(), data['aliens'].get_value(), data['actions'].get_value())
+        for container, column in zip(data['flat_Q_pairs'], pairs):
+            container.set_value(column)
+
+
+# Model variants (called inside the model context)
+def build_ps_rl(data, n_subj, n_trials, n_groups, update_Q_method='scan'):
+
+    # RL model of PSRLModel.py
+    rewards, choices, group = data['rewards'], data['choices'], data['group']
+
+    # Get population-level and individual parameters
+    beta_a_a = pm.Uniform('beta_a_a', lower=0, upper=upper)
+    beta_a_b = pm.Uniform('beta_a_b', lower=0, upper=upper)
+    beta_b_a = pm.Uniform('beta_b_a', lower=0, upper=upper)
+    beta_b_b = pm.Uniform('beta_b_b', lower=0, upper=upper)
+    beta_a = pm.Gamma('beta_a', alpha=beta_a_a, beta=beta_a_b, shape=n_groups)
+    beta_b = pm.Gamma('beta_b', alpha=beta_b_a, beta=beta_b_b, shape=n_groups)
+    eps = T.as_tensor_variable(0)
+
+    nalpha_a_a = pm.Uniform('nalpha_a_a', lower=0, upper=upper)
+    nalpha_a_b = pm.Uniform('nalpha_a_b', lower=0, upper=upper)
+    nalpha_b_a = pm.Uniform('nalpha_b_a', lower=0, upper=upper)
+    nalpha_b_b = pm.Uniform('nalpha_b_b', lower=0, upper=upper)
+    nalpha_a = pm.Gamma('nalpha_a', alpha=nalpha_a_a, beta=nalpha_a_b, shape=n_groups)
+    nalpha_b = pm.Gamma('nalpha_b', alpha=nalpha_b_a, beta=nalpha_b_b, shape=n_groups)
+
+    calpha_sc_a_a = pm.Uniform('calpha_sc_a_a', lower=0, upper=upper)
+    calpha_sc_a_b = pm.Uniform('calpha_sc_a_b', lower=0, upper=upper)
+    calpha_sc_b_a = pm.Uniform('calpha_sc_b_a', lower=0, upper=upper)
+    calpha_sc_b_b = pm.Uniform('calpha_sc_b_b', lower=0, upper=upper)
+    calpha_sc_a = pm.Gamma('calpha_sc_a', alpha=calpha_sc_a_a, beta=calpha_sc_a_b, shape=n_groups)
+    calpha_sc_b = pm.Gamma('calpha_sc_b', alpha=calpha_sc_b_a, beta=calpha_sc_b_b, shape=n_groups)
+    calpha_sc = pm.Beta('calpha_sc', alpha=calpha_sc_a[group], beta=calpha_sc_b[group], shape=n_subj)
+
+    cnalpha_sc_a_a = pm.Uniform('cnalpha_sc_a_a', lower=0, upper=upper)
+    cnalpha_sc_a_b = pm.Uniform('cnalpha_sc_a_b', lower=0, upper=upper)
+    cnalpha_sc_b_a = pm.Uniform('cnalpha_sc_b_a', lower=0, upper=upper)
+    cnalpha_sc_b_b = pm.Uniform('cnalpha_sc_b_b', lower=0, upper=upper)
+    cnalpha_sc_a = pm.Gamma('cnalpha_sc_a', alpha=cnalpha_sc_a_a, beta=cnalpha_sc_a_b, shape=n_groups)
+    cnalpha_sc_b = pm.Gamma('cnalpha_sc_b', alpha=cnalpha_sc_b_a, beta=cnalpha_sc_b_b, shape=n_groups)
+    cnalpha_sc = pm.Beta('cnalpha_sc', alpha=cnalpha_sc_a[group], beta=cnalpha_sc_b[group], shape=n_subj)
+
+    # Individual parameters
+    alpha = pm.Deterministic('alpha', T.ones(n_subj))
+    beta = pm.Gamma('beta', alpha=beta_a[group], beta=beta_b[group], shape=n_subj)
+    nalpha = pm.Deterministic('nalpha', alpha.copy())  # pm.Beta('nalpha', alpha=nalpha_a[group], beta=nalpha_b[group], shape=n_subj)
+    calpha = pm.Deterministic('calpha', alpha * calpha_sc)
+    cnalpha = pm.Deterministic('cnalpha', nalpha * cnalpha_sc)
+
+    # Get parameter means and variances
+    beta_mu = pm.Deterministic(
+        'beta_mu', beta_a / beta_b)
+    beta_var = pm.Deterministic(
+        'beta_var', beta_a / np.square(beta_b))
+    nalpha_mu = pm.Deterministic(
+        'nalpha_mu', 1 / (1 + nalpha_b / nalpha_a))
+    nalpha_var = pm.Deterministic(
+        'nalpha_var', (nalpha_a * nalpha_b) / (np.square(nalpha_a + nalpha_b) * (nalpha_a + nalpha_b + 1)))
+    calpha_sc_mu = pm.Deterministic(
+        'calpha_sc_mu', 1 / (1 + calpha_sc_b / calpha_sc_a))
+    calpha_sc_var = pm.Deterministic(
+        'calpha_sc_var', (calpha_sc_a * calpha_sc_b) / (np.square(calpha_sc_a + calpha_sc_b) * (calpha_sc_a + calpha_sc_b + 1)))
+    cnalpha_sc_mu = pm.Deterministic(
+        'cnalpha_sc_mu', 1 / (1 + cnalpha_sc_b / cnalpha_sc_a))
+    cnalpha_sc_var = pm.Deterministic(
+        'cnalpha_sc_var', (cnalpha_sc_a * cnalpha_sc_b) / (np.square(cnalpha_sc_a + cnalpha_sc_b) * (cnalpha_sc_a + cnalpha_sc_b + 1)))
+
+    # Group differences?
+    beta_mu_diff01 = pm.Deterministic('beta_mu_diff01', beta_a[0] - beta_a[1])
+    beta_mu_diff02 = pm.Deterministic('beta_mu_diff02', beta_a[0] - beta_a[2])
+    beta_mu_diff12 = pm.Deterministic('beta_mu_diff12', beta_a[1] - beta_a[2])
+
+    nalpha_mu_diff01 = pm.Deterministic('nalpha_mu_diff01', nalpha_a[0] - nalpha_a[1])
+    nalpha_mu_diff02 = pm.Deterministic('nalpha_mu_diff02', nalpha_a[0] - nalpha_a[2])
+    nalpha_mu_diff12 = pm.Deterministic('nalpha_mu_diff12', nalpha_a[1] - nalpha_a[2])
+
+    calpha_sc_mu_diff01 = pm.Deterministic('calpha_sc_mu_diff01', calpha_sc_a[0] - calpha_sc_a[1])
+    calpha_sc_mu_diff02 = pm.Deterministic('calpha_sc_mu_diff02', calpha_sc_a[0] - calpha_sc_a[2])
+    calpha_sc_mu_diff12 = pm.Deterministic('calpha_sc_mu_diff12', calpha_sc_a[1] - calpha_sc_a[2])
+
+    cnalpha_sc_mu_diff01 = pm.Deterministic('cnalpha_sc_mu_diff01', cnalpha_sc_a[0] - cnalpha_sc_a[1])
+    cnalpha_sc_mu_diff02 = pm.Deterministic('cnalpha_sc_mu_diff02', cnalpha_sc_a[0] - cnalpha_sc_a[2])
+    cnalpha_sc_mu_diff12 = pm.Deterministic('cnalpha_sc_mu_diff12', cnalpha_sc_a[1] - cnalpha_sc_a[2])
+
+    # Calculate Q-values
+    Q_left, Q_right = 0.5 * T.ones(n_subj, dtype='int32'), 0.5 * T.ones(n_subj, dtype='int32')
+    if update_Q_method == 'prefix':
+        Q_left, Q_right = update_Q_prefix(rewards, choices, Q_left, Q_right, alpha, nalpha, calpha, cnalpha, n_trials)
+    else:
+        [Q_left, Q_right], _ = theano.scan(fn=update_Q,
+                                           sequences=[rewards, choices],
+                                           outputs_info=[Q_left, Q_right],
+                                           non_sequences=[alpha, nalpha, calpha, cnalpha])
+
+    # Translate Q-values into probabilities and add eps noise
+    p_right = p_from_Q(Q_left, Q_right, beta, eps)
+    add_ps_likelihood(data, p_right, n_subj)
+
+
+def build_ps_model(data, n_subj, n_trials, n_groups, model_name='RL', update_Q_method='scan'):
+
+    # 'RL' and 'Bayes' models of PSModel.py
+    rewards, choices, group = data['rewards'], data['choices'], data['group']
+
+    # Get population-level and individual parameters
+    beta_a_a = pm.Uniform('beta_a_a', lower=0, upper=upper)
+    beta_a_b = pm.Uniform('beta_a_b', lower=0, upper=upper)
+    beta_b_a = pm.Uniform('beta_b_a', lower=0, upper=upper)
+    beta_b_b = pm.Uniform('beta_b_b', lower=0, upper=upper)
+    beta_a = pm.Gamma('beta_a', alpha=beta_a_a, beta=beta_a_b, shape=n_groups)
+    beta_b = pm.Gamma('beta_b', alpha=beta_b_a, beta=beta_b_b, shape=n_groups)
+    beta = pm.Gamma('beta', alpha=beta_a[group], beta=beta_b[group], shape=n_subj)
+    eps = T.as_tensor_variable(0)
+
+    # Beta mu and var and group differences
+    beta_mu = pm.Deterministic(
+        'beta_mu', beta_a / beta_b)
+    beta_var = pm.Deterministic(
+        'beta_var', beta_a / np.square(beta_b))
+    beta_mu_diff01 = pm.Deterministic('beta_mu_diff01', beta_a[0] - beta_a[1])
+    beta_mu_diff02 = pm.Deterministic('beta_mu_diff02', beta_a[0] - beta_a[2])
+    beta_mu_diff12 = pm.Deterministic('beta_mu_diff12', beta_a[1] - beta_a[2])
+
+    if model_name == 'Bayes':
+
+        p_switch_a_a = pm.Uniform('p_switch_a_a', lower=0, upper=upper)
+        p_switch_a_b = pm.Uniform('p_switch_a_b', lower=0, upper=upper)
+        p_switch_b_a = pm.Uniform('p_switch_b_a', lower=0, upper=upper)
+        p_switch_b_b = pm.Uniform('p_switch_b_b', lower=0, upper=upper)
+        p_switch_a = pm.Gamma('p_switch_a', alpha=p_switch_a_a, beta=p_switch_a_b, shape=n_groups)
+        p_switch_b = pm.Gamma('p_switch_b', alpha=p_switch_b_a, beta=p_switch_b_b, shape=n_groups)
+        p_switch = pm.Beta('p_switch', alpha=p_switch_a[group], beta=p_switch_b[group], shape=n_subj)
+
+        p_reward_a_a = pm.Uniform('p_reward_a_a', lower=0, upper=upper)
+        p_reward_a_b = pm.Uniform('p_reward_a_b', lower=0, upper=upper)
+        p_reward_b_a = pm.Uniform('p_reward_b_a', lower=0, upper=upper)
+        p_reward_b_b = pm.Uniform('p_reward_b_b', lower=0, upper=upper)
+        p_reward_a = pm.Gamma('p_reward_a', alpha=p_reward_a_a, beta=p_reward_a_b, shape=n_groups)
+        p_reward_b = pm.Gamma('p_reward_b', alpha=p_reward_b_a, beta=p_reward_b_b, shape=n_groups)
+        p_reward = pm.Beta('p_reward', alpha=p_reward_a[group], beta=p_reward_b[group], shape=n_subj)
+
+        p_noisy = 1e-5 * T.ones(n_subj)
+
+        # Get likelihoods
+        lik_cor, lik_inc = get_likelihoods(rewards, choices, p_reward, p_noisy)
+
+        # Get posterior, calculate probability of subsequent trial, add eps noise (no perseveration bonus)
+        p_right = 0.5 * T.ones(n_subj)
+        p_right, _ = theano.scan(fn=post_from_lik,
+                                 sequences=[lik_cor, lik_inc, T.zeros_like(lik_cor)],
+                                 outputs_info=[p_right],
+                                 non_sequences=[p_switch, eps, beta])
+
+    elif model_name == 'RL':
+
+        alpha_a_a = pm.Uniform('alpha_a_a', lower=0, upper=upper)
+        alpha_a_b = pm.Uniform('alpha_a_b', lower=0, upper=upper)
+        alpha_b_a = pm.Uniform('alpha_b_a', lower=0, upper=upper)
+        alpha_b_b = pm.Uniform('alpha_b_b', lower=0, upper=upper)
+        alpha_a = pm.Gamma('alpha_a', alpha=alpha_a_a, beta=alpha_a_b, shape=n_groups)
+        alpha_b = pm.Gamma('alpha_b', alpha=alpha_b_a, beta=alpha_b_b, shape=n_groups)
+        alpha = pm.Beta('alpha', alpha=alpha_a[group], beta=alpha_b[group], shape=n_subj)
+
+        nalpha_a_a = pm.Uniform('nalpha_a_a', lower=0, upper=upper)
+        nalpha_a_b = pm.Uniform('nalpha_a_b', lower=0, upper=upper)
+        nalpha_b_a = pm.Uniform('nalpha_b_a', lower=0, upper=upper)
+        nalpha_b_b = pm.Uniform('nalpha_b_b', lower=0, upper=upper)
+        nalpha_a = pm.Gamma('nalpha_a', alpha=nalpha_a_a, beta=nalpha_a_b, shape=n_groups)
+        nalpha_b = pm.Gamma('nalpha_b', alpha=nalpha_b_a, beta=nalpha_b_b, shape=n_groups)
+        nalpha = pm.Beta('nalpha', alpha=nalpha_a[group], beta=nalpha_b[group], shape=n_subj)
+
+        calpha_sc = pm.Deterministic('calpha_sc', T.as_tensor_variable(0))
+        calpha = pm.Deterministic('calpha', alpha * calpha_sc)
+        cnalpha_sc = pm.Deterministic('cnalpha_sc', calpha_sc.copy())
+        cnalpha = pm.Deterministic('cnalpha', nalpha * cnalpha_sc)
+
+        # Get parameter means and variances
+        alpha_mu = pm.Deterministic(
+            'alpha_mu', 1 / (1 + alpha_b / alpha_a))
+        alpha_var = pm.Deterministic(
+            'alpha_var', (alpha_a * alpha_b) / (np.square(alpha_a + alpha_b) * (alpha_a + alpha_b + 1)))
+        nalpha_mu = pm.Deterministic(
+            'nalpha_mu', 1 / (1 + nalpha_b / nalpha_a))
+        nalpha_var = pm.Deterministic(
+            'nalpha_var', (nalpha_a * nalpha_b) / (np.square(nalpha_a + nalpha_b) * (nalpha_a + nalpha_b + 1)))
+
+        # Group differences?
+        alpha_mu_diff01 = pm.Deterministic('alpha_mu_diff01', alpha_a[0] - alpha_a[1])
+        alpha_mu_diff02 = pm.Deterministic('alpha_mu_diff02', alpha_a[0] - alpha_a[2])
+        alpha_mu_diff12 = pm.Deterministic('alpha_mu_diff12', alpha_a[1] - alpha_a[2])
+
+        nalpha_mu_diff01 = pm.Deterministic('nalpha_mu_diff01', nalpha_a[0] - nalpha_a[1])
+        nalpha_mu_diff02 = pm.Deterministic('nalpha_mu_diff02', nalpha_a[0] - nalpha_a[2])
+        nalpha_mu_diff12 = pm.Deterministic('nalpha_mu_diff12', nalpha_a[1] - nalpha_a[2])
+
+        # Calculate Q-values
+        Q_left, Q_right = 0.5 * T.ones(n_subj), 0.5 * T.ones(n_subj)
+        if update_Q_method == 'prefix':
+            Q_left, Q_right = update_Q_prefix(rewards, choices, Q_left, Q_right,
+                                              alpha, nalpha, calpha, cnalpha, n_trials)
+        else:
+            [Q_left, Q_right], _ = theano.scan(fn=update_Q,
+                                               sequences=[rewards, choices],
+                                               outputs_info=[Q_left, Q_right],
+                                               non_sequences=[alpha, nalpha, calpha, cnalpha])
+
+        # Translate Q-values into probabilities and add eps noise
+        p_right = p_from_Q(Q_left, Q_right, beta, eps)
+
+    add_ps_likelihood(data, p_right, n_subj)
+
+
+def build_ps_bayes(data, n_subj, n_trials, n_groups):
+
+    # Bayesian model of PSBayesModel.py
+    rewards, choices, group = data['rewards'], data['choices'], data['group']
+    persev_bonus = T.concatenate([T.zeros((1, n_subj), dtype='int32'), 2 * choices - 1])  # -1 left, +1 right; 0 first
+
+    # Get population-level and individual parameters
+    eps = T.as_tensor_variable(0)
+    p_noisy = 1e-5 * T.as_tensor_variable(1)
+
+    beta_a_a = pm.Uniform('beta_a_a', lower=0, upper=upper)
+    beta_a_b = pm.Uniform('beta_a_b', lower=0, upper=upper)
+    beta_b_a = pm.Uniform('beta_b_a', lower=0, upper=upper)
+    beta_b_b = pm.Uniform('beta_b_b', lower=0, upper=upper)
+    beta_a = pm.Gamma('beta_a', alpha=beta_a_a, beta=beta_a_b, shape=n_groups)
+    beta_b = pm.Gamma('beta_b', alpha=beta_b_a, beta=beta_b_b, shape=n_groups)
+
+    persev_mu_mu = pm.Uniform('persev_mu_mu', lower=-1, upper=1)
+    persev_mu_sd = pm.HalfNormal('persev_mu_sd', sd=0.5)
+    persev_sd_sd = pm.HalfNormal('persev_sd_sd', sd=0.1)
+
+    p_switch_a_a = pm.Uniform('p_switch_a_a', lower=0, upper=upper)
+    p_switch_a_b = pm.Uniform('p_switch_a_b', lower=0, upper=upper)
+    p_switch_b_a = pm.Uniform('p_switch_b_a', lower=0, upper=upper)
+    p_switch_b_b = pm.Uniform('p_switch_b_b', lower=0, upper=upper)
+    p_switch_a = pm.Gamma('p_switch_a', alpha=p_switch_a_a, beta=p_switch_a_b, shape=n_groups)
+    p_switch_b = pm.Gamma('p_switch_b', alpha=p_switch_b_a, beta=p_switch_b_b, shape=n_groups)
+
+    p_reward_a_a = pm.Uniform('p_reward_a_a', lower=0, upper=upper)
+    p_reward_a_b = pm.Uniform('p_reward_a_b', lower=0, upper=upper)
+    p_reward_b_a = pm.Uniform('p_reward_b_a', lower=0, upper=upper)
+    p_reward_b_b = pm.Uniform('p_reward_b_b', lower=0, upper=upper)
+    p_reward_a = pm.Gamma('p_reward_a', alpha=p_reward_a_a, beta=p_reward_a_b, shape=n_groups)
+    p_reward_b = pm.Gamma('p_reward_b', alpha=p_reward_b_a, beta=p_reward_b_b, shape=n_groups)
+
+    # Parameter mu and var and group differences
+    beta_mu = pm.Deterministic('beta_mu', beta_a / beta_b)
+    beta_var = pm.Deterministic('beta_var', beta_a / T.square(beta_b))
+    persev_mu = pm.Bound(pm.Normal, lower=-1, upper=1)('persev_mu', mu=persev_mu_mu, sd=persev_mu_sd, shape=n_groups)
+    persev_sd = pm.HalfNormal('persev_sd', sd=persev_sd_sd, shape=n_groups)
+    p_switch_mu = pm.Deterministic('p_switch_mu', p_switch_a / (p_switch_a + p_switch_b))
+    p_switch_var = pm.Deterministic('p_switch_var', p_switch_a * p_switch_b / (T.square(p_switch_a + p_switch_b) * (p_switch_a + p_switch_b + 1)))
+    p_reward_mu = pm.Deterministic('p_reward_mu', p_reward_a / (p_reward_a + p_reward_b))
+    p_reward_var = pm.Deterministic('p_reward_var', p_reward_a * p_reward_b / (T.square(p_reward_a + p_reward_b) * (p_reward_a + p_reward_b + 1)))
+
+    # Individual parameters
+    beta = pm.Gamma('beta', alpha=beta_a[group], beta=beta_b[group], shape=n_subj)
+    persev = pm.Bound(pm.Normal, lower=-1, upper=1)('persev', mu=persev_mu[group], sd=persev_sd[group], shape=(1, n_subj), testval=0.1 * T.ones((1, n_subj)))
+    scaled_persev_bonus = persev_bonus * persev
+    p_switch = pm.Beta('p_switch', alpha=p_switch_a[group], beta=p_switch_b[group], shape=n_subj)
+    p_reward = pm.Beta('p_reward', alpha=p_reward_a[group], beta=p_reward_b[group], shape=n_subj)
+
+    # Group differences
+    add_group_differences(beta_mu=beta_mu, persev_mu=persev_mu, p_switch_mu=p_switch_mu, p_reward_mu=p_reward_mu)
+
+    add_ps_bayes_likelihood(data, rewards, choices, scaled_persev_bonus, p_switch, p_reward, p_noisy, eps, beta, n_subj)
+
+
+def build_ps_bayes_non_centered(data, n_subj, n_trials, n_groups):
+
+    # Bayesian model of PSBayesModelNonCentered.py (non-centered individual parameters)
+    rewards, choices, group = data['rewards'], data['choices'], data['group']
+    persev_bonus = T.concatenate([T.zeros((1, n_subj), dtype='int32'), 2 * choices - 1])  # -1 left, +1 right; 0 first
+
+    # Get population-level and individual parameters
+    eps = T.as_tensor_variable(0)
+    p_noisy = 1e-5 * T.as_tensor_variable(1)
+
+    beta_mu_mu = pm.Bound(pm.Normal, lower=0)('beta_mu_mu', mu=1, sd=2)
+    beta_mu_sd = pm.HalfNormal('beta_mu_sd', sd=2)
+    beta_sd_sd = pm.HalfNormal('beta_sd_sd', sd=1)
+    beta_mu = pm.Bound(pm.Normal, lower=0)('beta_mu', mu=beta_mu_mu, sd=beta_mu_sd, shape=n_groups)
+    beta_sd = pm.HalfNormal('beta_sd', sd=beta_sd_sd, shape=n_groups)
+    beta_offset = pm.Normal('beta_offset', mu=0, sd=1, shape=n_subj)
+
+    persev_mu_mu = pm.Bound(pm.Normal, lower=-1, upper=1)('persev_mu_mu', mu=0, sd=0.5)
+    persev_mu_sd = pm.HalfNormal('persev_mu_sd', sd=0.5)
+    persev_sd_sd = pm.HalfNormal('persev_sd_sd', sd=0.5)
+    persev_mu = pm.Bound(pm.Normal, lower=-1, upper=1)('persev_mu', mu=persev_mu_mu, sd=persev_mu_sd, shape=n_groups)
+    persev_sd = pm.HalfNormal('persev_sd', sd=persev_sd_sd, shape=n_groups)
+    persev_offset = pm.Normal('persev_offset', mu=0, sd=1, shape=n_subj)
+
+    p_switch_mu_mu = pm.Bound(pm.Normal, lower=0, upper=1)('p_switch_mu_mu', mu=0.1, sd=0.5)
+    p_switch_mu_sd = pm.HalfNormal('p_switch_mu_sd', sd=0.5)
+    p_switch_sd_sd = pm.HalfNormal('p_switch_sd_sd', sd=0.5)
+    p_switch_mu = pm.Bound(pm.Normal, lower=0, upper=1)('p_switch_mu', mu=p_switch_mu_mu, sd=p_switch_mu_sd, shape=n_groups)
+    p_switch_sd = pm.HalfNormal('p_switch_sd', sd=p_switch_sd_sd, shape=n_groups)
+    p_switch_offset = pm.Normal('p_switch_offset', mu=0, sd=1, shape=n_subj)
+
+    p_reward_mu_mu = pm.Bound(pm.Normal, lower=0, upper=1)('p_reward_mu_mu', mu=0.75, sd=0.5)
+    p_reward_mu_sd = pm.HalfNormal('p_reward_mu_sd', sd=0.5)
+    p_reward_sd_sd = pm.HalfNormal('p_reward_sd_sd', sd=0.5)
+    p_reward_mu = pm.Bound(pm.Normal, lower=0, upper=1)('p_reward_mu', mu=p_reward_mu_mu, sd=p_reward_mu_sd, shape=n_groups)
+    p_reward_sd = pm.HalfNormal('p_reward_sd', sd=p_reward_sd_sd, shape=n_groups)
+    p_reward_offset = pm.Normal('p_reward_offset', mu=0, sd=1, shape=n_subj)
+
+    # Individual parameters
+    beta = pm.Deterministic('beta', beta_mu[group] + beta_offset * beta_sd[group])
+    persev = pm.Deterministic('persev', persev_mu[group] + persev_offset * persev_sd[group])
+    p_switch = pm.Deterministic('p_switch', p_switch_mu[group] + p_switch_offset * p_switch_sd[group])
+    p_reward = pm.Deterministic('p_reward', p_reward_mu[group] + p_reward_offset * p_reward_sd[group])
+
+    scaled_persev_bonus = persev_bonus * persev.reshape((1, n_subj))
+
+    # Group differences
+    add_group_differences(beta_mu=beta_mu, persev_mu=persev_mu, p_switch_mu=p_switch_mu, p_reward_mu=p_reward_mu)
+
+    add_ps_bayes_likelihood(data, rewards, choices, scaled_persev_bonus, p_switch, p_reward, p_noisy, eps, beta, n_subj)
+
+
+def build_aliens(data, n_subj, n_trials, n_groups, flat_fast_path=False, marginalize_TS=False):
+
+    # Model of AliensModelManySubj.py
+    seasons, aliens, actions, rewards = data['seasons'], data['aliens'], data['actions'], data['rewards']
+
+    # RL parameters: softmax temperature beta; learning rate alpha; forgetting of Q-values
+    beta_shape = (n_subj, 1)  # Q_sub.shape inside scan -> [n_subj, n_actions]
+    forget_shape = (n_subj, 1, 1, 1)  # Q_low.shape inside scan -> [n_subj, n_TS, n_aliens, n_actions]
+    beta_high_shape = (n_subj, 1)  # Q_high_sub.shape inside scan -> [n_subj, n_TS]
+    forget_high_shape = (n_subj, 1, 1)  # Q_high.shape inside scan -> [n_subj, n_seasons, n_TS]
+
+    alpha_mu = pm.HalfNormal('alpha_mu', sd=0.1)
+    alpha_sd = pm.HalfNormal('alpha_sd', sd=0.1)
+    beta_mu = pm.Bound(pm.Normal, lower=0)('beta_mu', mu=1, sd=2)
+    beta_sd = pm.HalfNormal('beta_sd', sd=1)
+    forget_mu = pm.HalfNormal('forget_mu', sd=0.05)
+    forget_sd = pm.HalfNormal('forget_sd', sd=0.05)
+
+    alpha = pm.Beta('alpha', mu=alpha_mu, sd=alpha_sd, shape=n_subj)
+    beta = pm.Bound(pm.Normal, lower=0)('beta', mu=beta_mu, sd=beta_sd, shape=beta_shape)
+    forget = pm.Beta('forget', mu=forget_mu, sd=forget_sd, shape=forget_shape)
+
+    alpha_high = pm.Deterministic('alpha_high', 0.2 * T.ones(n_subj))  # Flat agent
+    beta_high = pm.Deterministic('beta_high', 2 * T.ones(beta_high_shape))
+    forget_high = pm.Deterministic('forget_high', T.zeros(forget_high_shape))
+
+    # Calculate Q_high and Q_low for each trial
+    if flat_fast_path:
+        Q_low_sub = get_flat_Q_low_sub(data['flat_Q_pairs'], rewards, alpha, forget.flatten(), n_trials, n_subj,
+                                       n_actions)
+        p_low = T.nnet.softmax((beta * Q_low_sub).reshape([n_trials * n_subj, n_actions]))
+    else:
+        Q_low0 = alien_initial_Q * T.ones([n_subj, n_TS, n_aliens, n_actions])
+        Q_high0 = alien_initial_Q * T.ones([n_subj, n_seasons, n_TS])
+        [Q_low, _, TS, p_low], _ = theano.scan(fn=update_Qs_marg if marginalize_TS else update_Qs,
+                                               sequences=[seasons, aliens, actions, rewards],
+                                               outputs_info=[Q_low0, Q_high0, None, None],
+                                               non_sequences=[beta, beta_high, alpha, alpha_high, forget, forget_high, n_subj, n_TS])
+
+    # Padded trials and subjects choose randomly
+    mask = data['mask'].reshape([n_trials * n_subj, 1])
+    p_low = mask * p_low.reshape([n_trials * n_subj, n_actions]) + (1 - mask) / n_actions
+
+    # Relate calculated p_low to observed actions
+    model_actions = pm.Categorical('actions',
+                                   p=p_low,
+                                   observed=actions.flatten())
+
+
+# Shared parts of the PS models
+def add_ps_bayes_likelihood(data, rewards, choices, scaled_persev_bonus, p_switch, p_reward, p_noisy, eps, beta,
+                            n_subj):
+
+    # Get likelihoods
+    lik_cor, lik_inc = get_likelihoods(rewards, choices, p_reward, p_noisy)
+
+    # Get posterior, calculate probability of subsequent trial, add eps noise
+    p_right = 0.5 * T.ones(n_subj, dtype='int32')
+    p_right, _ = theano.scan(fn=post_from_lik,
+                             sequences=[lik_cor, lik_inc, scaled_persev_bonus],
+                             outputs_info=[p_right],
+                             non_sequences=[p_switch, eps, beta])
+    add_ps_likelihood(data, p_right, n_subj)
+
+
+def add_ps_likelihood(data, p_right, n_subj):
+
+    # Add initial p=0.5 at the beginning of p_right
+    initial_p = 0.5 * T.ones((1, n_subj))
+    p_right = T.concatenate([initial_p, p_right[:-1]], axis=0)
+
+    # Padded trials and subjects choose randomly
+    p_right = data['mask'] * p_right + (1 - data['mask']) * 0.5
+
+    # Use Bernoulli to sample responses
+    model_choices = pm.Bernoulli('model_choices', p=p_right, observed=data['choices'])
+
+
+def add_group_differences(**group_means):
+
+    # Differences between the means of groups 0, 1, and 2
+    for name, mu in group_means.items():
+        pm.Deterministic(name + '_diff01', mu[0] - mu[1])
+        pm.Deterministic(name + '_diff02', mu[0] - mu[2])
+        pm.Deterministic(name + '_diff12', mu[1] - mu[2])
+
+
+model_builders = {'PSRL': build_ps_rl,
+                  'PS': build_ps_model,  # model_name='RL' or 'Bayes'
+                  'PSBayes': build_ps_bayes,
+                  'PSBayesNonCentered': build_ps_bayes_non_centered,
+                  'Aliens': build_aliens}
@@ -10,6 +10,7 @@ import matplotlib.pyplot as plt
 import seaborn as sns
 
 from shared_modeling_simulation import get_paths, get_alien_paths
+from data_cache import read_csv_columns, split_by_file
 
 
 def load_aliens_data(run_on_cluster, fitted_data_name, param_names, file_name_suff, n_subj, n_trials, verbose):
@@ -33,39 +34,44 @@ def load_aliens_data(run_on_cluster, fitted_data_name, param_names, file_name_su
     true_params = pd.DataFrame(np.ones((len(param_names), n_subj)),
                                index=['true_' + param_name for param_name in param_names])
 
-    # Load data and bring in the right format
-    for file_idx, filename in enumerate(filenames):
-        agent_data = pd.read_csv(filename)
-        if agent_data.shape[0] > n_trials:
-
-            # Remove all rows that do not contain 1InitialLearning data (-> jsPysch format)
-            agent_data = agent_data.rename(columns={'TS': 'context'})
-            context_names = [str(TS) for TS in range(3)]
-            item_names = range(3)
-            agent_data = agent_data.loc[
-                (agent_data['context'].isin(context_names)) &
-                # TODO: remove following line; take care of missing data elegantly using masked numpy arrays
-                (agent_data['item_chosen'].isin(item_names)) &
-                (agent_data['phase'] == '1InitialLearning')]
-            agent_data.index = range(agent_data.shape[0])
-
-            seasons[:, file_idx] = np.array(agent_data['context'])[:n_trials]
-            seasons = seasons.astype(int)
-            aliens[:, file_idx] = np.array(agent_data['sad_alien'])[:n_trials]
-            aliens = aliens.astype(int)
-            actions[:, file_idx] = np.array(agent_data['item_chosen'])[:n_trials]
+    # Load data from the columnar cache
+    columns = ['TS', 'context', 'sad_alien', 'item_chosen', 'reward', 'phase']
+    if fitted_data_name == 'simulations':
+        columns += list(param_names)
+    data, files = read_csv_columns(filenames, columns)
+
+    # Remove all rows that do not contain 1InitialLearning data (-> jsPysch format)
+    data['context'] = np.where(files['has_TS'].values[data['file_idx']], data['TS'], data['context'])  # rename "TS"
+    context_names = [str(TS) for TS in range(3)]
+    item_names = range(3)
+    data = data.loc[(data['context'].isin(context_names)) &
+                    # TODO: remove following line; take care of missing data elegantly using masked numpy arrays
+                    (data['item_chosen'].isin(item_names)) &
+                    (data['phase'] == '1InitialLearning')]
+    file_starts = split_by_file(data, len(filenames))
+
+    # Bring data in the right format
+    for file_idx in range(len(filenames)):
+        if files['n_rows'][file_idx] > n_trials:
+            agent_data = data.iloc[file_starts[file_idx]:file_starts[file_idx + 1]]
+
+            seasons[:, file_idx] = agent_data['context'].values[:n_trials].astype(float)
+            aliens[:, file_idx] = agent_data['sad_alien'].values[:n_trials]
+            actions[:, file_idx] = agent_data['item_chosen'].values[:n_trials]
             # actions[np.isnan(actions)] = -999
             # actions_masked = np.ma.masked_values(actions, value=-999)
-            actions = actions.astype(int)
             # actions_masked = actions_masked.astype(int)
-            rewards[:, file_idx] = agent_data['reward'].tolist()[:n_trials]
+            rewards[:, file_idx] = agent_data['reward'].values[:n_trials]
             # rewards = (rewards - rewards.mean(axis=0, keepdims=True)) / rewards.std(axis=0, keepdims=True)  # TODO: subjwise z-scores
             # rewards[actions == -999] = -999
             # rewards_masked = np.ma.masked_values(rewards, value=999)
             # sID = filename[-7:-4]
 
             if fitted_data_name == 'simulations':
-                true_params.ix[:, file_idx] = [agent_data[param_name][0] for param_name in param_names]
+                true_params.iloc[:, file_idx] = [agent_data[param_name].values[0] for param_name in param_names]
+    seasons = seasons.astype(int)
+    aliens = aliens.astype(int)
+    actions = actions.astype(int)
 
     # Remove excess columns (participants)
     seasons = np.delete(seasons, range(file_idx + 1, n_subj), 1)
@@ -108,15 +114,17 @@ def load_data(run_on_cluster, fitted_data_name, kids_and_teens_only, adults_only
     rewards = np.zeros(choices.shape)
     age = pd.DataFrame(np.full((n_subj, 2), np.nan), columns=['sID', 'age'])
 
-    # Load data and bring in the right format
+    # Load data from the columnar cache and bring in the right format
     SLCNinfo = pd.read_csv(paths['SLCN info'])
+    data, files = read_csv_columns(filenames, ['selected_box', 'reward', 'sID'])
+    file_starts = split_by_file(data, len(filenames))
     file_idx = 0
-    for filename in filenames:
-        agent_data = pd.read_csv(filename)
+    for filename_idx, filename in enumerate(filenames):
+        agent_data = data.iloc[file_starts[filename_idx]:file_starts[filename_idx + 1]]
         if agent_data.shape[0] > n_trials:
-            choices[:, file_idx] = np.array(agent_data['selected_box'])[:n_trials]
-            rewards[:, file_idx] = agent_data['reward'].tolist()[:n_trials]
-            sID = agent_data['sID'][0]
+            choices[:, file_idx] = agent_data['selected_box'].values[:n_trials]
+            rewards[:, file_idx] = agent_data['reward'].values[:n_trials]
+            sID = agent_data['sID'].values[0]
             subj_age = SLCNinfo[SLCNinfo['ID'] == sID]['PreciseYrs'].values
             if not subj_age:
                 subj_age = [np.nan]
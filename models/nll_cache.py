@@ -0,0 +1,48 @@
+from collections import OrderedDict
+
+import numpy as np
+
+
+class NLLCache(object):
+    """
+    Least-recently-used cache of NLLs, keyed by (hash of the subject's data, learning_style, parameter vector rounded
+    to decimals). Holds at most max_size NLLs; counts hits and misses.
+    """
+
+    def __init__(self, max_size=100000, decimals=8):
+        self.max_size = max_size
+        self.decimals = decimals
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get_keys(self, data_hash, learning_style, all_pars):
+
+        # One key per row of all_pars (shape [n_candidates, n_pars]); + 0. turns -0. into 0.
+        rounded = np.round(np.atleast_2d(all_pars), self.decimals) + 0.
+        return [(data_hash, learning_style, tuple(pars)) for pars in rounded.tolist()]
+
+    def get(self, key):
+
+        # Cached NLL (and mark it as recently used), or None
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return self.entries[key]
+        self.misses += 1
+        return None
+
+    def put(self, key, NLL):
+        self.entries[key] = NLL
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)  # least recently used
+
+    def get_stats(self):
+        n_lookups = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self.entries),
+                'hit_rate': self.hits / n_lookups if n_lookups else np.nan}
+
+    def __str__(self):
+        return "NLL cache: {hits} hits, {misses} misses (hit rate {hit_rate:.1%}), {size} NLLs stored".format(
+            **self.get_stats())
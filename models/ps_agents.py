@@ -1,4 +1,6 @@
 import numpy as np
+import shared_softmax
+from shared_softmax import softmax_with_epsilon
 
 
 class RLAgent(object):
@@ -77,19 +79,13 @@ class RLAgent(object):
 
     def get_p_from_Q(self, Q, beta, epsilon):
 
-        # Softmax
-        p_actions = np.empty(len(Q))
-        for i in range(len(Q)):
-            denominator = 1. + sum([np.exp(beta * (Q[j] - Q[i])) for j in range(len(Q)) if j != i])
-            p_actions[i] = 1. / denominator
-
-        # Add epsilon noise and get probabilities into [0, 1] (minimizer will sometimes go outside) -> change that!
-        p_actions = epsilon / len(p_actions) + (1 - epsilon) * p_actions
-        p_actions[np.argwhere(p_actions < 0)] = 0
-        p_actions[np.argwhere(p_actions > 1)] = 1
-        assert np.round(sum(p_actions), 3) == 1, 'Error in get_p_from_Q: probabilities must sum to 1.'
-        assert np.all(p_actions >= 0), 'Error in get_p_from_Q: probabilities must be >= 0.'
-        assert np.all(p_actions <= 1), 'Error in get_p_from_Q: probabilities must be <= 1.'
+        # Softmax and epsilon noise
+        p_actions = softmax_with_epsilon(Q, beta, epsilon)
+
+        # Get probabilities into [0, 1] (minimizer will sometimes go outside) -> change that!
+        p_actions = np.clip(p_actions, 0, 1)
+        if shared_softmax.debug:
+            assert np.round(sum(p_actions), 3) == 1, 'Error in get_p_from_Q: probabilities must sum to 1.'
         return p_actions
 
     def forget_Qs(self):
@@ -153,8 +149,9 @@ class BayesAgent(object):
         # p_actions[np.argwhere(p_actions < 0)] = 0
         # p_actions[np.argwhere(p_actions > 1)] = 1
         # assert np.round(sum(p_actions), 3) == 1, 'Error in get_p_from_Q: probabilities must sum to 1.'
-        assert np.all(p_actions >= 0), 'Error in get_p_from_Q: probabilities must be >= 0.'
-        assert np.all(p_actions <= 1), 'Error in get_p_from_Q: probabilities must be <= 1.'
+        if shared_softmax.debug:
+            assert np.all(p_actions >= 0), 'Error in get_p_from_Q: probabilities must be >= 0.'
+            assert np.all(p_actions <= 1), 'Error in get_p_from_Q: probabilities must be <= 1.'
 
         self.p_actions = p_actions
 
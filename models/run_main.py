@@ -1,9 +1,11 @@
 from main import *
+from slcn_config import get_config, get_shard
 import glob
 
 
-# Set and check parameters
-sets = {'run_on_cluster': False,
+# Set and check parameters (run_on_cluster, n_workers, data roots, and sharding can also be set in the config)
+config = get_config()
+sets = {'run_on_cluster': config.get('run_on_cluster', False),
         'data_set': 'PS',  # 'PS' or 'Aliens'
 
 	    #########################
@@ -15,7 +17,9 @@ sets = {'run_on_cluster': False,
 
         'set_specific_parameters': False,
         'use_humans': True,
-        'n_agents': 1}
+        'n_agents': 1,
+        'minimizer': config.get('minimizer', 'basinhopping'),  # or 'L-BFGS-B' (multistart), 'DE' (population)
+        'n_workers': config.get('n_workers', 1)}  # number of processes used for fitting
 check_user_settings(sets)
 
 # Get data paths, plot paths, etc.
@@ -26,32 +30,35 @@ else:
     file_name_pattern = '*' + sets['learning_style'] + '*.csv'
 agent_ids = range(173, 177)
 
-# Interactive game
-# interactive_game(sets, paths['prob_switch_randomized_sequences'])
-
-# # Simulate random agents based on the model specified above
-# for agent_id in agent_ids:
-#     simulate(sets, agent_id,
-#              paths['agent_data_path'],
-#              paths['prob_switch_randomized_sequences'])
-
-# # Fit data to files in the given directory (either human data or simulated agents)
-# for file_name in glob.glob(paths['agent_data_path'] + file_name_pattern)[0:4]:
-#     fit(sets, file_name,
-#         paths['fitted_data_path'],
-#         paths['heatmap_data_path'],
-#         paths['prob_switch_randomized_sequences'])
-
-# # Plot heatmaps to show how the fitting went
-# for agent_id in agent_ids:
-#     plot_heatmaps(sets, agent_id,
-#                   paths['heatmap_data_path'],
-#                   paths['heatmap_plot_path'])
-
-# Simulate data based on fitted parameters
-file_name_pattern = '*' + sets['learning_style'] + '*.csv'
-path = 'C:/Users/maria/MEGAsync/SLCN/PShumanDataCluster/fit_par/'  # paths['fitted_data_path']
-for file_name in glob.glob(path + file_name_pattern):
-    simulate_based_on_data(sets, file_name,
-                           paths['simulation_data_path'],
-                           paths['prob_switch_randomized_sequences'])
+# Guard against re-running the analyses when worker processes import this script
+if __name__ == '__main__':
+
+    # Interactive game
+    # interactive_game(sets, paths['prob_switch_randomized_sequences'])
+
+    # # Simulate random agents based on the model specified above
+    # for agent_id in agent_ids:
+    #     simulate(sets, agent_id,
+    #              paths['agent_data_path'],
+    #              paths['prob_switch_randomized_sequences'])
+
+    # # Fit data to files in the given directory (either human data or simulated agents); already fitted files are skipped
+    # fit_all(sets, get_shard(sorted(glob.glob(paths['agent_data_path'] + file_name_pattern)), config),
+    #         paths['fitted_data_path'],
+    #         paths['heatmap_data_path'],
+    #         paths['prob_switch_randomized_sequences'],
+    #         n_workers=sets['n_workers'])
+
+    # # Plot heatmaps to show how the fitting went
+    # for agent_id in agent_ids:
+    #     plot_heatmaps(sets, agent_id,
+    #                   paths['heatmap_data_path'],
+    #                   paths['heatmap_plot_path'])
+
+    # Simulate data based on fitted parameters
+    file_name_pattern = '*' + sets['learning_style'] + '*.csv'
+    path = paths['base_path'] + 'PShumanDataCluster/fit_par/'  # fits from the cluster; paths['fitted_data_path']
+    for file_name in get_shard(sorted(glob.glob(path + file_name_pattern)), config):
+        simulate_based_on_data(sets, file_name,
+                               paths['simulation_data_path'],
+                               paths['prob_switch_randomized_sequences'])
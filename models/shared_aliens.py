@@ -1,4 +1,5 @@
 import numpy as np
+from shared_softmax import softmax_with_epsilon
 import theano.tensor as T
 
 from theano.tensor.shared_randomstreams import RandomStreams
@@ -65,12 +66,12 @@ def update_Qs_sim(season, alien,
     # TS = season  # Flat
     # TS = 0  # fs
     # TS = Q_high_sub.argmax(axis=1)  # Hierarchical deterministic
-    TS = np.array([np.random.choice(a=n_TS, p=p_high_subj) for p_high_subj in p_high])  # Hierarchical softmax
+    TS = sample_choice(p_high)  # Hierarchical softmax
 
     # Calculate action probabilities based on TS and select action
     Q_low_sub = Q_low[np.arange(n_subj), TS, alien]  # Q_low_sub.shape -> [n_subj, n_actions]
     p_low = softmax(beta * Q_low_sub, axis=1)
-    action = [np.random.choice(range(n_actions), p=p_low_subj) for p_low_subj in p_low]
+    action = sample_choice(p_low)
     reward, correct = task.produce_reward(action)
 
     # Forget Q-values a little bit
@@ -103,6 +104,75 @@ def update_Qs_sim(season, alien,
     return [Q_low, Q_high, TS, action, correct, reward, p_low]
 
 
+def sample_choice(p):
+
+    # Inverse-CDF sampling: one option for each row of p (p.shape -> [n_subj, n_options]), all rows at once
+    rand = np.random.rand(p.shape[0], 1)
+    choice = np.sum(rand >= np.cumsum(p, axis=1), axis=1)
+    return np.minimum(choice, p.shape[1] - 1)  # guard against rounding errors in cumsum
+
+
+def simulate_aliens(task, n_trials,
+                    Q_low, Q_high,
+                    beta, beta_high, alpha, alpha_high, forget, forget_high,
+                    n_subj, n_actions, n_TS, verbose=False):
+
+    # Let all n_subj agents play all trials of task; trial-wise results have shape [n_trials, n_subj]
+    seasons = np.zeros([n_trials, n_subj], dtype=int)
+    TSs = np.zeros([n_trials, n_subj], dtype=int)
+    aliens = np.zeros([n_trials, n_subj], dtype=int)
+    actions = np.zeros([n_trials, n_subj], dtype=int)
+    rewards = np.zeros([n_trials, n_subj])
+    corrects = np.zeros([n_trials, n_subj])
+    p_lows = np.zeros([n_trials, n_subj, n_actions])
+    Q_highs = np.zeros([n_trials, n_subj])
+
+    for trial in range(n_trials):
+
+        # Observe stimuli
+        season, alien = task.present_stimulus(trial)
+        if verbose:
+            print("\n\tTRIAL {0}".format(trial))
+            print("season:", season)
+            print("alien:", alien)
+
+        # Select action & update Q-values
+        [Q_low, Q_high, TS, action, correct, reward, p_low] =\
+            update_Qs_sim(season, alien,
+                          Q_low, Q_high,
+                          beta, beta_high, alpha, alpha_high, forget, forget_high,
+                          n_subj, n_actions, n_TS, task, verbose=verbose)
+
+        # Store trial data
+        seasons[trial] = season
+        TSs[trial] = TS
+        aliens[trial] = alien
+        actions[trial] = action
+        rewards[trial] = reward
+        corrects[trial] = correct
+        Q_highs[trial] = Q_high[np.arange(n_subj), season, TS]
+        p_lows[trial] = p_low
+
+    return [Q_low, Q_high, seasons, TSs, aliens, actions, rewards, corrects, p_lows, Q_highs]
+
+
+def get_action_frequencies(sim_actions, n_subj, n_actions):
+
+    # Fraction of each subject's simulated agents (agents subj, subj + n_subj, ...) that chose each action
+    n_trials, n_sim = sim_actions.shape
+    sim_subj = np.arange(n_sim) % n_subj
+    idx = (sim_subj * n_trials + np.arange(n_trials)[:, np.newaxis]) * n_actions + sim_actions.astype(int)
+    counts = np.bincount(idx.flatten(), minlength=n_subj * n_trials * n_actions)
+    return counts.reshape([n_subj, n_trials, n_actions]) / (n_sim / n_subj)  # -> [n_subj, n_trials, n_actions]
+
+
+def get_action_likelihoods(action_frequencies, actions):
+
+    # Look up the frequency of each subject's actual action in each trial (actions.shape -> [n_trials, n_subj])
+    n_subj, n_trials, _ = action_frequencies.shape
+    return action_frequencies[np.arange(n_subj), np.arange(n_trials)[:, np.newaxis], actions.astype(int)]
+
+
 def update_Qs(season, alien, action, reward,
               Q_low, Q_high,
               beta, beta_high, alpha, alpha_high, forget, forget_high, n_subj, n_TS):
@@ -138,6 +208,112 @@ def update_Qs(season, alien, action, reward,
     return [Q_low, Q_high, TS, p_low]
 
 
+def update_Qs_marg(season, alien, action, reward,
+                   Q_low, Q_high,
+                   beta, beta_high, alpha, alpha_high, forget, forget_high, n_subj, n_TS, tensor=T):
+    """
+    Same as update_Qs, but instead of sampling one TS with RandomStreams, marginalizes over TSs: the action
+    probabilities are the mixture over TSs, weighted by p_TS = softmax(beta_high * Q_high[season]), and all TSs are
+    updated, weighted by p_TS (like alien_agents.Agent.learn). The likelihood is then deterministic (and smooth),
+    which NUTS needs for step-size adaptation. Works on theano tensors (tensor=T) and on numpy arrays (tensor=np).
+    Returns [Q_low, Q_high, p_TS, p_low]; p_TS.shape -> [n_subj, n_TS], p_low.shape -> [n_subj, n_actions].
+    """
+
+    def softmax_last_axis(X):
+        exp_X = tensor.exp(X - X.max(axis=-1, keepdims=True))
+        return exp_X / exp_X.sum(axis=-1, keepdims=True)
+
+    # TS probabilities
+    Q_high_sub = Q_high[tensor.arange(n_subj), season]  # Q_high_sub.shape -> [n_subj, n_TS]
+    p_TS = softmax_last_axis(beta_high * Q_high_sub)
+
+    # Action probabilities: mixture of each TS's softmax
+    Q_low_alien = Q_low.transpose(0, 2, 3, 1)[tensor.arange(n_subj), alien]  # -> [n_subj, n_actions, n_TS]
+    p_low_TS = softmax_last_axis(beta.reshape((n_subj, 1, 1)) * Q_low_alien.transpose(0, 2, 1))  # [n_subj, n_TS, n_a]
+    p_low = (p_TS.reshape((n_subj, n_TS, 1)) * p_low_TS).sum(axis=1)
+
+    # Forget Q-values a little bit
+    Q_low = (1 - forget) * Q_low + forget * alien_initial_Q
+    Q_high = (1 - forget_high) * Q_high + forget_high * alien_initial_Q
+
+    # Calculate RPEs & update Q-values of all TSs, weighted by p_TS
+    current_trial_high = tensor.arange(n_subj), season
+    RPE_high = reward.reshape((n_subj, 1)) - Q_high[current_trial_high]  # RPE_high.shape -> [n_subj, n_TS]
+    high_update = alpha_high.reshape((n_subj, 1)) * p_TS * RPE_high
+
+    Q_low_t = Q_low.transpose(0, 2, 3, 1)  # Q_low_t.shape -> [n_subj, n_aliens, n_actions, n_TS]
+    current_trial_low = tensor.arange(n_subj), alien, action
+    RPE_low = reward.reshape((n_subj, 1)) - Q_low_t[current_trial_low]  # RPE_low.shape -> [n_subj, n_TS]
+    low_update = alpha.reshape((n_subj, 1)) * p_TS * RPE_low
+
+    if tensor is np:
+        Q_high = Q_high.copy()
+        Q_high[current_trial_high] += high_update
+        Q_low_t = Q_low_t.copy()
+        Q_low_t[current_trial_low] += low_update
+    else:
+        Q_high = T.inc_subtensor(Q_high[current_trial_high], high_update)
+        Q_low_t = T.inc_subtensor(Q_low_t[current_trial_low], low_update)
+    Q_low = Q_low_t.transpose(0, 3, 1, 2)
+
+    return [Q_low, Q_high, p_TS, p_low]
+
+
+def get_flat_Q_pairs(seasons, aliens, actions):
+    """
+    Data-only part of get_flat_Q_low_sub (call once, outside the model).
+    For each trial t and subject, find the earlier trials i whose update touched one of the Q-values that the flat
+    agent (TS = season) reads in trial t, i.e., same season and alien. Returns index arrays (one entry per pair):
+    [trial t, subject, trial i, action of trial i, forgetting steps between i and t, later updates of that Q-value].
+    """
+
+    n_trials, n_subj = seasons.shape
+    pairs = []
+    for subj in range(n_subj):
+
+        # Q-values (season, alien) that are read and Q-values (season, alien, action) that are updated in each trial
+        _, read_cell = np.unique(np.array([seasons[:, subj], aliens[:, subj]]).T, axis=0, return_inverse=True)
+        _, update_cell = np.unique(np.array([seasons[:, subj], aliens[:, subj], actions[:, subj]]).T, axis=0,
+                                   return_inverse=True)
+        read_cell, update_cell = read_cell.flatten(), update_cell.flatten()
+
+        # Number of updates of each Q-value up to and including each trial
+        n_updates = np.cumsum(np.eye(update_cell.max() + 1, dtype=int)[update_cell], axis=0)
+
+        # Earlier trials that updated one of the Q-values read in trial t
+        earlier = np.arange(n_trials)[:, np.newaxis] > np.arange(n_trials)
+        t, i = np.nonzero((read_cell[:, np.newaxis] == read_cell) & earlier)
+        pairs.append([t, np.full(len(t), subj), i, actions[i, subj],
+                      t - 1 - i,  # forgetting steps between the update in trial i and reading in trial t
+                      n_updates[t - 1, update_cell[i]] - n_updates[i, update_cell[i]]])  # later updates of the Q-value
+
+    return [np.concatenate(column).astype('int32') for column in zip(*pairs)]
+
+
+def get_flat_Q_low_sub(pairs, rewards, alpha, forget, n_trials, n_subj, n_actions, tensor=T):
+    """
+    Q_low[trial, subj, season, alien] of the flat agent with forgetting (TS = season) before each trial, without scan.
+    Forgetting and updates make each Q-value an affine recurrence, Q - Q0 <- (1 - forget) * (Q - Q0), and
+    Q - Q0 <- (1 - alpha) * (Q - Q0) + alpha * (reward - Q0) for the updated Q-value, so each earlier update adds
+    alpha * (reward - Q0) * (1 - alpha) ** n_later_updates * (1 - forget) ** n_forgetting_steps.
+    pairs comes from get_flat_Q_pairs; alpha and forget have shape [n_subj]; works with tensor=T and tensor=np.
+    Returns Q-values of shape [n_trials, n_subj, n_actions], the same as the scan-based Q_low[t, subj, season, alien].
+    """
+
+    trial, subj, update_trial, action, n_forgetting_steps, n_later_updates = pairs
+    alpha, forget = alpha[subj], forget[subj]
+    contributions = alpha * (rewards[update_trial, subj] - alien_initial_Q) * \
+        (1 - alpha) ** n_later_updates * (1 - forget) ** n_forgetting_steps
+
+    # Sum up contributions for each trial, subject, and action
+    if tensor is np:
+        Q_low_sub = np.zeros([n_trials, n_subj, n_actions])
+        np.add.at(Q_low_sub, (trial, subj, action), contributions)
+    else:
+        Q_low_sub = T.inc_subtensor(T.zeros([n_trials, n_subj, n_actions])[trial, subj, action], contributions)
+    return alien_initial_Q + Q_low_sub
+
+
 def split_subj_in_half(n_subj):
 
     half_of_subj = np.arange(0, n_subj, 2)  # np.random.choice(range(n_subj), size=int(np.ceil(n_subj / 2)), replace=False)
@@ -170,17 +346,8 @@ def softmax(X, axis=None):
     if axis is None:
         axis = next(j[0] for j in enumerate(y.shape) if j[1] > 1)
 
-    # subtract the max for numerical stability
-    y = y - np.expand_dims(np.max(y, axis=axis), axis)
-
-    # exponentiate y
-    y = np.exp(y)
-
-    # take the sum along the specified axis
-    ax_sum = np.expand_dims(np.sum(y, axis=axis), axis)
-
-    # finally: divide elementwise
-    p = y / ax_sum
+    # softmax along axis (shared kernel, no epsilon noise)
+    p = softmax_with_epsilon(y, axis=axis)
 
     # flatten if X was 1D
     if len(X.shape) == 1: p = p.flatten()
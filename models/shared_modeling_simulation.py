@@ -1,5 +1,9 @@
+import os
+
 import numpy as np
+from shared_softmax import softmax_with_epsilon
 import theano.tensor as T
+from slcn_config import get_config
 
 
 alien_initial_Q = 5 / 3
@@ -7,41 +11,57 @@ alien_initial_Q = 5 / 3
 
 def get_paths(run_on_cluster):
 
-    if run_on_cluster:
-        base_path = '/home/bunge/maria/Desktop/'
-        return {'human data': base_path + '/PShumanData/',
-                'fitting results': base_path + '/PSPyMC3/fitting/',
-                'SLCN info': base_path + '/PSPyMC3/SLCNinfo2.csv',
-                'simulations': base_path + 'PSPyMC3/PSsimulations/',
-                'old simulations': base_path + '/PShumanData/fit_par/',
-                'PS task info': base_path + '/ProbabilisticSwitching/Prerandomized sequences/'}
+    # Base folders and single paths can be set in the config (ps_data_root, [ps_paths]). ps_data_root is the folder
+    # with PShumanData/, PSPyMC3/, and ProbabilisticSwitching/ (the cluster layout, also used by main.get_paths) on
+    # every machine; without it, the default folders of the cluster or the laptop are used.
+    config = get_config()
+    if run_on_cluster or 'ps_data_root' in config:
+        base_path = os.path.join(config.get('ps_data_root', '/home/bunge/maria/Desktop/'), '')
+        paths = {'human data': base_path + '/PShumanData/',
+                 'fitting results': base_path + '/PSPyMC3/fitting/',
+                 'SLCN info': base_path + '/PSPyMC3/SLCNinfo2.csv',
+                 'simulations': base_path + 'PSPyMC3/PSsimulations/',
+                 'old simulations': base_path + '/PShumanData/fit_par/',
+                 'PS task info': base_path + '/ProbabilisticSwitching/Prerandomized sequences/'}
 
     else:
         base_path = 'C:/Users/maria/MEGAsync/SLCN'
-        return {'human data': base_path + 'data/ProbSwitch/',
-                'fitting results': base_path + '/PShumanData/fitting/',
-                'SLCN info': base_path + 'data/SLCNinfo2.csv',
-                'PS reward versions': base_path + 'data/ProbSwitch_rewardversions.csv',
-                'ages': base_path + 'data/ages.csv',
-                'simulations': base_path + '/PSsimulations/',
-                'old simulations': base_path + '/PSGenRecCluster/fit_par/',
-                'PS task info': base_path + '/ProbabilisticSwitching/Prerandomized sequences/'}
+        paths = {'human data': base_path + 'data/ProbSwitch/',
+                 'fitting results': base_path + '/PShumanData/fitting/',
+                 'SLCN info': base_path + 'data/SLCNinfo2.csv',
+                 'PS reward versions': base_path + 'data/ProbSwitch_rewardversions.csv',
+                 'ages': base_path + 'data/ages.csv',
+                 'simulations': base_path + '/PSsimulations/',
+                 'old simulations': base_path + '/PSGenRecCluster/fit_par/',
+                 'PS task info': base_path + '/ProbabilisticSwitching/Prerandomized sequences/'}
+
+    paths.update(config.get('ps_paths', {}))
+    return paths
 
 
 def get_alien_paths(run_on_cluster):
 
-    if run_on_cluster:
-        base_path = '/home/bunge/maria/Desktop/'
-        return {'human data': base_path + '/AlienshumanData/',
-                'fitting results': base_path + '/AliensPyMC3/fitting/',
-                'simulations': base_path + 'AliensPyMC3/Aliensimulations/'}
+    # Base folders and single paths can be set in the config (aliens_data_root, [aliens_paths]). aliens_data_root is
+    # the folder with AlienshumanData/ and AliensPyMC3/ (the cluster layout, also used by main.get_paths) on every
+    # machine; without it, the default folders of the cluster or the laptop are used.
+    config = get_config()
+    if run_on_cluster or 'aliens_data_root' in config:
+        base_path = os.path.join(config.get('aliens_data_root', '/home/bunge/maria/Desktop/'), '')
+        paths = {'human data': base_path + '/AlienshumanData/',
+                 'task sequences': base_path + '/AlienshumanData/',  # raw (jsPsych) files of version 3.1
+                 'fitting results': base_path + '/AliensPyMC3/fitting/',
+                 'simulations': base_path + 'AliensPyMC3/Aliensimulations/'}
 
     else:
         base_path = 'C:/Users/maria/MEGAsync/Berkeley/TaskSets'
-        return {'human data': base_path + '/Data/versions1.0and3.1/',
-                'human data prepr': base_path + '/Data/version3.1preprocessed/',
-                'fitting results': base_path + '/AliensFitting/',
-                'simulations': 'C:/Users/maria/MEGAsync/SLCN/PSsimulations/'}
+        paths = {'human data': base_path + '/Data/versions1.0and3.1/',
+                 'human data prepr': base_path + '/Data/version3.1preprocessed/',
+                 'task sequences': base_path + '/Data/version3.1/',
+                 'fitting results': base_path + '/AliensFitting/',
+                 'simulations': 'C:/Users/maria/MEGAsync/SLCN/PSsimulations/'}
+
+    paths.update(config.get('aliens_paths', {}))
+    return paths
 
 
 def p_from_Q(Q_left, Q_right, beta, eps):
@@ -71,6 +91,37 @@ def update_Q(reward, choice, Q_left, Q_right, alpha, nalpha, calpha, cnalpha):
     return Q_left + alpha_left * RPE, Q_right + alpha_right * RPE
 
 
+def update_Q_prefix(rewards, choices, Q_left, Q_right, alpha, nalpha, calpha, cnalpha, n_trials, tensor=T):
+    """
+    Same Q-values as theano.scan over update_Q (shape [n_trials, n_subj]), but computed in log2(n_trials) steps:
+    Once rewards and choices are known, each trial's update is an affine map Q -> A Q + b of (Q_left, Q_right),
+    so all trials can be combined with a parallel prefix (Hillis-Steele) scan over the composed maps.
+    Works on theano tensors (tensor=T) and on numpy arrays (tensor=np); n_trials must be a python int.
+    """
+
+    # Read off each trial's affine map from update_Q: b = update(0, 0); columns of A = update(1, 0) - b, update(0, 1) - b
+    b_l, b_r = update_Q(rewards, choices, 0, 0, alpha, nalpha, calpha, cnalpha)
+    a_ll, a_rl = update_Q(rewards, choices, 1, 0, alpha, nalpha, calpha, cnalpha)
+    a_lr, a_rr = update_Q(rewards, choices, 0, 1, alpha, nalpha, calpha, cnalpha)
+    a_ll, a_rl, a_lr, a_rr = a_ll - b_l, a_rl - b_r, a_lr - b_l, a_rr - b_r
+
+    # Compose each trial's map with the map that ends `shift` trials earlier (identity before the first trial)
+    shift = 1
+    while shift < n_trials:
+        def earlier(X, pad):
+            return tensor.concatenate([pad * tensor.ones_like(X[:shift]), X[:-shift]], axis=0)
+        e_ll, e_lr, e_rl, e_rr = earlier(a_ll, 1), earlier(a_lr, 0), earlier(a_rl, 0), earlier(a_rr, 1)
+        e_l, e_r = earlier(b_l, 0), earlier(b_r, 0)
+        a_ll, a_lr, a_rl, a_rr, b_l, b_r = \
+            a_ll * e_ll + a_lr * e_rl, a_ll * e_lr + a_lr * e_rr, \
+            a_rl * e_ll + a_rr * e_rl, a_rl * e_lr + a_rr * e_rr, \
+            a_ll * e_l + a_lr * e_r + b_l, a_rl * e_l + a_rr * e_r + b_r
+        shift *= 2
+
+    # Apply the cumulative maps to the initial Q-values
+    return a_ll * Q_left + a_lr * Q_right + b_l, a_rl * Q_left + a_rr * Q_right + b_r
+
+
 def get_likelihoods(rewards, choices, p_reward, p_noisy):
 
     # p(r=r|choice=correct): Likelihood of outcome (reward 0 or 1) if choice was correct:
@@ -149,17 +200,8 @@ def softmax(X, axis=None):
     if axis is None:
         axis = next(j[0] for j in enumerate(y.shape) if j[1] > 1)
 
-    # subtract the max for numerical stability
-    y = y - np.expand_dims(np.max(y, axis=axis), axis)
-
-    # exponentiate y
-    y = np.exp(y)
-
-    # take the sum along the specified axis
-    ax_sum = np.expand_dims(np.sum(y, axis=axis), axis)
-
-    # finally: divide elementwise
-    p = y / ax_sum
+    # softmax along axis (shared kernel, no epsilon noise)
+    p = softmax_with_epsilon(y, axis=axis)
 
     # flatten if X was 1D
     if len(X.shape) == 1: p = p.flatten()
@@ -0,0 +1,29 @@
+import numpy as np
+
+
+# Set to True to check probabilities after every call (slow; use for debugging only)
+debug = False
+
+
+def softmax_with_epsilon(Q, beta=1., epsilon=0., n_options=None, axis=-1):
+    """
+    Translate values into choice probabilities: p = epsilon / n_options + (1 - epsilon) * softmax(beta * Q).
+
+    Works on arrays of any batch shape; the softmax is taken along axis.
+    beta and epsilon can be scalars or arrays that broadcast against Q.
+    n_options (optional): number of options the epsilon noise is spread over. Default = Q.shape[axis].
+    """
+
+    # Subtract the max for numerical stability, exponentiate, and normalize
+    y = beta * np.asarray(Q, dtype=float)
+    y = np.exp(y - np.max(y, axis=axis, keepdims=True))
+    p = y / np.sum(y, axis=axis, keepdims=True)
+
+    # Add epsilon noise
+    if n_options is None:
+        n_options = p.shape[axis]
+    p = epsilon / n_options + (1 - epsilon) * p
+
+    if debug:
+        assert np.all(np.round(np.sum(p, axis=axis), 3) == 1), 'Error in softmax_with_epsilon: probabilities must sum to 1.'
+    return p
@@ -0,0 +1,123 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+
+
+# Settings that can be given in the config file, as environment variables (SLCN_<NAME>), or on the command line.
+# Scripts look up each setting with config.get(name, <script default>), so unset settings keep the script's value.
+setting_names = ['run_on_cluster',
+                 'ps_data_root',  # folder with PShumanData/, PSPyMC3/, ... (replaces the laptop / cluster folders)
+                 'aliens_data_root',  # folder with AlienshumanData/, AliensPyMC3/, ...
+                 'cache_dir',  # where columnar caches of csv data are stored (e.g., on a local SSD)
+                 'scratch_dir',  # where temporary files go
+                 'compile_dir',  # where Theano keeps compiled models across jobs (see compile_cache.py)
+                 'trace_dir',  # where PyMC3 scripts stream their draws while sampling (see chunked_trace.py)
+                 'n_cores',
+                 'n_chains',
+                 'n_samples',
+                 'n_tune',
+                 'n_workers',  # processes used by the maximum-likelihood fitting in run_main.py
+                 'minimizer',  # fitter of run_main.py: 'basinhopping' (default), 'L-BFGS-B', or 'DE'
+                 'shard',  # index of this job when one analysis is split across several nodes
+                 'n_shards']  # number of jobs the analysis is split into
+path_section_names = ['ps_paths', 'aliens_paths']  # tables that override single entries of get_paths, get_alien_paths
+
+default_config_files = [os.path.join(os.path.dirname(os.path.abspath(__file__)), 'slcn_config.toml'),
+                        os.path.join(os.path.dirname(os.path.abspath(__file__)), 'slcn_config.yaml')]
+
+config = None  # loaded once per process by get_config
+
+
+def get_config(argv=None):
+    """
+    Settings for all entry scripts. Later sources override earlier ones:
+    config file (--config, $SLCN_CONFIG, or slcn_config.toml / .yaml next to this file) < environment variables
+    (e.g., SLCN_N_CORES=8) < command line (e.g., --n_cores 8, or --set cache_dir=/scratch/cache).
+    Only settings that were given appear in the result.
+    """
+
+    global config
+    if config is not None and argv is None:
+        return config
+
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+
+    # Config file
+    config_file = args.config or os.environ.get('SLCN_CONFIG')
+    if not config_file:
+        config_file = next((file_name for file_name in default_config_files if os.path.isfile(file_name)), None)
+    new_config = read_config_file(config_file) if config_file else {}
+    unknown = [name for name in new_config if name not in setting_names + path_section_names]
+    assert not unknown, 'Unknown settings {0} in config file {1}. Allowed are {2}.'.\
+        format(unknown, config_file, setting_names + path_section_names)
+
+    # Environment variables
+    for name in setting_names:
+        if 'SLCN_' + name.upper() in os.environ:
+            new_config[name] = parse_value(os.environ['SLCN_' + name.upper()])
+
+    # Command line
+    for name in setting_names:
+        if getattr(args, name) is not None:
+            new_config[name] = parse_value(getattr(args, name))
+    for assignment in args.set:
+        name, value = assignment.split('=', 1)
+        assert name in setting_names, 'Unknown setting "{0}". Allowed are {1}.'.format(name, setting_names)
+        new_config[name] = parse_value(value)
+
+    # Settings of this process; temporary files go to the scratch folder
+    if argv is None:
+        config = new_config
+        if config.get('scratch_dir'):
+            if not os.path.isdir(config['scratch_dir']):
+                os.makedirs(config['scratch_dir'])
+            tempfile.tempdir = config['scratch_dir']
+    return new_config
+
+
+def parse_args(argv):
+
+    # Unknown arguments are ignored, such that scripts can still have their own command line options
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument('--config', default=None, help='TOML or YAML config file')
+    for name in setting_names:
+        parser.add_argument('--' + name, default=None)
+    parser.add_argument('--set', action='append', default=[], help='name=value; can be given several times')
+    return parser.parse_known_args(argv)[0]
+
+
+def read_config_file(file_name):
+
+    if file_name.endswith(('.yaml', '.yml')):
+        import yaml  # optional dependency; only needed for YAML config files
+        with open(file_name) as f:
+            return yaml.safe_load(f) or {}
+    try:
+        import tomllib  # python >= 3.11
+        with open(file_name, 'rb') as f:
+            return tomllib.load(f)
+    except ImportError:
+        import toml
+        with open(file_name) as f:
+            return toml.load(f)
+
+
+def parse_value(value):
+
+    # Values from environment variables and the command line are strings; read numbers and booleans
+    if not isinstance(value, str):
+        return value
+    if value.lower() in ['true', 'false']:
+        return value.lower() == 'true'
+    try:
+        return json.loads(value)
+    except ValueError:
+        return value
+
+
+def get_shard(items, config):
+
+    # The part of items that this job works on when the analysis is split into n_shards jobs (every n_shards-th item)
+    return list(items)[config.get('shard', 0)::config.get('n_shards', 1)]
@@ -0,0 +1,314 @@
+import json
+import os
+import pickle
+
+import numpy as np
+import pandas as pd
+
+
+# Traces are read from folders in the chunked_trace layout (run.json, chain_<c>/meta.json, chain_<c>/<name>.bin).
+# Folders of sample_chunked are read directly; fits save their draws as such a folder (save_fit), and pickled trace
+# bundles of older fits (<file_name>.pickle with 'trace', 'model', and 'summary') are converted once into
+# <file_name>_trace/ (see open_trace). Models are not pickled but rebuilt from run.json's model_spec and data.npz.
+
+
+class TraceReader(object):
+    """
+    Memory-mapped, read-only trace: only the variables and draws that are asked for are loaded from disk. Mirrors
+    the parts of pymc3's MultiTrace that the analysis and simulation scripts use (trace['beta'], trace.get_values,
+    trace.varnames, trace.stat_names, ...), such that pymc3's plotting functions accept it as well.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.run = read_json(os.path.join(directory, 'run.json'))
+        self.model_spec = self.run.get('model_spec')
+        self.chains = [chain for chain in range(self.run['chains']) if os.path.isfile(get_meta_file(directory, chain))]
+        metas = [read_json(get_meta_file(directory, chain)) for chain in self.chains]
+        self.draw_idxs = {chain: get_posterior_draw_idxs(self.run, meta['n_draws'])
+                          for chain, meta in zip(self.chains, metas)}
+        n_posterior = min(len(draw_idxs) for draw_idxs in self.draw_idxs.values())  # chains stopped early can differ
+        self.draw_idxs = {chain: draw_idxs[:n_posterior] for chain, draw_idxs in self.draw_idxs.items()}
+        self.n_draws = {chain: meta['n_draws'] for chain, meta in zip(self.chains, metas)}
+
+        # Variables and sampler stats (stats are stored per sampler as sampler<i>_<name>)
+        self.files = {name: [tuple(shape), np.dtype(dtype)] for name, shape, dtype in metas[0]['vars']}
+        self.varnames = [name for name, shape, dtype in metas[0]['vars']]
+        self.stat_files = {}
+        for sampler_idx, stats in enumerate(metas[0]['sampler_stats']):
+            for stat_name, dtype in stats:
+                self.files['sampler{0}_{1}'.format(sampler_idx, stat_name)] = [(), np.dtype(dtype)]
+                self.stat_files.setdefault(stat_name, []).append('sampler{0}_{1}'.format(sampler_idx, stat_name))
+        self.stat_names = set(self.stat_files)
+
+    @property
+    def nchains(self):
+        return len(self.chains)
+
+    def __len__(self):
+        return len(self.draw_idxs[self.chains[0]])
+
+    def __getitem__(self, varname):
+        return self.get_values(varname)
+
+    def get_shape(self, varname):
+        return self.files[varname][0]
+
+    def read(self, name, chain):
+
+        # All draws of variable or stat file name in chain, including tuning draws (memory-mapped, nothing loaded yet)
+        shape, dtype = self.files[name]
+        file_name = os.path.join(self.directory, 'chain_{0}'.format(chain), name + '.bin')
+        return np.memmap(file_name, dtype=dtype, mode='r', shape=(self.n_draws[chain],) + shape)
+
+    def get_values(self, varname, burn=0, thin=1, combine=True, chains=None, squeeze=True, idx=()):
+        """
+        Posterior draws of varname (or of a sampler stat) like MultiTrace.get_values. idx selects elements of the
+        variable (e.g., idx=(slice(0, 10),) for the first ten subjects), such that only those are read from disk.
+        """
+
+        if varname in self.stat_files and varname not in self.varnames:
+            return self.get_sampler_stats(varname, burn, thin, combine, chains, squeeze)
+        chains = self.chains if chains is None else np.atleast_1d(chains)
+        values = []
+        for chain in chains:
+            draw_idxs = self.draw_idxs[chain][burn::thin]
+            if any(isinstance(i, np.ndarray) for i in idx):
+                draw_idxs = draw_idxs[:, None]  # broadcast against index arrays of the elements
+            values.append(self.read(varname, chain)[(draw_idxs,) + tuple(idx)])
+        if combine:
+            return np.concatenate(values)
+        return values[0] if squeeze and len(values) == 1 else values
+
+    def get_sampler_stats(self, varname, burn=0, thin=1, combine=True, chains=None, squeeze=True):
+        chains = self.chains if chains is None else np.atleast_1d(chains)
+        values = []
+        for chain in chains:
+            draw_idxs = self.draw_idxs[chain][burn::thin]
+            stats = [self.read(name, chain)[draw_idxs] for name in self.stat_files[varname]]
+            values.append(stats[0] if len(stats) == 1 else np.column_stack(stats))
+        if combine:
+            return np.concatenate(values)
+        return values[0] if squeeze and len(values) == 1 else values
+
+    def get_draw(self, varname, draw):
+
+        # Draw number draw of the posterior draws of all chains (counted like in trace[varname])
+        for chain in self.chains:
+            if draw < len(self.draw_idxs[chain]):
+                return np.array(self.read(varname, chain)[self.draw_idxs[chain][draw]])
+            draw -= len(self.draw_idxs[chain])
+        raise IndexError('The trace in {0} has fewer draws.'.format(self.directory))
+
+    def iter_points(self, chunk_size=100):
+
+        # All posterior draws as pymc3 points ({varname: value}), reading chunk_size draws of each variable at a time
+        for chain in self.chains:
+            draw_idxs = self.draw_idxs[chain]
+            for start in range(0, len(draw_idxs), chunk_size):
+                chunk = {varname: np.array(self.read(varname, chain)[draw_idxs[start:start + chunk_size]])
+                         for varname in self.varnames}
+                for i in range(len(chunk[self.varnames[0]])):
+                    yield {varname: values[i] for varname, values in chunk.items()}
+
+    def load_model(self):
+
+        # The sampled pymc3 model, rebuilt from model_spec with its data set to data.npz (the model is shared within
+        # the process, see model_factory.get_model); converted old bundles have their pickled model instead
+        if self.model_spec is not None and os.path.isfile(os.path.join(self.directory, 'data.npz')):
+            from model_factory import get_model_from_spec, set_data  # imports theano, which reading does not need
+            model, data = get_model_from_spec(self.model_spec)
+            with np.load(os.path.join(self.directory, 'data.npz')) as data_arrays:
+                set_data(data, **data_arrays)
+            return model
+        file_name = os.path.join(self.directory, 'model.pickle')
+        if not os.path.isfile(file_name):
+            return None
+        with open(file_name, 'rb') as handle:
+            return pickle.load(handle)
+
+
+def open_trace(file_name):
+    """
+    TraceReader of a fit: file_name is a trace folder (e.g., the trace_dir of sample_chunked) or the fitting results
+    path without extension, whose <file_name>.pickle names the trace folder (save_fit). Old bundles in
+    <file_name>.pickle are converted into <file_name>_trace/ the first time (unpickled this once; as their model
+    cannot be rebuilt, it goes to <file_name>_trace/model.pickle).
+    """
+
+    if os.path.isfile(os.path.join(file_name, 'run.json')):
+        return TraceReader(file_name)
+    directory = file_name + '_trace'
+    if not os.path.isfile(os.path.join(directory, 'run.json')):
+        with open(file_name + '.pickle', 'rb') as handle:
+            data = pickle.load(handle)
+        if 'trace_dir' in data:
+            return TraceReader(data['trace_dir'])
+        print("Converting {0}.pickle into a trace folder (only done once)...".format(file_name))
+        export_trace(data['trace'], directory, data.get('model_spec'))
+        if data.get('model') is not None:
+            with open(os.path.join(directory, 'model.pickle'), 'wb') as handle:
+                pickle.dump(data['model'], handle, protocol=pickle.HIGHEST_PROTOCOL)
+    return TraceReader(directory)
+
+
+def save_fit(file_name, summary, trace=None, model_spec=None, data_arrays=None, trace_dir=None):
+    """
+    Save the results of a fit: the draws go to trace_dir (a folder written by sample_chunked), or else trace is
+    exported to <file_name>_trace/ with model_spec and data_arrays; <file_name>.pickle holds the summary and the
+    trace folder (read with open_trace(file_name)).
+    """
+
+    if trace_dir is None:
+        trace_dir = file_name + '_trace'
+        export_trace(trace, trace_dir, model_spec, data_arrays)
+    with open(file_name + '.pickle', 'wb') as handle:
+        pickle.dump({'trace_dir': trace_dir, 'model_spec': model_spec, 'summary': summary},
+                    handle, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def export_trace(trace, directory, model_spec=None, data_arrays=None):
+
+    # Write a pymc3 MultiTrace (all draws are posterior draws) into directory, in the chunked_trace layout
+    for chain in trace.chains:
+        strace = trace._straces[chain]
+        chain_dir = os.path.join(directory, 'chain_{0}'.format(chain))
+        if not os.path.isdir(chain_dir):
+            os.makedirs(chain_dir)
+        meta = {'n_draws': len(strace), 'vars': [], 'sampler_stats': []}
+        for varname in trace.varnames:
+            values = np.asarray(strace.get_values(varname))
+            values.tofile(os.path.join(chain_dir, varname + '.bin'))
+            meta['vars'].append([varname, list(values.shape[1:]), values.dtype.str])
+        for sampler_idx, sampler_vars in enumerate(strace.sampler_vars or []):
+            meta['sampler_stats'].append([])
+            for stat_name in sampler_vars:
+                values = np.asarray(strace.get_sampler_stats(stat_name, sampler_idx))
+                values.tofile(os.path.join(chain_dir, 'sampler{0}_{1}.bin'.format(sampler_idx, stat_name)))
+                meta['sampler_stats'][-1].append([stat_name, values.dtype.str])
+        write_json(os.path.join(chain_dir, 'meta.json'), meta)
+    write_json(os.path.join(directory, 'run.json'),
+               {'draws': len(trace), 'tune': 0, 'chains': max(trace.chains) + 1, 'tuning_draws': [],
+                'model_spec': model_spec})
+    if data_arrays is not None:
+        np.savez(os.path.join(directory, 'data.npz'), **data_arrays)
+
+
+def summarize(trace, varnames=None, chunk_size=100):
+    """
+    Summary of the posterior (mean, sd, 2.5% and 97.5% quantiles, and Gelman-Rubin Rhat for several chains) with
+    the row names of pm.summary ('beta__0', ...). Reads chunk_size elements of one variable at a time.
+    """
+
+    if varnames is None:
+        varnames = [varname for varname in trace.varnames if not varname.endswith('__')]  # without transformed ones
+    rows = []
+    for varname in varnames:
+        shape = trace.get_shape(varname)
+        n_elements = int(np.prod(shape))
+        for start in range(0, n_elements, chunk_size):
+            elements = np.arange(start, min(start + chunk_size, n_elements))
+            idx = np.unravel_index(elements, shape) if shape else ()
+            values = np.array(trace.get_values(varname, combine=False, squeeze=False, idx=idx))  # [chain, draw, elem]
+            values = values.reshape(values.shape[:2] + (len(elements),))
+            summary = pd.DataFrame({'mean': values.mean(axis=(0, 1)),
+                                    'sd': values.reshape(-1, len(elements)).std(axis=0),
+                                    'q2.5': np.percentile(values, 2.5, axis=(0, 1)),
+                                    'q97.5': np.percentile(values, 97.5, axis=(0, 1))},
+                                   index=[get_flat_name(varname, shape, element) for element in elements])
+            if values.shape[0] > 1:
+                summary['Rhat'] = get_rhat(values)
+            rows.append(summary)
+    return pd.concat(rows)
+
+
+def get_flat_name(varname, shape, element):
+    if not shape:
+        return varname
+    return varname + '__' + '_'.join(str(i) for i in np.unravel_index(element, shape))
+
+
+def get_rhat(values):
+
+    # Gelman-Rubin statistic of values with shape [n_chains, n_draws, n_elements]
+    n_draws = values.shape[1]
+    within = values.var(axis=1, ddof=1).mean(axis=0)
+    between = n_draws * values.mean(axis=1).var(axis=0, ddof=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.sqrt(((n_draws - 1) / n_draws * within + between / n_draws) / within)
+
+
+def waic(trace, model, chunk_size=100):
+    """
+    WAIC of model (like pm.waic), computed in one pass over the draws: per observation, only a running log-sum-exp
+    and the running mean and variance of the log likelihood are kept, instead of the full [draws, observations]
+    log likelihood matrix. Returns a Series with WAIC, WAIC_se, p_WAIC, var_warn, and the pointwise waic_i.
+    """
+
+    # Running sums over draws for each observation (Welford's algorithm for the variance)
+    log_lik_fns = [observed.logp_elemwise for observed in model.observed_RVs]
+    n_draws, log_sum_lik, mean_log_lik, m2_log_lik = 0, None, None, None
+    for point in trace.iter_points(chunk_size):
+        log_lik = np.concatenate([np.ravel(log_lik_fn(point)) for log_lik_fn in log_lik_fns])
+        if n_draws == 0:
+            log_sum_lik, mean_log_lik, m2_log_lik = log_lik.copy(), np.zeros_like(log_lik), np.zeros_like(log_lik)
+        else:
+            log_sum_lik = np.logaddexp(log_sum_lik, log_lik)
+        n_draws += 1
+        delta = log_lik - mean_log_lik
+        mean_log_lik += delta / n_draws
+        m2_log_lik += delta * (log_lik - mean_log_lik)
+
+    # WAIC = -2 * (lppd - p_WAIC), per observation and summed
+    lppd_i = log_sum_lik - np.log(n_draws)
+    p_waic_i = m2_log_lik / n_draws  # variance with ddof=0, like pm.waic
+    waic_i = -2 * (lppd_i - p_waic_i)
+    return pd.Series({'WAIC': np.sum(waic_i), 'WAIC_se': np.sqrt(len(waic_i) * np.var(waic_i)),
+                      'p_WAIC': np.sum(p_waic_i), 'var_warn': int(np.any(p_waic_i > 0.4)), 'waic_i': waic_i})
+
+
+def compare_waic(waics):
+    """
+    Model comparison table like pm.compare (columns WAIC, pWAIC, dWAIC, weight, SE, dSE, var_warn; best model first)
+    from the waic results of several models ({model_name: waic(...)}). Weights are Akaike-type (pseudo-BMA).
+    """
+
+    best_waic_i = min(waics.values(), key=lambda w: w['WAIC'])['waic_i']
+    comparison = pd.DataFrame({name: {'WAIC': w['WAIC'], 'pWAIC': w['p_WAIC'], 'SE': w['WAIC_se'],
+                                      'var_warn': w['var_warn'],
+                                      'dSE': np.sqrt(len(w['waic_i']) * np.var(w['waic_i'] - best_waic_i))}
+                               for name, w in waics.items()}).T.sort_values('WAIC')
+    comparison['dWAIC'] = comparison['WAIC'] - comparison['WAIC'].min()
+    weights = np.exp(-0.5 * comparison['dWAIC'].astype(float))
+    comparison['weight'] = weights / weights.sum()
+    return comparison[['WAIC', 'pWAIC', 'dWAIC', 'weight', 'SE', 'dSE', 'var_warn']]
+
+
+def get_meta_file(directory, chain):
+    return os.path.join(directory, 'chain_{0}'.format(chain), 'meta.json')
+
+
+def get_posterior_draw_idxs(run, n_draws):
+
+    # All draws that are not in one of the tuning ranges of run.json
+    is_posterior = np.ones(n_draws, dtype=bool)
+    for first, last in run['tuning_draws']:
+        is_posterior[first:last] = False
+    return np.flatnonzero(is_posterior)
+
+
+def read_json(file_name):
+    with open(file_name) as f:
+        return json.load(f)
+
+
+def write_json(file_name, content):
+    write_atomic(file_name, json.dumps(content, indent=1).encode())
+
+
+def write_atomic(file_name, content):
+
+    # Write to a temporary file and rename, such that an interrupted job never leaves a half-written file
+    with open(file_name + '.tmp', 'wb') as f:
+        f.write(content)
+    os.replace(file_name + '.tmp', file_name)